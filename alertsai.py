@@ -3,10 +3,12 @@ import argparse
 import json
 import csv
 from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 from library import utils
 import library.clients.dbentityclient as dbclient
 import library.clients.alertsaiclient as alertsaiclient
 import library.localstore as store
+import library.snapshotstore as snapshotstore
 import library.nrpylogger as nrpylogger
 
 alertsaiclient = alertsaiclient.AlertsAI()
@@ -15,114 +17,146 @@ logger = nrpylogger.get_logger(os.path.basename(__file__))
 config = store.load_json_from_file(".", "alertsai.json")
 nr_user_api_key = config['nr_user_api_key']
 accountId = config['accountId']
+# account : page every condition of the account once, policy : page the conditions of each policy
+export_mode = config.get('export_mode', 'account')
+snapshot = config.get('snapshot', False)
+snapshot_file = config.get('snapshot_file', snapshotstore.DEFAULT_SNAPSHOT_FILE)
 
 
-def get_all_policies(nr_user_api_key, accountId, nextCursor=None):
+# returns the policies of the account, or None if the search failed
+def get_all_policies(nr_user_api_key, accountId):
     all_policies = []
-    while True:
-        result = alertsaiclient.get_all_policies_nrql(nr_user_api_key, accountId, nextCursor)
-        policies = result['response']['data']['actor']['account']['alerts']['policiesSearch']
-        nextCursor = policies['nextCursor']
-        for policy in policies['policies']:
+    policies_pager = alertsaiclient.policies_pager(nr_user_api_key, accountId)
+    for policies in policies_pager:
+        for policy in policies:
             all_policies.append({
                 "policyId": policy['id'],
                 "policyName": policy['name']
             })
-        # Break the loop if there is no next cursor
-        if not nextCursor:
-            break
-
-        logger.info("List of all policies have been generated.")
+    if policies_pager.error:
+        logger.error("Error listing policies " + json.dumps(policies_pager.error))
+        return None
+    logger.info("List of all policies have been generated.")
     return all_policies
 
 
-def get_all_policy_conditions(nr_user_api_key, accountId, policyId, policyName, nextCursor):
+def get_all_policy_conditions(nr_user_api_key, accountId, policyId, policyName):
     conditions_list = []
     invalid_policy_list = []
     empty_policy_list = []
-    while True:
-        result = alertsaiclient.get_policy_conditions_nrql(nr_user_api_key, accountId, policyId, policyName, nextCursor)
-        if 'error' in result:
-            logger.info(str(policyId) + " is an invalid policy.")
-            invalid_policy_list.append({'policyId': policyId, 'policyName': policyName})
-            return conditions_list, invalid_policy_list, empty_policy_list
-        else:
-            conditions = result['response']['data']['actor']['account']['alerts']['nrqlConditionsSearch']
-            nextCursor = conditions['nextCursor']
-            # If there are no conditions, add the policy to the empty policy list
-            if not conditions['nrqlConditions']:
-                logger.info(str(policyId) + " has no conditions.")
-                empty_policy_list.append({'policyId': policyId, 'policyName': policyName})
-                return conditions_list, invalid_policy_list, empty_policy_list
-            else:
-                result_condition_list = conditions['nrqlConditions']
-        for condition in result_condition_list:
-            conditions_list.append({
-                "policyId": policyId,
-                "policyName": policyName,
-                "conditionId": condition['id'],
-                "conditionType": condition['type'],
-                "conditionName": condition['name'],
-                "conditionQuery": condition['nrql']['query'],
-                "nrqlEvaluationOffset": condition['nrql']['evaluationOffset'],
-                "description": condition['description'],
-                "enabled": condition['enabled'],
-                "runbookUrl": condition['runbookUrl'],
-                "closeViolationsOnExpiration": condition['expiration']['closeViolationsOnExpiration'],
-                "expirationDuration": condition['expiration']['expirationDuration'],
-                "openViolationOnExpiration": condition['expiration']['openViolationOnExpiration'],
-                "aggregationDelay": condition['signal']['aggregationDelay'],
-                "aggregationMethod": condition['signal']['aggregationMethod'],
-                "aggregationTimer": condition['signal']['aggregationTimer'],
-                "aggregationWindow": condition['signal']['aggregationWindow'],
-                "evaluationDelay": condition['signal']['evaluationDelay'],
-                "evaluationOffset": condition['signal']['evaluationOffset'],
-                "fillOption": condition['signal']['fillOption'],
-                "fillValue": condition['signal']['fillValue'],
-                "slideBy": condition['signal']['slideBy'],
-                "violationTimeLimit": condition['violationTimeLimit'],
-                "violationTimeLimitSeconds": condition['violationTimeLimitSeconds']
-            })
-            if len(condition['terms']) > 1:
-                conditions_list[-1]["operator1"] = condition['terms'][0]['operator']
-                conditions_list[-1]["priority1"] = condition['terms'][0]['priority']
-                conditions_list[-1]["threshold1"] = condition['terms'][0]['threshold']
-                conditions_list[-1]["thresholdDuration1"] = condition['terms'][0]['thresholdDuration']
-                conditions_list[-1]["thresholdOccurrences1"] = condition['terms'][0]['thresholdOccurrences']
-                conditions_list[-1]["operator2"] = condition['terms'][1]['operator']
-                conditions_list[-1]["priority2"] = condition['terms'][1]['priority']
-                conditions_list[-1]["threshold2"] = condition['terms'][1]['threshold']
-                conditions_list[-1]["thresholdDuration2"] = condition['terms'][1]['thresholdDuration']
-                conditions_list[-1]["thresholdOccurrences2"] = condition['terms'][1]['thresholdOccurrences']
-            else:
-                conditions_list[-1]["operator1"] = condition['terms'][0]['operator']
-                conditions_list[-1]["priority1"] = condition['terms'][0]['priority']
-                conditions_list[-1]["threshold1"] = condition['terms'][0]['threshold']
-                conditions_list[-1]["thresholdDuration1"] = condition['terms'][0]['thresholdDuration']
-                conditions_list[-1]["thresholdOccurrences1"] = condition['terms'][0]['thresholdOccurrences']
-                conditions_list[-1]["operator2"] = None
-                conditions_list[-1]["priority2"] = None
-                conditions_list[-1]["threshold2"] = None
-                conditions_list[-1]["thresholdDuration2"] = None
-                conditions_list[-1]["thresholdOccurrences2"] = None
-
-        # Break the loop if there is no next cursor
-        if not nextCursor:
-            logger.info("List of all conditions have been generated.")
-            break
+    conditions_pager = alertsaiclient.policy_conditions_pager(nr_user_api_key, accountId, policyId, policyName)
+    for conditions in conditions_pager:
+        for condition in conditions:
+            conditions_list.append(condition_row(policyId, policyName, condition))
+    if conditions_pager.error and not conditions_pager.pages:
+        logger.info(str(policyId) + " is an invalid policy.")
+        invalid_policy_list.append({'policyId': policyId, 'policyName': policyName})
+    elif conditions_pager.error:
+        # a later page failed, the policy is valid but its conditions are incomplete
+        logger.error("Error listing the conditions of policy " + str(policyId) + " after " +
+                     str(conditions_pager.pages) + " pages " + json.dumps(conditions_pager.error))
+    elif not conditions_list:
+        # If there are no conditions, add the policy to the empty policy list
+        logger.info(str(policyId) + " has no conditions.")
+        empty_policy_list.append({'policyId': policyId, 'policyName': policyName})
+    else:
+        logger.info("List of all conditions have been generated.")
     return conditions_list, invalid_policy_list, empty_policy_list
 
 
-def generate_policies_and_conditions_report():
-    policies_and_conditions_report_filename =  "policies_and_conditions_report-"+str(date.today())+".csv"
-    invalid_policies_report_filename = "invalid_policies_report-"+str(date.today())+".csv"
-    empty_policies_report_filename = "empty_policies_report-"+str(date.today())+".csv"
+# returns { policyId : [conditions] } for every nrql condition of the account, or None if the search failed
+def get_all_conditions_by_policy(nr_user_api_key, accountId):
+    conditions_by_policy = {}
+    conditions_pager = alertsaiclient.conditions_pager(nr_user_api_key, accountId)
+    for conditions in conditions_pager:
+        for condition in conditions:
+            conditions_by_policy.setdefault(str(condition['policyId']), []).append(condition)
+    if conditions_pager.error:
+        logger.error("Error listing conditions " + json.dumps(conditions_pager.error))
+        return None
+    logger.info("Listed all conditions in " + str(conditions_pager.pages) + " pages.")
+    return conditions_by_policy
+
+
+# policies without conditions are empty, policies referenced by conditions but not listed are invalid
+def group_conditions_by_policy(all_policies_list, conditions_by_policy):
+    conditions_list = []
+    empty_policy_list = []
+    listed_policy_ids = set()
+    for policy in all_policies_list:
+        policy_id = str(policy['policyId'])
+        listed_policy_ids.add(policy_id)
+        conditions = conditions_by_policy.get(policy_id, [])
+        if not conditions:
+            empty_policy_list.append(policy)
+        for condition in conditions:
+            conditions_list.append(condition_row(policy['policyId'], policy['policyName'], condition))
+    invalid_policy_list = []
+    for policy_id in conditions_by_policy.keys() - listed_policy_ids:
+        invalid_policy_list.append({'policyId': policy_id, 'policyName': None})
+        for condition in conditions_by_policy[policy_id]:
+            conditions_list.append(condition_row(policy_id, None, condition))
+    return conditions_list, invalid_policy_list, empty_policy_list
+
+
+def condition_row(policyId, policyName, condition):
+    row = {
+        "policyId": policyId,
+        "policyName": policyName,
+        "conditionId": condition['id'],
+        "conditionType": condition['type'],
+        "conditionName": condition['name'],
+        "conditionQuery": condition['nrql']['query'],
+        "nrqlEvaluationOffset": condition['nrql']['evaluationOffset'],
+        "description": condition['description'],
+        "enabled": condition['enabled'],
+        "runbookUrl": condition['runbookUrl'],
+        "closeViolationsOnExpiration": condition['expiration']['closeViolationsOnExpiration'],
+        "expirationDuration": condition['expiration']['expirationDuration'],
+        "openViolationOnExpiration": condition['expiration']['openViolationOnExpiration'],
+        "aggregationDelay": condition['signal']['aggregationDelay'],
+        "aggregationMethod": condition['signal']['aggregationMethod'],
+        "aggregationTimer": condition['signal']['aggregationTimer'],
+        "aggregationWindow": condition['signal']['aggregationWindow'],
+        "evaluationDelay": condition['signal']['evaluationDelay'],
+        "evaluationOffset": condition['signal']['evaluationOffset'],
+        "fillOption": condition['signal']['fillOption'],
+        "fillValue": condition['signal']['fillValue'],
+        "slideBy": condition['signal']['slideBy'],
+        "violationTimeLimit": condition['violationTimeLimit'],
+        "violationTimeLimitSeconds": condition['violationTimeLimitSeconds']
+    }
+    if len(condition['terms']) > 1:
+        row["operator1"] = condition['terms'][0]['operator']
+        row["priority1"] = condition['terms'][0]['priority']
+        row["threshold1"] = condition['terms'][0]['threshold']
+        row["thresholdDuration1"] = condition['terms'][0]['thresholdDuration']
+        row["thresholdOccurrences1"] = condition['terms'][0]['thresholdOccurrences']
+        row["operator2"] = condition['terms'][1]['operator']
+        row["priority2"] = condition['terms'][1]['priority']
+        row["threshold2"] = condition['terms'][1]['threshold']
+        row["thresholdDuration2"] = condition['terms'][1]['thresholdDuration']
+        row["thresholdOccurrences2"] = condition['terms'][1]['thresholdOccurrences']
+    else:
+        row["operator1"] = condition['terms'][0]['operator']
+        row["priority1"] = condition['terms'][0]['priority']
+        row["threshold1"] = condition['terms'][0]['threshold']
+        row["thresholdDuration1"] = condition['terms'][0]['thresholdDuration']
+        row["thresholdOccurrences1"] = condition['terms'][0]['thresholdOccurrences']
+        row["operator2"] = None
+        row["priority2"] = None
+        row["threshold2"] = None
+        row["thresholdDuration2"] = None
+        row["thresholdOccurrences2"] = None
+    return row
+
+
+def get_conditions_of_each_policy(all_policies_list):
     policies_and_conditions_report = []
     invalid_policies_report = []
     empty_policies_report = []
-    all_policies_list = get_all_policies(nr_user_api_key, accountId, nextCursor=None)
     for policy in all_policies_list:
-        conditions_list, invalid_policies_list, empty_policies_list = get_all_policy_conditions(nr_user_api_key, accountId, policy['policyId'], policy['policyName'], nextCursor=None)
+        conditions_list, invalid_policies_list, empty_policies_list = get_all_policy_conditions(nr_user_api_key, accountId, policy['policyId'], policy['policyName'])
         if conditions_list:
             for condition in conditions_list:
                 policies_and_conditions_report.append(condition)
@@ -133,6 +167,31 @@ def generate_policies_and_conditions_report():
         if empty_policies_list:
             for temp_policy in empty_policies_list:
                 empty_policies_report.append(temp_policy)
+    return policies_and_conditions_report, invalid_policies_report, empty_policies_report
+
+
+def generate_policies_and_conditions_report():
+    policies_and_conditions_report_filename =  "policies_and_conditions_report-"+str(date.today())+".csv"
+    invalid_policies_report_filename = "invalid_policies_report-"+str(date.today())+".csv"
+    empty_policies_report_filename = "empty_policies_report-"+str(date.today())+".csv"
+    conditions_by_policy = None
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        all_policies_future = executor.submit(get_all_policies, nr_user_api_key, accountId)
+        if export_mode == 'account':
+            conditions_by_policy = get_all_conditions_by_policy(nr_user_api_key, accountId)
+        all_policies_list = all_policies_future.result()
+    if all_policies_list is None:
+        # every condition would be reported under an invalid policy
+        logger.error("Could not list the policies, no report has been generated.")
+        return
+    if conditions_by_policy is not None:
+        policies_and_conditions_report, invalid_policies_report, empty_policies_report = \
+            group_conditions_by_policy(all_policies_list, conditions_by_policy)
+    else:
+        if export_mode == 'account':
+            logger.info("Falling back to listing the conditions of each policy.")
+        policies_and_conditions_report, invalid_policies_report, empty_policies_report = \
+            get_conditions_of_each_policy(all_policies_list)
     # Creating CSV Reports
     store.save_list_of_dict_as_csv(policies_and_conditions_report, policies_and_conditions_report_filename)
     logger.info("Policies and Conditions Report has been saved as " + policies_and_conditions_report_filename)
@@ -140,6 +199,28 @@ def generate_policies_and_conditions_report():
     logger.info("Invalid Policies Report has been saved as " + invalid_policies_report_filename)
     store.save_list_of_dict_as_csv(empty_policies_report, empty_policies_report_filename)
     logger.info("Empty Policies Report has been saved as " + empty_policies_report_filename)
+    if snapshot:
+        snapshot_policies_and_conditions(all_policies_list, policies_and_conditions_report,
+                                         conditions_by_policy is not None)
+
+
+# records the policies and conditions that changed since the last run in the snapshot store. Conditions missing from
+# a complete account-wide listing are recorded as deleted.
+def snapshot_policies_and_conditions(all_policies_list, policies_and_conditions_report, complete):
+    snapshots = snapshotstore.SnapshotStore(snapshot_file)
+    key_prefix = str(accountId) + '/'
+    for policy in all_policies_list:
+        snapshots.save(snapshotstore.POLICY, key_prefix + str(policy['policyId']), policy)
+    condition_keys = []
+    for condition in policies_and_conditions_report:
+        condition_keys.append(key_prefix + str(condition['conditionId']))
+        snapshots.save(snapshotstore.CONDITION, condition_keys[-1], condition)
+    if complete:
+        deleted = snapshots.mark_deleted(snapshotstore.CONDITION, condition_keys, key_prefix)
+        logger.info(str(len(deleted)) + " conditions were deleted.")
+    logger.info(str(snapshots.saved) + " policies and conditions changed, " + str(snapshots.unchanged) +
+                " unchanged, saved to " + snapshot_file)
+    snapshots.close()
 
 
 if __name__ == '__main__':
@@ -2,11 +2,16 @@ import os
 import argparse
 import json
 import csv
-from datetime import date
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from library import utils
 import library.clients.ccuconsumptionclient as ccuconsumptionclient
 import library.localstore as store
+import library.ccucost as ccucost
+from library.ccurollup import CcuRollup, DEFAULT_TOP_K
+import library.nrqlwindows as nrqlwindows
 import library.nrpylogger as nrpylogger
+from library.responsecache import ResponseCache, DEFAULT_CACHE_FILE
 
 ccuconsumptionclient = ccuconsumptionclient.CCUConsumption()
 logger = nrpylogger.get_logger(os.path.basename(__file__))
@@ -15,6 +20,18 @@ config = store.load_json_from_file(".", "ccuconsumption.json")
 nr_user_api_key = config['nr_user_api_key']
 since = config['since']
 until = config['until']
+max_workers = config.get('max_workers', 8)
+ResponseCache.configure(config.get('cache', True), config.get('refresh_cache', False),
+                        config.get('cache_file', DEFAULT_CACHE_FILE))
+tier_scope = config.get('tier_scope', ccucost.ORGANIZATION)
+partition_workers = config.get('partition_workers', 4)
+min_partition_ms = config.get('min_partition_minutes', 60) * nrqlwindows.MINUTE_MS
+facet_limit = config.get('facet_limit', nrqlwindows.DEFAULT_FACET_LIMIT)
+top_k = config.get('top_k', DEFAULT_TOP_K)
+CONDITION_ID_DIGITS = '0123456789'
+# conditions are split by at most this many trailing id digits, 10^4 partitions of a minimal time window
+MAX_SUFFIX_DIGITS = 4
+REPORT_FIELDS = ["accountId", "conditionId", "conditionName", "policyId", "conditionQuery", "ccuConsumption"]
 
 
 def get_all_accounts(nr_user_api_key):
@@ -31,34 +48,119 @@ def get_all_accounts(nr_user_api_key):
     return all_accounts_list, all_accounts_dicts
 
 
+# accounts are processed by max_workers threads, each account's rows are written as soon as it completes
+# a failing account is logged and skipped without stopping the others. The rows are rolled up as they are written.
 def generate_ccu_consumption_report_for_all_accounts(nr_user_api_key):
     all_accounts_list, all_accounts_dicts = get_all_accounts(nr_user_api_key)
-    ccu_consumption_report = []
-    for account in all_accounts_list:
-        result = get_ccu_consumption_per_condition(nr_user_api_key, account, since, until)
-        for condition in result:
-            condition_details = get_condition_details(nr_user_api_key, account, condition["conditionId"])
-            if condition_details:
-                ccu_consumption_report.append({
-                    "accountId": account,
-                    "conditionId": condition["conditionId"],
-                    "conditionName": condition_details["conditionName"],
-                    "policyId": condition_details["policyId"],
-                    "conditionQuery": condition_details["query"],
-                    "ccuConsumption": condition["ccuConsumption"]
-                })
-    store.save_list_of_dict_as_csv(ccu_consumption_report, "ccu_consumption_report_%s_%s.csv" % (since, until))
+    failed_accounts = []
+    rollup = CcuRollup(top_k)
+    report_file_name = "ccu_consumption_report_%s_%s.csv" % (since, until)
+    with open(report_file_name, 'w', newline='') as report_file, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        report_writer = csv.DictWriter(report_file, REPORT_FIELDS)
+        report_writer.writeheader()
+        futures = {executor.submit(get_account_report_rows, nr_user_api_key, account): account
+                   for account in all_accounts_list}
+        for done, future in enumerate(as_completed(futures), 1):
+            account = futures[future]
+            try:
+                rows = future.result()
+                report_writer.writerows(rows)
+                report_file.flush()
+                rollup.add_all(rows)
+            except Exception as ex:
+                logger.error("Could not report account " + str(account) + " : " + repr(ex))
+                failed_accounts.append(account)
+            logger.info("Reported " + str(done) + " of " + str(len(futures)) + " accounts.")
+    if failed_accounts:
+        logger.error("CCU consumption is missing for accounts " + str(failed_accounts))
     logger.info("CCU consumption report has been generated.")
+    generate_ccu_rollup_reports(rollup)
+    generate_ccu_cost_reports(report_file_name, rollup)
+
+
+def generate_ccu_rollup_reports(rollup):
+    store.save_list_of_dict_as_csv(rollup.account_rows(), "ccu_rollup_by_account_%s_%s.csv" % (since, until))
+    store.save_list_of_dict_as_csv(rollup.policy_rows(), "ccu_rollup_by_policy_%s_%s.csv" % (since, until))
+    store.save_list_of_dict_as_csv(rollup.pattern_rows(), "ccu_rollup_by_query_pattern_%s_%s.csv" % (since, until))
+    store.save_list_of_dict_as_csv(rollup.top(), "ccu_top_conditions_%s_%s.csv" % (since, until))
+    logger.info("CCU rollup reports have been generated.")
+
+
+# prices the consumption report with ccu_tier.csv and ccu_discount.csv, when they exist. Usage per account and policy
+# comes from the rollup so the rows are priced in a single pass without loading the report in memory.
+def generate_ccu_cost_reports(report_file_name, rollup):
+    if not os.path.exists("ccu_tier.csv"):
+        logger.info("No ccu_tier.csv, skipping the CCU cost reports.")
+        return
+    pricing = ccucost.TierPricing(load_ccu_tier_prices())
+    fractions = ccucost.paid_fractions(load_ccu_discounts()) if os.path.exists("ccu_discount.csv") else {}
+    usage_by_account = {account_id: usage for account_id, (usage, count) in rollup.by_account.items()}
+    usage_by_policy = {policy_key: usage for policy_key, (usage, count) in rollup.by_policy.items()}
+    rates = ccucost.account_rates(usage_by_account, pricing, fractions, tier_scope)
+    cost_file_name = "ccu_cost_report_%s_%s.csv" % (since, until)
+    with open(report_file_name, newline='') as report_file, open(cost_file_name, 'w', newline='') as cost_file:
+        cost_writer = csv.DictWriter(cost_file, REPORT_FIELDS + ["ccuCost"])
+        cost_writer.writeheader()
+        for row in csv.DictReader(report_file):
+            row["ccuCost"] = float(row["ccuConsumption"]) * rates[row["accountId"]]
+            cost_writer.writerow(row)
+    store.save_list_of_dict_as_csv([{"accountId": account_id, "policyId": policy_id, "ccuConsumption": usage,
+                                     "ccuCost": usage * rates[account_id]}
+                                    for (account_id, policy_id), usage in usage_by_policy.items()],
+                                   "ccu_cost_by_policy_%s_%s.csv" % (since, until))
+    store.save_list_of_dict_as_csv([{"accountId": account_id, "ccuConsumption": usage,
+                                     "ccuCost": usage * rates[account_id],
+                                     "paidFraction": ccucost.paid_fraction(fractions, account_id)}
+                                    for account_id, usage in usage_by_account.items()],
+                                   "ccu_cost_by_account_%s_%s.csv" % (since, until))
+    logger.info("CCU cost reports have been generated.")
+
+
+def get_account_report_rows(nr_user_api_key, account):
+    rows = []
+    result = get_ccu_consumption_per_condition(nr_user_api_key, account, since, until)
+    all_condition_details = get_conditions_details(nr_user_api_key, account,
+                                                   [condition["conditionId"] for condition in result])
+    for condition in result:
+        condition_details = all_condition_details.get(condition["conditionId"])
+        if condition_details:
+            rows.append({
+                "accountId": account,
+                "conditionId": condition["conditionId"],
+                "conditionName": condition_details["conditionName"],
+                "policyId": condition_details["policyId"],
+                "conditionQuery": condition_details["query"],
+                "ccuConsumption": condition["ccuConsumption"]
+            })
+    return rows
 
 
 def get_condition_details(nr_user_api_key, accountId, conditionId):
-    condition_details = {}
     result = ccuconsumptionclient.get_condition_details(nr_user_api_key, accountId, conditionId)
     if 'error' in result:
         logger.error(json.dumps(result))
         return
-    elif result['response']['data']['actor']['account']['alerts']['nrqlCondition']:
-        conditions_data = result['response']['data']['actor']['account']['alerts']['nrqlCondition']
+    return to_condition_details(conditionId, result['response']['data']['actor']['account']['alerts']['nrqlCondition'])
+
+
+# looks up conditions in aliased batches, returns { conditionId : condition_details } for the valid conditions
+def get_conditions_details(nr_user_api_key, accountId, conditionIds):
+    all_condition_details = {}
+    results = ccuconsumptionclient.get_conditions_details(nr_user_api_key, accountId, conditionIds)
+    for conditionId, result in zip(conditionIds, results):
+        if 'error' in result:
+            logger.error(json.dumps(result))
+            continue
+        condition_details = to_condition_details(conditionId, result['response'])
+        if condition_details:
+            all_condition_details[conditionId] = condition_details
+    return all_condition_details
+
+
+def to_condition_details(conditionId, conditions_data):
+    condition_details = {}
+    if conditions_data:
         if conditions_data['name']:
             condition_details["conditionName"] = conditions_data['name']
         else:
@@ -70,16 +172,55 @@ def get_condition_details(nr_user_api_key, accountId, conditionId):
         logger.info("Condition id " + str(conditionId) + " is invalid.")
         return
 
+# The whole range is queried first. A partition returning facet_limit conditions is truncated: its time window is
+# split in half down to min_partition_minutes, then its conditions are split by the last digits of their id. Time
+# windows and id suffixes are disjoint so the usage of every partition is summed per condition exactly.
 def get_ccu_consumption_per_condition(nr_user_api_key, accountId, since, until):
-    condition_ccu_consumption = []
-    result = ccuconsumptionclient.get_ccu_consumption(nr_user_api_key, accountId, since, until)
-    ccu_per_conidition = result['response']['data']['actor']['nrql']['results']
-    for condition in ccu_per_conidition:
-        condition_ccu_consumption.append({
-            "conditionId": condition['dimension_conditionId'],
-            "ccuConsumption": condition['sum.usage']
-        })
-    return condition_ccu_consumption
+    since_ms, until_ms = to_epoch_ms(since), to_epoch_ms(until)
+    planner = nrqlwindows.WindowPlanner(since_ms, until_ms, until_ms - since_ms, min_partition_ms, until_ms - since_ms,
+                                        facet_limit)
+    usage_by_condition = {}
+    suffix_partitions = []
+    with ThreadPoolExecutor(max_workers=partition_workers) as executor:
+        in_flight = {}
+        while True:
+            while len(in_flight) < partition_workers and (suffix_partitions or planner.has_next()):
+                window, suffix = suffix_partitions.pop() if suffix_partitions else (planner.next_window(), None)
+                future = executor.submit(get_partition_usage, nr_user_api_key, accountId, window, suffix)
+                in_flight[future] = (window, suffix)
+            if not in_flight:
+                break
+            done, not_done = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                window, suffix = in_flight.pop(future)
+                results = future.result()
+                truncated = len(results) >= facet_limit
+                if truncated and (suffix or not planner.can_split(window)) and \
+                        len(suffix or '') < MAX_SUFFIX_DIGITS:
+                    logger.info("Account " + str(accountId) + " window " + str(window) + " suffix " + str(suffix) +
+                                " hit the facet limit, splitting by condition id")
+                    suffix_partitions.extend((window, digit + (suffix or '')) for digit in CONDITION_ID_DIGITS)
+                    continue
+                if truncated and suffix:
+                    logger.warning("Account " + str(accountId) + " results are truncated for suffix " + suffix)
+                if suffix is None and not planner.complete(window, len(results)):
+                    continue
+                for condition in results:
+                    conditionId = condition['dimension_conditionId']
+                    usage_by_condition[conditionId] = usage_by_condition.get(conditionId, 0) + condition['sum.usage']
+    return [{"conditionId": conditionId, "ccuConsumption": usage}
+            for conditionId, usage in usage_by_condition.items()]
+
+
+def get_partition_usage(nr_user_api_key, accountId, window, suffix):
+    result = ccuconsumptionclient.get_ccu_consumption(nr_user_api_key, accountId, window[0], window[1], suffix)
+    if 'error' in result:
+        raise ValueError(json.dumps(result['error']))
+    return result['response']['data']['actor']['nrql']['results']
+
+
+def to_epoch_ms(iso_time):
+    return int(datetime.fromisoformat(iso_time.replace('Z', '+00:00')).timestamp() * 1000)
 
 
 def load_ccu_tier_prices():
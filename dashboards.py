@@ -1,22 +1,36 @@
 import os
 import argparse
+import asyncio
+import csv
 import json
+from datetime import datetime
+from pathlib import Path
 from library import utils
 import library.clients.dbentityclient as dbclient
 import library.clients.entityclient as entityclient
+import library.clients.gql as nerdgraph
 import library.localstore as store
+import library.snapshotstore as snapshotstore
 import library.nrpylogger as nrpylogger
 
 db_entity = dbclient.DashboardEntity()
 ec = entityclient.EntityClient()
 logger = nrpylogger.get_logger(os.path.basename(__file__))
 NO_NAME = "NONE"
+DEFAULT_EXPORT_DIR = "dashboards"
+MANIFEST_FILE = "manifest.csv"
+MANIFEST_FIELDS = ["accountId", "guid", "name", "file", "status", "error"]
+EXPORTED = "exported"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+CHANGES_FILE = "snapshot_changes.csv"
 
 
 def setup_params(parser):
     parser.add_argument('--fromAccount', nargs=1, type=int, required=True, help='source accountId')
     parser.add_argument('--fromApiKey', nargs=1, type=str, required=True, help='fromAccount User API Key')
-    parser.add_argument('--entityGuid', nargs=1, type=str, required=True, help='Dashboard entityGuid')
+    parser.add_argument('--entityGuid', nargs=1, type=str, required=False,
+                        help='Dashboard entityGuid, required to --download or --copy')
     parser.add_argument('--download', dest='download', required=False, action='store_true',
                         help='Download Dashboard JSON')
     parser.add_argument('--copy', dest='copy', required=False, action='store_true',
@@ -25,6 +39,21 @@ def setup_params(parser):
     parser.add_argument('--toApiKey', nargs=1, type=str, required=False, help='toAccount User API Key. Optional in '
                                                                               'case fromApiKey works for both accounts ')
     parser.add_argument('--toName', nargs=1, type=str, required=False, help='name of copied dashboard')
+    parser.add_argument('--exportAll', dest='exportAll', required=False, action='store_true',
+                        help='Download every dashboard of --accounts to --exportDir')
+    parser.add_argument('--accounts', nargs='+', type=int, required=False,
+                        help='accountIds to export, fromAccount by default')
+    parser.add_argument('--exportDir', nargs=1, type=str, required=False, default=[DEFAULT_EXPORT_DIR],
+                        help='directory of the exported dashboards and their manifest.csv')
+    parser.add_argument('--concurrency', nargs=1, type=int, required=False, default=[nerdgraph.DEFAULT_CONCURRENCY],
+                        help='max NerdGraph requests in flight')
+    parser.add_argument('--snapshot', dest='snapshot', required=False, action='store_true',
+                        help='with --exportAll, record the dashboards that changed in the snapshot store')
+    parser.add_argument('--snapshotFile', nargs=1, type=str, required=False,
+                        default=[snapshotstore.DEFAULT_SNAPSHOT_FILE], help='snapshot store sqlite file')
+    parser.add_argument('--changesSince', nargs=1, type=str, required=False,
+                        help='write the snapshots changed since an iso date e.g. 2024-03-01T00:00:00 to '
+                             + CHANGES_FILE)
 
 
 def print_params():
@@ -34,6 +63,15 @@ def print_params():
         logger.info("Dashboard entityGuid " + args.entityGuid[0])
     if args.download:
         logger.info("action : download")
+    if args.exportAll:
+        logger.info("action : exportAll")
+        logger.info("accounts : " + str(args.accounts or args.fromAccount))
+        logger.info("exportDir : " + args.exportDir[0])
+        logger.info("concurrency : " + str(args.concurrency[0]))
+        if args.snapshot:
+            logger.info("snapshotFile : " + args.snapshotFile[0])
+    if args.changesSince:
+        logger.info("action : changesSince " + args.changesSince[0])
     if args.copy:
         logger.info("action: copy ")
         logger.info("toAccount : " + str(args.toAccount[0]))
@@ -54,6 +92,92 @@ def download(per_api_key, entity_guid):
     store.save_json_to_file(dashboard, db_file_name)
 
 
+# Lists the dashboards of each account page by page and downloads the dashboards of a page concurrently, each one to
+# <accountId>-<name>-<guid>.json in export_dir as soon as its page is fetched. manifest.csv gets one row per dashboard
+# with its file, or the error that prevented its download. Returns the number of dashboards that failed.
+# With a SnapshotStore only the dashboards that changed since the last snapshot are recorded and written again, and
+# the dashboards no longer listed in an account are recorded as deleted.
+def export_all(per_api_key, account_ids, export_dir=DEFAULT_EXPORT_DIR, concurrency=nerdgraph.DEFAULT_CONCURRENCY,
+               snapshots=None):
+    export_path = Path(export_dir)
+    export_path.mkdir(mode=0o777, parents=True, exist_ok=True)
+    async_db_entity = dbclient.AsyncDashboardEntity(nerdgraph.AsyncGraphQl(concurrency))
+    listed = 0
+    failed = 0
+    try:
+        with open(export_path / MANIFEST_FILE, 'w', newline='') as manifest_file:
+            manifest = csv.DictWriter(manifest_file, MANIFEST_FIELDS)
+            manifest.writeheader()
+            for account_id in account_ids:
+                snapshot_keys = []
+                dashboards_pager = db_entity.iter_dashboards(per_api_key, account_id)
+                for outlines in dashboards_pager:
+                    rows = asyncio.run(export_dashboards(async_db_entity, per_api_key, outlines, export_path,
+                                                         snapshots))
+                    manifest.writerows(rows)
+                    manifest_file.flush()
+                    listed += len(rows)
+                    failed += sum(1 for row in rows if row['status'] == FAILED)
+                    snapshot_keys.extend(snapshot_key(outline) for outline in outlines)
+                if dashboards_pager.error:
+                    logger.error("Could not list the dashboards of " + str(account_id) + " " +
+                                 json.dumps(dashboards_pager.error))
+                    manifest.writerow({"accountId": account_id, "status": FAILED,
+                                       "error": json.dumps(dashboards_pager.error)})
+                    failed += 1
+                elif snapshots:
+                    deleted = snapshots.mark_deleted(snapshotstore.DASHBOARD, snapshot_keys, str(account_id) + '/')
+                    logger.info(str(len(deleted)) + " dashboards of " + str(account_id) + " were deleted.")
+    finally:
+        async_db_entity.gql.close()
+    logger.info("Exported " + str(listed - failed) + " of " + str(listed) + " dashboards to " + str(export_path))
+    if snapshots:
+        logger.info(str(snapshots.saved) + " dashboards changed, " + str(snapshots.unchanged) + " unchanged.")
+    return failed
+
+
+async def export_dashboards(async_db_entity, per_api_key, outlines, export_path, snapshots=None):
+    results = await asyncio.gather(*[async_db_entity.get(per_api_key, outline['guid']) for outline in outlines])
+    return [save_exported_dashboard(outline, result, export_path, snapshots)
+            for outline, result in zip(outlines, results)]
+
+
+def save_exported_dashboard(outline, result, export_path, snapshots=None):
+    row = {"accountId": outline['accountId'], "guid": outline['guid'], "name": outline['name']}
+    dashboard = None
+    if 'response' in result and result['response'].get('data'):
+        dashboard = result['response']['data']['actor']['entity']
+    if 'error' in result or not dashboard:
+        row["status"] = FAILED
+        row["error"] = json.dumps(result.get('error', [{'message': 'Dashboard not found'}]))
+        logger.error("Could not export " + outline['name'] + " " + row["error"])
+        return row
+    file_name = store.sanitize(str(outline['accountId']) + "-" + outline['name'] + "-" + outline['guid']) + ".json"
+    row["file"] = file_name
+    changed = snapshots.save(snapshotstore.DASHBOARD, snapshot_key(outline), dashboard) if snapshots else True
+    if changed or not (export_path / file_name).exists():
+        Path(export_path / file_name).write_text(json.dumps(dashboard, indent=utils.DEFAULT_INDENT))
+    row["status"] = EXPORTED if changed else UNCHANGED
+    return row
+
+
+def snapshot_key(outline):
+    return str(outline['accountId']) + '/' + outline['guid']
+
+
+# writes the dashboards, conditions and policies added, modified or deleted since an iso date to snapshot_changes.csv
+def report_changes(since, snapshot_file=snapshotstore.DEFAULT_SNAPSHOT_FILE):
+    snapshots = snapshotstore.SnapshotStore(snapshot_file)
+    since_epoch = datetime.fromisoformat(since.replace('Z', '+00:00')).timestamp()
+    changes = snapshots.changes_since(since_epoch)
+    snapshots.close()
+    for change in changes:
+        change['recordedAt'] = datetime.fromtimestamp(change['recordedAt']).isoformat()
+    store.save_list_of_dict_as_csv(changes, CHANGES_FILE)
+    logger.info(str(len(changes)) + " changes since " + since + " saved to " + CHANGES_FILE)
+    return changes
+
+
 def copy_dashboard(per_api_key, entity_guid, to_acct, to_api_key, to_name):
     result = db_entity.get(per_api_key, entity_guid)
     dashboard = result['response']['data']['actor']['entity']
@@ -136,8 +260,18 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Copy/Download Dashboard')
     setup_params(parser)
     args = parser.parse_args()
+    if (args.download or args.copy) and not args.entityGuid:
+        parser.error('--entityGuid is required to --download or --copy')
     if args.download:
         download(args.fromApiKey[0], args.entityGuid[0])
+    elif args.exportAll:
+        snapshots = snapshotstore.SnapshotStore(args.snapshotFile[0]) if args.snapshot else None
+        export_all(args.fromApiKey[0], args.accounts or args.fromAccount, args.exportDir[0], args.concurrency[0],
+                   snapshots)
+        if snapshots:
+            snapshots.close()
+    elif args.changesSince:
+        report_changes(args.changesSince[0], args.snapshotFile[0])
     elif args.copy or args.updateFacets:
         if not args.toApiKey:
             logger.info("No toApiKey provided. Assuming fromApiKey will work for the toAccount")
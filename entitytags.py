@@ -1,13 +1,24 @@
 import os
 import argparse
+import asyncio
 import json
 from library import utils
 import library.clients.entityclient as entityclient
+import library.clients.gql as nerdgraph
+import library.clients.gqlbatch as gqlbatch
+import library.tagmutations as tagmutations
+import library.tagjournal as tagjournal
+import library.taginventory as taginventory
+import library.localstore as store
 import library.nrpylogger as nrpylogger
 
 
 ec = entityclient.EntityClient()
 logger = nrpylogger.get_logger(os.path.basename(__file__))
+TAG_MUTATION_PLAN_FILE = 'tag_mutation_plan.csv'
+DEFAULT_RETRIES = 1
+TAG_INVENTORY_NAME = 'tag_inventory'
+DEFAULT_INVENTORY_QUERY = "domain = 'INFRA' AND type = 'HOST'"
     
 
 def setup_params(parser):
@@ -18,6 +29,27 @@ def setup_params(parser):
                         help='Remove all tags from infra hosts')
     parser.add_argument('--getAllInfraHostTags', dest='getAllInfraHostTags', required=False, action='store_true',
                         help='Get all mutable tags from infra hosts')
+    parser.add_argument('--skipImmutableHosts', dest='skipImmutableHosts', required=False, action='store_true',
+                        help='do not read the tags of hosts whose tag values were only seen immutable on other hosts')
+    parser.add_argument('--tagInventory', dest='tagInventory', required=False, action='store_true',
+                        help='count the tag keys and values of the entities matching --inventoryQuery')
+    parser.add_argument('--inventoryQuery', nargs=1, type=str, required=False, default=[DEFAULT_INVENTORY_QUERY],
+                        help='entitySearch query of the tag inventory, infra hosts by default')
+    parser.add_argument('--inventoryFormat', nargs=1, type=str, required=False, default=[taginventory.CSV],
+                        choices=[taginventory.CSV, taginventory.SQLITE], help='tag inventory output, csv or sqlite')
+    parser.add_argument('--concurrency', nargs=1, type=int, required=False, default=[nerdgraph.DEFAULT_CONCURRENCY],
+                        help='max NerdGraph requests in flight')
+    parser.add_argument('--dryRun', dest='dryRun', required=False, action='store_true',
+                        help='write the planned tag mutations to tag_mutation_plan.csv without applying them')
+    parser.add_argument('--retries', nargs=1, type=int, required=False, default=[DEFAULT_RETRIES],
+                        help='times the failed entities are retried at the end of the run')
+    parser.add_argument('--restart', dest='restart', required=False, action='store_true',
+                        help='discard the journal of an interrupted run instead of resuming it')
+    parser.add_argument('--journalMaxAge', nargs=1, type=float, required=False,
+                        default=[tagjournal.DEFAULT_MAX_AGE_HOURS],
+                        help='hours after which the journal of an interrupted run is planned again')
+    parser.add_argument('--batchSize', nargs=1, type=int, required=False, default=[gqlbatch.DEFAULT_BATCH_SIZE],
+                        help='entities mutated per NerdGraph request')
 
 
 def print_params():
@@ -30,79 +62,271 @@ def print_params():
         logger.info("Remove all editable tags from infra hosts")
     if args.getAllInfraHostTags:
         logger.info("Get all editable tags from all infra hosts")
+    if args.skipImmutableHosts:
+        logger.info("Hosts whose tag values were only seen immutable are skipped")
+    if args.tagInventory:
+        logger.info("Tag inventory of " + args.inventoryQuery[0] + " as " + args.inventoryFormat[0])
+    logger.info("concurrency : " + str(args.concurrency[0]))
+    logger.info("batchSize : " + str(args.batchSize[0]))
+    logger.info("retries : " + str(args.retries[0]))
+    if args.dryRun:
+        logger.info("Dry run, tags will not be mutated")
+    if args.restart:
+        logger.info("Restart, the journal of an interrupted run is discarded")
+    logger.info("journalMaxAge : " + str(args.journalMaxAge[0]))
 
 
-def update_tags(per_api_key, del_tag_values, add_tags):
+# fetches tagsWithMetadata in aliased batches of gqlbatch.DEFAULT_BATCH_SIZE entities, with batches sent concurrently
+async def gather_tags_with_metadata(aec, per_api_key, entities):
+    guid_batches = gqlbatch.chunks([entity['guid'] for entity in entities])
+    batch_results = await asyncio.gather(*[aec.gql_get_tags_with_metadata_batch(per_api_key, guids)
+                                           for guids in guid_batches])
+    all_results = []
+    for guids, results in zip(guid_batches, batch_results):
+        if isinstance(results, dict):
+            results = [results] * len(guids)
+        all_results.extend(results)
+    return all_results
+
+
+# streams infra hosts page by page and calls process(entity, mutable_tags) for each host,
+# the next page of hosts is fetched while the tags of the current page are being read. With skip_immutable,
+# tagsWithMetadata is only read for hosts whose inline tags include values not only seen as immutable, the other hosts
+# are assumed to have no mutable tags, see ImmutableTagValues. mutable_tags is None for a host whose tags could not be
+# read.
+def for_each_infra_host_tags(per_api_key, concurrency, process, skip_immutable=False):
+    aec = entityclient.AsyncEntityClient(nerdgraph.AsyncGraphQl(concurrency))
+    hosts_pager = ec.gql_iter_entities_of_type(per_api_key, "INFRA", "HOST")
+    immutable_values = tagmutations.ImmutableTagValues()
+    host_count = 0
+    skipped_count = 0
+    for entities in hosts_pager:
+        to_read = [entity for entity in entities
+                   if not skip_immutable or immutable_values.may_be_mutable(entity.get('tags'))]
+        all_tags = asyncio.run(gather_tags_with_metadata(aec, per_api_key, to_read)) if to_read else []
+        tags_by_guid = {entity['guid']: tags_result for entity, tags_result in zip(to_read, all_tags)}
+        for entity in entities:
+            logger.info('Processing ' + entity['type'] + ':' + entity['name'])
+            tags_result = tags_by_guid.get(entity['guid'])
+            if tags_result is None:
+                skipped_count += 1
+                process(entity, [])
+                continue
+            if 'error' in tags_result:
+                logger.error("Error getting tags for " + entity['name'] + json.dumps(tags_result['error']))
+                process(entity, None)
+                continue
+            if tags_result['response']:
+                immutable_values.learn(tags_result['response']['tagsWithMetadata'])
+            process(entity, mutable_tag_keys(tags_result))
+        host_count += len(entities)
+    aec.gql.close()
+    logger.info("Read tags of " + str(host_count - skipped_count) + " of " + str(host_count) + " hosts.")
+    return hosts_pager, host_count
+
+
+def mutable_tag_keys(tags_result):
+    mutableTags = []
+    if not tags_result['response']:
+        return mutableTags
+    for tag in tags_result['response']['tagsWithMetadata']:
+        if tag['values'][0]['mutable']:
+            mutableTags.append(tag['key'])
+    return mutableTags
+
+
+def update_tags(per_api_key, del_tag_values, add_tags, concurrency=nerdgraph.DEFAULT_CONCURRENCY,
+                batch_size=gqlbatch.DEFAULT_BATCH_SIZE, dry_run=False, retries=DEFAULT_RETRIES, restart=False,
+                max_age_hours=tagjournal.DEFAULT_MAX_AGE_HOURS):
     del_tag_values_arr = del_tag_values.split(",")
     addTagsArr = add_tags.split(",")
+    return run_operation(per_api_key, ['update_tags', del_tag_values_arr, addTagsArr],
+                         lambda: plan_update_tags(per_api_key, del_tag_values_arr, addTagsArr),
+                         concurrency, batch_size, dry_run, retries, restart, max_age_hours=max_age_hours)
+
+
+# returns the plans of the entities tagged with del_tag_values, or None when they could not be searched
+def plan_update_tags(per_api_key, del_tag_values_arr, addTagsArr):
     result = ec.gql_get_entities_with_tags(per_api_key, del_tag_values_arr)
     if 'error' in result:
         logger.error(json.dumps(result['error']), utils.DEFAULT_INDENT)
         logger.error("Error in executing NerdGraph query.")
-        return
-    if result['count'] > 0:
-        for entity in result['entities']:
-            logger.info('Processing ' + entity['entityType'] + ':' + entity['name'])
-            rm_result = ec.gql_mutate_delete_tag_values(per_api_key, entity['guid'], del_tag_values_arr)
-            if not rm_result['response']['data']['taggingDeleteTagValuesFromEntity']['errors']:
-                logger.info('Tag ' + del_tag_values + ' Removed to ' + entity['entityType'] + ':' + entity['name'])
-            add_result = ec.gql_mutate_add_tags(per_api_key, entity['guid'], addTagsArr)
-            if not add_result['response']['data']['taggingAddTagsToEntity']['errors']:
-                logger.info('Tag ' + add_tags + ' Added to ' + entity['entityType'] + ':' + entity['name'])
+        return None
+    if result['count'] == 0:
+        logger.warning("No entities found matching " + ",".join(del_tag_values_arr))
+    return [tagmutations.plan(entity, tagmutations.retag_mutations(entity.get('tags'), del_tag_values_arr, addTagsArr))
+            for entity in result['entities']]
+
+
+# Plans the operation then writes the plans to tag_mutation_plan.csv on a dry run, or applies them under a
+# TagJournal. When the journal of an interrupted run of the same operation and api key exists, its plans are resumed
+# instead of planning again. Entities that fail are retried up to retries times once the others are done.
+# Entities whose tags could not be read are journaled as failed and planned again by replan(plans) before a retry.
+def run_operation(per_api_key, operation, plan_all, concurrency, batch_size, dry_run, retries, restart, replan=None,
+                  max_age_hours=tagjournal.DEFAULT_MAX_AGE_HOURS):
+    journal = None if dry_run else tagjournal.TagJournal(tagjournal.journal_file(operation, per_api_key), restart,
+                                                         max_age_hours)
+    if journal and journal.plans is not None:
+        logger.info("Resuming " + journal.file_name + " : " + str(journal.done_count()) + " of " +
+                    str(len(journal.plans)) + " entities are done.")
     else:
-        logger.warning("No entities found matching " + del_tag_values)
+        plans = plan_all()
+        if plans is None:
+            if journal:
+                journal.finish()
+            return None
+        changes = [entity_plan for entity_plan in plans
+                   if entity_plan['mutations'] or entity_plan['mutations'] is None]
+        logger.info(str(len(plans) - len(changes)) + " of " + str(len(plans)) + " entities already have their tags.")
+        if dry_run:
+            store.save_list_of_dict_as_csv(tagmutations.plan_rows(changes), TAG_MUTATION_PLAN_FILE)
+            logger.info("Planned tag mutations of " + str(len(changes)) + " entities in " + TAG_MUTATION_PLAN_FILE)
+            return []
+        journal.start(changes)
+        for entity_plan in changes:
+            if entity_plan['mutations'] is None:
+                journal.record(tagmutations.unread_outcome(entity_plan))
+    outcomes = mutate_journaled(per_api_key, journal.pending(), replan, concurrency, batch_size, journal)
+    for attempt in range(retries):
+        retry_queue = journal.failed()
+        if not retry_queue:
+            break
+        logger.info("Retrying " + str(len(retry_queue)) + " failed entities.")
+        outcomes = mutate_journaled(per_api_key, retry_queue, replan, concurrency, batch_size, journal)
+    journal.finish()
+    return outcomes
 
 
-def remove_all_infra_tags(per_api_key):
-    infraTags = {'mutableTags': []}
-    result = ec.gql_get_entities_of_type(per_api_key, "INFRA", "HOST")
-    if 'error' in result:
-        logger.error(json.dumps(result['error']), utils.DEFAULT_INDENT)
-        logger.error("Error in executing NerdGraph query.")
-        infraTags['error'] = json.dumps(result['error'])
-        return infraTags
-    if result['count'] > 0:
-        for entity in result['entities']:
-            logger.info('Processing ' + entity['type'] + ':' + entity['name'])
-            result = ec.gql_get_tags_with_metadata(per_api_key, entity['guid'])
-            mutableTags = []
-            for tag in result['response']['data']['actor']['entity']['tagsWithMetadata']:
-                if tag['values'][0]['mutable']:
-                    mutableTags.append(tag['key'])
-            if mutableTags:
-                logger.info('deleting tags for ' + entity['name'] + " : " + json.dumps(mutableTags))
-                result = ec.gql_mutate_delete_tag_keys(per_api_key, entity['guid'], mutableTags)
-                if not result['response']['data']['taggingDeleteTagFromEntity']['errors']:
-                    logger.info('Deleted tags for ' + entity['name'] + " : " + json.dumps(mutableTags))
-                else:
-                    logger.error("Error deleting tags for " + entity['name'] + json.dumps(result))
-            else:
-                logger.info('No mutable tags found for ' + entity['name'])
+# plans again the entities whose tags could not be read then applies the plans, entities still unread stay failed
+def mutate_journaled(per_api_key, plans, replan, concurrency, batch_size, journal):
+    unread = [entity_plan for entity_plan in plans if entity_plan['mutations'] is None]
+    if unread and replan:
+        replanned = {entity_plan['entity']['guid']: entity_plan for entity_plan in replan(unread)}
+        plans = [replanned.get(entity_plan['entity']['guid'], entity_plan) for entity_plan in plans]
+        for entity_plan in replanned.values():
+            if entity_plan['mutations'] is not None:
+                journal.update(entity_plan)
+    for entity_plan in plans:
+        if entity_plan['mutations'] is None:
+            log_outcome(tagmutations.unread_outcome(entity_plan))
+    return mutate_tags(per_api_key, [entity_plan for entity_plan in plans if entity_plan['mutations'] is not None],
+                       concurrency, batch_size, journal)
+
+
+# applies the plans through a TagMutationPipeline, logs and journals each entity's outcome and returns the outcomes
+def mutate_tags(per_api_key, plans, concurrency=nerdgraph.DEFAULT_CONCURRENCY, batch_size=gqlbatch.DEFAULT_BATCH_SIZE,
+                journal=None):
+    def on_outcome(outcome):
+        log_outcome(outcome)
+        if journal:
+            journal.record(outcome)
+
+    aec = entityclient.AsyncEntityClient(nerdgraph.AsyncGraphQl(concurrency))
+    try:
+        outcomes = tagmutations.TagMutationPipeline(aec, per_api_key, batch_size, on_outcome).run(plans)
+    finally:
+        aec.gql.close()
+    failed = [outcome for outcome in outcomes if outcome['status'] == tagmutations.FAILED]
+    logger.info("Mutated tags of " + str(len(outcomes) - len(failed)) + " of " + str(len(outcomes)) + " entities.")
+    if failed:
+        logger.error("Tags could not be mutated for " + json.dumps([outcome['guid'] for outcome in failed]))
+    return outcomes
+
+
+def log_outcome(outcome):
+    if outcome['status'] == tagmutations.DONE:
+        logger.info('Mutated tags of ' + str(outcome['name']))
     else:
+        logger.error('Error mutating tags of ' + str(outcome['name']) + json.dumps(outcome['errors']))
+
+
+def remove_all_infra_tags(per_api_key, concurrency=nerdgraph.DEFAULT_CONCURRENCY,
+                          batch_size=gqlbatch.DEFAULT_BATCH_SIZE, dry_run=False, retries=DEFAULT_RETRIES,
+                          restart=False, max_age_hours=tagjournal.DEFAULT_MAX_AGE_HOURS, skip_immutable=False):
+    return run_operation(per_api_key, ['remove_all_infra_tags'],
+                         lambda: plan_remove_all_infra_tags(per_api_key, concurrency, skip_immutable),
+                         concurrency, batch_size, dry_run, retries, restart,
+                         lambda unread: replan_delete_mutable_tags(per_api_key, concurrency, unread), max_age_hours)
+
+
+# returns the plans deleting the mutable tags of every infra host, or None when the hosts could not be listed
+def plan_remove_all_infra_tags(per_api_key, concurrency, skip_immutable=False):
+    plans = []
+    hosts_pager, host_count = for_each_infra_host_tags(
+        per_api_key, concurrency, lambda entity, mutableTags: plan_delete_mutable_tags(plans, entity, mutableTags),
+        skip_immutable)
+    if hosts_pager.error:
+        logger.error(json.dumps(hosts_pager.error), utils.DEFAULT_INDENT)
+        logger.error("Error in executing NerdGraph query.")
+        return None
+    if host_count == 0:
         logger.warning("No entities found matching domain INFRA type HOST")
+    return plans
+
 
+# reads the tags of the hosts that could not be read while planning, hosts failing again are left unread
+def replan_delete_mutable_tags(per_api_key, concurrency, unread):
+    aec = entityclient.AsyncEntityClient(nerdgraph.AsyncGraphQl(concurrency))
+    try:
+        all_tags = asyncio.run(gather_tags_with_metadata(aec, per_api_key,
+                                                         [entity_plan['entity'] for entity_plan in unread]))
+    finally:
+        aec.gql.close()
+    plans = []
+    for entity_plan, tags_result in zip(unread, all_tags):
+        entity = entity_plan['entity']
+        if 'error' in tags_result:
+            logger.error("Error getting tags for " + entity['name'] + json.dumps(tags_result['error']))
+            plans.append(entity_plan)
+            continue
+        plan_delete_mutable_tags(plans, entity, mutable_tag_keys(tags_result))
+    return plans
+
+
+def plan_delete_mutable_tags(plans, entity, mutableTags):
+    mutations = []
+    if mutableTags is None:
+        logger.warning('Tags of ' + entity['name'] + ' could not be read, they will be read again before a retry')
+        mutations = None
+    elif mutableTags:
+        logger.info('deleting tags for ' + entity['name'] + " : " + json.dumps(mutableTags))
+        mutations.append(tagmutations.mutation(tagmutations.DELETE_KEYS, mutableTags))
+    else:
+        logger.info('No mutable tags found for ' + entity['name'])
+    plans.append(tagmutations.plan(entity, mutations))
+
+
+def get_all_infra_tags(per_api_key, concurrency=nerdgraph.DEFAULT_CONCURRENCY, skip_immutable=False):
+    def log_mutable_tags(entity, mutableTags):
+        if mutableTags is not None:
+            logger.info(entity['name'] + ' mutable tags ' + json.dumps(mutableTags))
 
-def get_all_infra_tags(per_api_key):
     infraTags = {'mutableTags': []}
-    result = ec.gql_get_entities_of_type(per_api_key, "INFRA", "HOST")
-    if 'error' in result:
-        logger.error(json.dumps(result['error']), utils.DEFAULT_INDENT)
+    hosts_pager, host_count = for_each_infra_host_tags(per_api_key, concurrency, log_mutable_tags, skip_immutable)
+    if hosts_pager.error:
+        logger.error(json.dumps(hosts_pager.error), utils.DEFAULT_INDENT)
         logger.error("Error in executing NerdGraph query.")
-        infraTags['error'] = json.dumps(result['error'])
+        infraTags['error'] = json.dumps(hosts_pager.error)
         return infraTags
-    if result['count'] > 0:
-        for entity in result['entities']:
-            logger.info('Processing ' + entity['type'] + ':' + entity['name'])
-            result = ec.gql_get_tags_with_metadata(per_api_key, entity['guid'])
-            mutableTags = []
-            for tag in result['response']['data']['actor']['entity']['tagsWithMetadata']:
-                if tag['values'][0]['mutable']:
-                    mutableTags.append(tag['key'])
-            logger.info(entity['name'] + ' mutable tags ' + json.dumps(mutableTags))
-    else:
+    if host_count == 0:
         logger.warning("No entities found matching domain INFRA type HOST")
 
 
+# counts the tags of the matching entities from the entity search pages, without a tag query per entity
+def tag_inventory(per_api_key, query=DEFAULT_INVENTORY_QUERY, output_format=taginventory.CSV):
+    inventory = taginventory.TagInventory()
+    entity_pager = ec.gql_iter_entities_matching(per_api_key, query)
+    for entities in entity_pager:
+        inventory.add(entities)
+    if entity_pager.error:
+        logger.error(json.dumps(entity_pager.error), utils.DEFAULT_INDENT)
+        logger.error("Error in executing NerdGraph query.")
+        return None
+    logger.info("Read the tags of " + str(inventory.entities) + " entities in " + str(entity_pager.pages) + " pages.")
+    inventory.save(TAG_INVENTORY_NAME, output_format)
+    return inventory
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Update tags for all entities from one value to another')
     setup_params(parser)
@@ -111,9 +335,13 @@ if __name__ == '__main__':
     if not personal_api_key:
         utils.error_and_exit('personalApiKey', 'ENV_PERSONAL_API_KEY')
     print_params()
-    if args.getAllInfraHostTags:
-        get_all_infra_tags(personal_api_key)
+    if args.tagInventory:
+        tag_inventory(personal_api_key, args.inventoryQuery[0], args.inventoryFormat[0])
+    elif args.getAllInfraHostTags:
+        get_all_infra_tags(personal_api_key, args.concurrency[0], args.skipImmutableHosts)
     elif args.rmAllInfraHostTags:
-        remove_all_infra_tags(personal_api_key)
+        remove_all_infra_tags(personal_api_key, args.concurrency[0], args.batchSize[0], args.dryRun, args.retries[0],
+                              args.restart, args.journalMaxAge[0], args.skipImmutableHosts)
     else:
-        update_tags(personal_api_key, args.delTagValues[0], args.addTags[0])
+        update_tags(personal_api_key, args.delTagValues[0], args.addTags[0], args.concurrency[0], args.batchSize[0],
+                    args.dryRun, args.retries[0], args.restart, args.journalMaxAge[0])
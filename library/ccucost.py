@@ -0,0 +1,61 @@
+import os
+import bisect
+from itertools import accumulate
+import library.nrpylogger as nrpy_logger
+
+# discounts listed for this accountId apply to every account without its own row
+ALL_ACCOUNTS = '*'
+ORGANIZATION = 'organization'
+ACCOUNT = 'account'
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# Tiered CCU price list, loaded from rows with fromCcu and pricePerCcu, each tier ends where the next one starts.
+# The cost of every tier boundary is accumulated once, so the cost of any usage is one bisect and one multiplication.
+class TierPricing:
+
+    def __init__(self, tier_rows):
+        tiers = sorted((float(row['fromCcu']), float(row['pricePerCcu'])) for row in tier_rows)
+        if not tiers or tiers[0][0] != 0:
+            tiers.insert(0, (0.0, 0.0))
+        self.starts = [start for start, price in tiers]
+        self.prices = [price for start, price in tiers]
+        widths = [end - start for start, end in zip(self.starts, self.starts[1:])]
+        self.start_costs = [0.0] + list(accumulate(width * price for width, price in zip(widths, self.prices)))
+
+    def cost(self, usage):
+        tier = bisect.bisect_right(self.starts, usage) - 1
+        return self.start_costs[tier] + (usage - self.starts[tier]) * self.prices[tier]
+
+    def costs(self, usages):
+        return [self.cost(usage) for usage in usages]
+
+
+# rows with accountId and discountPercent, returns { accountId : fraction of the cost that is paid }
+def paid_fractions(discount_rows):
+    return {str(row['accountId']): 1.0 - float(row['discountPercent']) / 100 for row in discount_rows}
+
+
+def paid_fraction(fractions, account_id):
+    return fractions.get(str(account_id), fractions.get(ALL_ACCOUNTS, 1.0))
+
+
+# Prices the CCU usage of each account. Tiers apply to the usage of the whole organization by default, or to each
+# account on its own with scope ACCOUNT. Either way the tiered cost is spread over the usage at its blended rate, so
+# the cost of a condition or policy is its usage times the rate of its account, less the account's discount.
+# returns { accountId : rate per ccu }
+def account_rates(usage_by_account, pricing, fractions, scope=ORGANIZATION):
+    rates = {}
+    if scope == ORGANIZATION:
+        total_usage = sum(usage_by_account.values())
+        organization_rate = pricing.cost(total_usage) / total_usage if total_usage else 0.0
+        blended_rates = {account_id: organization_rate for account_id in usage_by_account}
+    else:
+        account_ids = list(usage_by_account)
+        usages = [usage_by_account[account_id] for account_id in account_ids]
+        blended_rates = {account_id: cost / usage if usage else 0.0
+                         for account_id, usage, cost in zip(account_ids, usages, pricing.costs(usages))}
+    for account_id, rate in blended_rates.items():
+        rates[account_id] = rate * paid_fraction(fractions, account_id)
+    return rates
@@ -0,0 +1,79 @@
+import os
+import re
+import heapq
+import itertools
+import library.nrpylogger as nrpy_logger
+
+DEFAULT_TOP_K = 100
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+WHITESPACE = re.compile(r'\s+')
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# NRQL with its literals replaced by ? so conditions differing only in names, ids or thresholds share a pattern
+def nrql_pattern(query):
+    pattern = STRING_LITERAL.sub('?', query or '')
+    pattern = NUMBER_LITERAL.sub('?', pattern)
+    return WHITESPACE.sub(' ', pattern).strip()
+
+
+# Sums CCU usage per account, policy and NRQL pattern and keeps the top_k conditions with the most usage while the
+# report rows are produced. Memory grows with the number of accounts, policies and patterns, not with the rows.
+class CcuRollup:
+
+    def __init__(self, top_k=DEFAULT_TOP_K):
+        self.top_k = top_k
+        self.by_account = {}
+        self.by_policy = {}
+        self.by_pattern = {}
+        self.rows = 0
+        self._top = []
+        self._sequence = itertools.count()
+
+    def add(self, row):
+        usage = float(row['ccuConsumption'])
+        self.rows += 1
+        self._add_to(self.by_account, str(row['accountId']), usage)
+        self._add_to(self.by_policy, (str(row['accountId']), str(row['policyId'])), usage)
+        self._add_to(self.by_pattern, nrql_pattern(row['conditionQuery']), usage)
+        # a min heap of the top_k largest, the smallest of them is dropped when a larger row comes in
+        entry = (usage, next(self._sequence), row)
+        if len(self._top) < self.top_k:
+            heapq.heappush(self._top, entry)
+        elif usage > self._top[0][0]:
+            heapq.heapreplace(self._top, entry)
+
+    def add_all(self, rows):
+        for row in rows:
+            self.add(row)
+
+    # the top_k rows, most usage first
+    def top(self):
+        return [row for usage, sequence, row in sorted(self._top, key=lambda entry: (-entry[0], entry[1]))]
+
+    def account_rows(self):
+        return [{'accountId': account_id, 'conditions': count, 'ccuConsumption': usage}
+                for account_id, (usage, count) in self._descending(self.by_account)]
+
+    def policy_rows(self):
+        return [{'accountId': account_id, 'policyId': policy_id, 'conditions': count, 'ccuConsumption': usage}
+                for (account_id, policy_id), (usage, count) in self._descending(self.by_policy)]
+
+    def pattern_rows(self):
+        return [{'queryPattern': pattern, 'conditions': count, 'ccuConsumption': usage}
+                for pattern, (usage, count) in self._descending(self.by_pattern)]
+
+    @staticmethod
+    def _add_to(totals, key, usage):
+        total = totals.get(key)
+        if total is None:
+            totals[key] = [usage, 1]
+        else:
+            total[0] += usage
+            total[1] += 1
+
+    @staticmethod
+    def _descending(totals):
+        return sorted(totals.items(), key=lambda item: -item[1][0])
@@ -0,0 +1,49 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+import library.nrpylogger as nrpy_logger
+
+DEFAULT_CHECKPOINT_FILE = 'db/checkpoints.sqlite'
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# Persists the partial results of each queried time window, keyed by a hash of the query and the window bounds,
+# so an interrupted or scheduled export only has to query the windows it does not already have.
+class CheckpointStore:
+
+    def __init__(self, file_name=DEFAULT_CHECKPOINT_FILE):
+        Path(file_name).parent.mkdir(mode=0o777, parents=True, exist_ok=True)
+        self.file_name = file_name
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS windows (query_hash TEXT, since_ms INTEGER, '
+                                'until_ms INTEGER, results TEXT, saved_at INTEGER, '
+                                'PRIMARY KEY (query_hash, since_ms, until_ms))')
+        self.connection.commit()
+
+    @staticmethod
+    def query_hash(*query_parts):
+        return hashlib.sha256(json.dumps(query_parts, sort_keys=True).encode()).hexdigest()
+
+    def save(self, query_hash, window, results):
+        self.connection.execute('INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?)',
+                                (query_hash, window[0], window[1], json.dumps(results), int(time.time())))
+        self.connection.commit()
+
+    def windows(self, query_hash, start_ms, end_ms):
+        cursor = self.connection.execute('SELECT since_ms, until_ms FROM windows WHERE query_hash = ? '
+                                         'AND since_ms >= ? AND until_ms <= ?', (query_hash, start_ms, end_ms))
+        return [(row[0], row[1]) for row in cursor]
+
+    def load(self, query_hash, window):
+        row = self.connection.execute('SELECT results FROM windows WHERE query_hash = ? AND since_ms = ? '
+                                      'AND until_ms = ?', (query_hash, window[0], window[1])).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def close(self):
+        self.connection.close()
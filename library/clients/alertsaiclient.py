@@ -5,6 +5,7 @@ import library.utils as utils
 import library.localstore as store
 import library.nrpylogger as nrpy_logger
 import library.clients.gql as nerdgraph
+import library.clients.pager as pager
 
 logger = nrpy_logger.get_logger(os.path.basename(__file__))
 
@@ -26,149 +27,139 @@ class AlertsAI:
         logger.debug(json.dumps(payload))
         return nerdgraph.GraphQl.post(nr_user_api_key, payload)
 
+    @staticmethod
+    def get_all_conditions_nrql(nr_user_api_key, accountId, nextCursor):
+        payload = AlertsAI.get_all_conditions_payload(accountId, nextCursor)
+        logger.debug(json.dumps(payload))
+        return nerdgraph.GraphQl.post(nr_user_api_key, payload)
+
+    @staticmethod
     def get_all_policies_payload(accountId, nextCursor=None):
-        if nextCursor:
-            policy_query = '''query ($accountId:Int!) {
-                  actor {
-                    account(id: $accountId) {
-                      alerts {
-                        policiesSearch(cursor: "%s") {
-                          policies {
-                            id
-                            name
-                          }
-                          nextCursor
-                          totalCount
-                        }
-                      }
-                    }
-                  }
-                }
-                ''' % (nextCursor)
-            variables = {'accountId': accountId}
-        else:
-            policy_query = '''query($accountId: Int!) {
-                                actor {
+        policy_query = '''query($accountId: Int!, $cursor: String) {
+                            actor {
+                                account(id: $accountId) {
+                                  alerts {
+                                    policiesSearch(cursor: $cursor) {
+                                      policies {
+                                        id
+                                        name
+                                      }
+                                      nextCursor
+                                      totalCount
+                                    }
+                                  }
+                                }
+                              }
+                            }'''
+        variables = {'accountId': accountId, 'cursor': nextCursor}
+        return {'query': policy_query, 'variables': variables}
+
+    @staticmethod
+    def get_policy_conditions_payload(accountId, policyId, policyName, nextCursor=None):
+        conditions_query = AlertsAI._conditions_query()
+        variables = {'accountId': accountId, 'policyId': policyId, 'cursor': nextCursor}
+        return {'query': conditions_query, 'variables': variables}
+
+    @staticmethod
+    def get_all_conditions_payload(accountId, nextCursor=None):
+        variables = {'accountId': accountId, 'cursor': nextCursor}
+        return {'query': AlertsAI._conditions_query(False), 'variables': variables}
+
+    # searches the conditions of one policy, or of the whole account when policy_criteria is False
+    @staticmethod
+    def _conditions_query(policy_criteria=True):
+        variable_declarations, search_criteria = '', ''
+        if policy_criteria:
+            variable_declarations, search_criteria = '$policyId: ID, ', 'searchCriteria: {policyId: $policyId}, '
+        return """query ($accountId: Int!, %s$cursor: String) {
+                                  actor {
                                     account(id: $accountId) {
                                       alerts {
-                                        policiesSearch {
-                                          policies {
+                                        nrqlConditionsSearch(%scursor: $cursor) {
+                                          nextCursor
+                                          nrqlConditions {
+                                            description
+                                            enabled
+                                            expiration {
+                                              closeViolationsOnExpiration
+                                              expirationDuration
+                                              openViolationOnExpiration
+                                            }
                                             id
                                             name
+                                            nrql {
+                                              evaluationOffset
+                                              query
+                                            }
+                                            policyId
+                                            runbookUrl
+                                            signal {
+                                              aggregationDelay
+                                              aggregationMethod
+                                              aggregationTimer
+                                              aggregationWindow
+                                              evaluationDelay
+                                              evaluationOffset
+                                              fillOption
+                                              fillValue
+                                              slideBy
+                                            }
+                                            terms {
+                                              operator
+                                              priority
+                                              threshold
+                                              thresholdDuration
+                                              thresholdOccurrences
+                                            }
+                                            type
+                                            violationTimeLimit
+                                            violationTimeLimitSeconds
                                           }
-                                          nextCursor
                                           totalCount
                                         }
                                       }
                                     }
                                   }
-                                }'''
-            variables = {'accountId': accountId}
-        return {'query': policy_query, 'variables': variables}
+                                }""" % (variable_declarations, search_criteria)
 
-    def get_policy_conditions_payload(accountId, policyId, policyName, nextCursor=None):
-        if nextCursor:
-            conditions_query = """query ($accountId: Int!, $policyId: ID) {
-                                                  actor {
-                                                    account(id: $accountId) {
-                                                      alerts {
-                                                        nrqlConditionsSearch(searchCriteria: {policyId: $policyId}, cursor: "%s") {
-                                                          nextCursor
-                                                          nrqlConditions {
-                                                            description
-                                                            enabled
-                                                            expiration {
-                                                              closeViolationsOnExpiration
-                                                              expirationDuration
-                                                              openViolationOnExpiration
-                                                            }
-                                                            id
-                                                            name
-                                                            nrql {
-                                                              evaluationOffset
-                                                              query
-                                                            }
-                                                            policyId
-                                                            runbookUrl
-                                                            signal {
-                                                              aggregationDelay
-                                                              aggregationMethod
-                                                              aggregationTimer
-                                                              aggregationWindow
-                                                              evaluationDelay
-                                                              evaluationOffset
-                                                              fillOption
-                                                              fillValue
-                                                              slideBy
-                                                            }
-                                                            terms {
-                                                              operator
-                                                              priority
-                                                              threshold
-                                                              thresholdDuration
-                                                              thresholdOccurrences
-                                                            }
-                                                            type
-                                                            violationTimeLimit
-                                                            violationTimeLimitSeconds
-                                                          }
-                                                          totalCount
-                                                        }
-                                                      }
-                                                    }
-                                                  }
-                                                }""" % nextCursor
-            variables = {'accountId': accountId, 'policyId': policyId}
-        else:
-            conditions_query = """query ($accountId: Int!, $policyId: ID) {
-                                      actor {
-                                        account(id: $accountId) {
-                                          alerts {
-                                            nrqlConditionsSearch(searchCriteria: {policyId: $policyId}) {
-                                              nextCursor
-                                              nrqlConditions {
-                                                description
-                                                enabled
-                                                expiration {
-                                                  closeViolationsOnExpiration
-                                                  expirationDuration
-                                                  openViolationOnExpiration
-                                                }
-                                                id
-                                                name
-                                                nrql {
-                                                  evaluationOffset
-                                                  query
-                                                }
-                                                policyId
-                                                runbookUrl
-                                                signal {
-                                                  aggregationDelay
-                                                  aggregationMethod
-                                                  aggregationTimer
-                                                  aggregationWindow
-                                                  evaluationDelay
-                                                  evaluationOffset
-                                                  fillOption
-                                                  fillValue
-                                                  slideBy
-                                                }
-                                                terms {
-                                                  operator
-                                                  priority
-                                                  threshold
-                                                  thresholdDuration
-                                                  thresholdOccurrences
-                                                }
-                                                type
-                                                violationTimeLimit
-                                                violationTimeLimitSeconds
-                                              }
-                                              totalCount
-                                            }
-                                          }
-                                        }
-                                      }
-                                    }"""
-            variables = {'accountId': accountId, 'policyId': policyId}
-        return {'query': conditions_query, 'variables': variables}
\ No newline at end of file
+    @staticmethod
+    def policies_pager(nr_user_api_key, accountId):
+        return pager.CursorPager(lambda cursor: AlertsAI.get_all_policies_nrql(nr_user_api_key, accountId, cursor),
+                                 AlertsAI._extract_policies_page)
+
+    @staticmethod
+    def policy_conditions_pager(nr_user_api_key, accountId, policyId, policyName):
+        return pager.CursorPager(lambda cursor: AlertsAI.get_policy_conditions_nrql(nr_user_api_key, accountId,
+                                                                                    policyId, policyName, cursor),
+                                 AlertsAI._extract_conditions_page)
+
+    # every nrql condition of the account, whatever its policy
+    @staticmethod
+    def conditions_pager(nr_user_api_key, accountId):
+        return pager.CursorPager(lambda cursor: AlertsAI.get_all_conditions_nrql(nr_user_api_key, accountId, cursor),
+                                 AlertsAI._extract_conditions_page)
+
+    @staticmethod
+    def _extract_policies_page(response_json):
+        policies = response_json['data']['actor']['account']['alerts']['policiesSearch']
+        return policies['policies'], policies['nextCursor']
+
+    @staticmethod
+    def _extract_conditions_page(response_json):
+        conditions = response_json['data']['actor']['account']['alerts']['nrqlConditionsSearch']
+        return conditions['nrqlConditions'], conditions['nextCursor']
+
+class AsyncAlertsAI:
+
+    def __init__(self, async_gql=None):
+        self.gql = async_gql or nerdgraph.AsyncGraphQl()
+
+    async def get_all_policies_nrql(self, nr_user_api_key, accountId, nextCursor):
+        return await self.gql.run(AlertsAI.get_all_policies_nrql, nr_user_api_key, accountId, nextCursor)
+
+    async def get_policy_conditions_nrql(self, nr_user_api_key, accountId, policyId, policyName, nextCursor):
+        return await self.gql.run(AlertsAI.get_policy_conditions_nrql, nr_user_api_key, accountId, policyId,
+                                  policyName, nextCursor)
+
+    async def get_all_conditions_nrql(self, nr_user_api_key, accountId, nextCursor):
+        return await self.gql.run(AlertsAI.get_all_conditions_nrql, nr_user_api_key, accountId, nextCursor)
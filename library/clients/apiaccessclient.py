@@ -56,3 +56,15 @@ class ApiAccess:
         variables = {'accountIds': [account_id],'userIds': [user_id] }
         return {'query': query, 'variables': variables}
 
+
+class AsyncApiAccess:
+
+    def __init__(self, async_gql=None):
+        self.gql = async_gql or nerdgraph.AsyncGraphQl()
+
+    async def get_user_api_key(self, user_api_key, account_id, user_id):
+        return await self.gql.run(ApiAccess.get_user_api_key, user_api_key, account_id, user_id)
+
+    async def create_user_api_key(self, user_api_key, account_id, user_id, api_key_name, notes):
+        return await self.gql.run(ApiAccess.create_user_api_key, user_api_key, account_id, user_id, api_key_name,
+                                  notes)
@@ -5,6 +5,16 @@ import library.utils as utils
 import library.localstore as store
 import library.nrpylogger as nrpy_logger
 import library.clients.gql as nerdgraph
+import library.clients.gqlbatch as gqlbatch
+import library.responsecache as responsecache
+
+CONDITION_DETAILS_BATCH_SIZE = 50
+CONDITION_DETAILS_BATCH = gqlbatch.AliasBatch('c', {'conditionId': 'ID!'},
+                                              'nrqlCondition(id: $conditionId) { policyId name nrql { query } }',
+                                              envelope='actor { account(id: $accountId) { alerts { %s } } }',
+                                              path=('actor', 'account', 'alerts'),
+                                              shared_variables={'accountId': 'Int!'},
+                                              batch_size=CONDITION_DETAILS_BATCH_SIZE)
 
 logger = nrpy_logger.get_logger(os.path.basename(__file__))
 
@@ -15,8 +25,8 @@ class CCUConsumption:
         pass
 
     @staticmethod
-    def get_ccu_consumption(nr_user_api_key, accountId, start, end):
-        payload = CCUConsumption.get_ccu_consumption_payload(accountId, start, end)
+    def get_ccu_consumption(nr_user_api_key, accountId, start, end, condition_suffix=None):
+        payload = CCUConsumption.get_ccu_consumption_payload(accountId, start, end, condition_suffix)
         logger.debug(json.dumps(payload))
         return nerdgraph.GraphQl.post(nr_user_api_key, payload)
 
@@ -24,28 +34,52 @@ class CCUConsumption:
     def get_current_user_all_accounts(nr_user_api_key):
         payload = CCUConsumption.get_all_accounts_payload()
         logger.debug(json.dumps(payload))
-        return nerdgraph.GraphQl.post(nr_user_api_key, payload)
+        return responsecache.cached('currentUserAccounts', nr_user_api_key, [],
+                                    lambda: nerdgraph.GraphQl.post(nr_user_api_key, payload))
 
 
     @staticmethod
     def get_condition_details(nr_user_api_key,accountId, conditionId):
         payload = CCUConsumption.get_condition_details_payload(accountId, conditionId)
         logger.debug(json.dumps(payload))
-        return nerdgraph.GraphQl.post(nr_user_api_key, payload)
+        return responsecache.cached('conditionDetails', nr_user_api_key, [accountId, conditionId, 'single'],
+                                    lambda: nerdgraph.GraphQl.post(nr_user_api_key, payload))
+
+    # returns one result per conditionId, result['response'] is the nrqlCondition or None if it does not exist
+    @staticmethod
+    def get_conditions_details(nr_user_api_key, accountId, conditionIds):
+        return responsecache.cached_each('conditionDetails', nr_user_api_key, [accountId], conditionIds,
+                                         lambda missed: CONDITION_DETAILS_BATCH.post(nr_user_api_key, missed,
+                                                                                     {'accountId': accountId}))
 
+    # start, end : quoted as dates when strings, used as epoch milliseconds when numbers
+    # condition_suffix : only the conditions whose id ends with it, to split accounts with more conditions than a
+    # single query returns
     @staticmethod
-    def get_ccu_consumption_payload(accountId, start, end):
-        ccu_consumption_query = '''query($accountId: [Int!]!) {
+    def get_ccu_consumption_payload(accountId, start, end, condition_suffix=None):
+        ccu_consumption_query = '''query($accountId: [Int!]!, $nrqlQuery: Nrql!) {
                                   actor {
                                     nrql(
-                                      query: "FROM NrComputeUsage SELECT sum(usage) WHERE dimension_productCapability = 'Alert Conditions' FACET dimension_conditionId SINCE '%s' UNTIL '%s' LIMIT MAX"
+                                      query: $nrqlQuery
                                       accounts: $accountId
                                     ) {
                                       results
                                     }
                                   }
-                                }''' % (start, end)
-        return {'query': ccu_consumption_query, 'variables': {'accountId': accountId}}
+                                }'''
+        condition_filter = ''
+        if condition_suffix:
+            condition_filter = " AND dimension_conditionId LIKE '%" + condition_suffix + "'"
+        nrql = "FROM NrComputeUsage SELECT sum(usage) WHERE dimension_productCapability = 'Alert Conditions'" + \
+               condition_filter + " FACET dimension_conditionId SINCE " + CCUConsumption._time_literal(start) + \
+               " UNTIL " + CCUConsumption._time_literal(end) + " LIMIT MAX"
+        return {'query': ccu_consumption_query, 'variables': {'accountId': accountId, 'nrqlQuery': nrql}}
+
+    @staticmethod
+    def _time_literal(time_value):
+        if isinstance(time_value, str):
+            return "'" + time_value + "'"
+        return str(time_value)
 
     @staticmethod
     def get_all_accounts_payload():
@@ -77,3 +111,22 @@ class CCUConsumption:
                                       }
                                     }''' % conditionId
         return {'query': condition_details_query, 'variables': {'accountId': accountId}}
+
+
+class AsyncCCUConsumption:
+
+    def __init__(self, async_gql=None):
+        self.gql = async_gql or nerdgraph.AsyncGraphQl()
+
+    async def get_ccu_consumption(self, nr_user_api_key, accountId, start, end, condition_suffix=None):
+        return await self.gql.run(CCUConsumption.get_ccu_consumption, nr_user_api_key, accountId, start, end,
+                                  condition_suffix)
+
+    async def get_current_user_all_accounts(self, nr_user_api_key):
+        return await self.gql.run(CCUConsumption.get_current_user_all_accounts, nr_user_api_key)
+
+    async def get_condition_details(self, nr_user_api_key, accountId, conditionId):
+        return await self.gql.run(CCUConsumption.get_condition_details, nr_user_api_key, accountId, conditionId)
+
+    async def get_conditions_details(self, nr_user_api_key, accountId, conditionIds):
+        return await self.gql.run(CCUConsumption.get_conditions_details, nr_user_api_key, accountId, conditionIds)
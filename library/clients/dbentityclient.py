@@ -4,6 +4,7 @@ import os
 import library.utils as utils
 import library.nrpylogger as nrpy_logger
 import library.clients.gql as nerdgraph
+import library.clients.pager as pager
 
 logger = nrpy_logger.get_logger(os.path.basename(__file__))
 
@@ -19,6 +20,12 @@ class DashboardEntity:
         logger.debug(json.dumps(payload))
         return nerdgraph.GraphQl.post(user_api_key, payload)
 
+    # yields pages of the outlines of the dashboards of an account, the pages of multi page dashboards are left out
+    @staticmethod
+    def iter_dashboards(user_api_key, account_id):
+        return pager.CursorPager(lambda cursor: nerdgraph.GraphQl.post(
+            user_api_key, DashboardEntity._dashboards_payload(account_id, cursor)), DashboardEntity._extract_dashboards)
+
     @staticmethod
     def get_pages_widgets(user_api_key, guid):
         payload = DashboardEntity._get_pages_widgets_payload(guid)
@@ -82,6 +89,35 @@ class DashboardEntity:
         variables = {'guid': guid}
         return {'query': dashboard_query, 'variables': variables}
 
+    @staticmethod
+    def _dashboards_payload(account_id, cursor=None):
+        dashboards_query = '''query($query: String!, $cursor: String) {
+                                actor {
+                                    entitySearch(query: $query) {
+                                        count
+                                        results(cursor: $cursor) {
+                                            nextCursor
+                                            entities {
+                                                ... on DashboardEntityOutline {
+                                                    guid
+                                                    name
+                                                    accountId
+                                                    dashboardParentGuid
+                                                }
+                                            }
+                                        }
+                                    }
+                                }
+                            }'''
+        variables = {'query': "type = 'DASHBOARD' AND accountId = '" + str(account_id) + "'", 'cursor': cursor}
+        return {'query': dashboards_query, 'variables': variables}
+
+    @staticmethod
+    def _extract_dashboards(gql_rsp_json):
+        results = gql_rsp_json['data']['actor']['entitySearch']['results']
+        dashboards = [entity for entity in results['entities'] if entity and not entity.get('dashboardParentGuid')]
+        return dashboards, results['nextCursor']
+
     @staticmethod
     def _get_pages_widgets_payload(guid):
         dashboard_query = '''query($guid: EntityGuid!) { 
@@ -106,3 +142,21 @@ class DashboardEntity:
                                 }'''
         variables = {'guid': guid}
         return {'query': dashboard_query, 'variables': variables}
+
+
+class AsyncDashboardEntity:
+
+    def __init__(self, async_gql=None):
+        self.gql = async_gql or nerdgraph.AsyncGraphQl()
+
+    async def get(self, user_api_key, guid):
+        return await self.gql.run(DashboardEntity.get, user_api_key, guid)
+
+    async def get_pages_widgets(self, user_api_key, guid):
+        return await self.gql.run(DashboardEntity.get_pages_widgets, user_api_key, guid)
+
+    async def create(self, user_api_key, account_id, dashboard):
+        return await self.gql.run(DashboardEntity.create, user_api_key, account_id, dashboard)
+
+    async def update_page_widgets(self, user_api_key, page_guid, widgets):
+        return await self.gql.run(DashboardEntity.update_page_widgets, user_api_key, page_guid, widgets)
@@ -1,9 +1,12 @@
-import requests
 import json
 import os
 import library.utils as utils
 import library.nrpylogger as nrpy_logger
 import library.clients.gql as nerdgraph
+import library.clients.gqlbatch as gqlbatch
+import library.clients.pager as pager
+import library.ratelimiter as ratelimiter
+import library.responsecache as responsecache
 
 SHOW_APM_APP_URL = 'https://api.newrelic.com/v2/applications/'
 GET_APM_APP_URL = 'https://api.newrelic.com/v2/applications.json'
@@ -20,19 +23,49 @@ APM_EXT_SVC = 'APM_EXT_SVC'
 MOBILE_APP = 'MOBILE_APP'
 MONITOR = 'MONITOR'
 DASHBOARD = 'DASHBOARD'
+TAGS_WITH_METADATA_BATCH = gqlbatch.AliasBatch('e', {'guid': 'EntityGuid!'},
+                                               'entity(guid: $guid) { '
+                                               'tagsWithMetadata { key values { mutable value } } }')
 
 logger = nrpy_logger.get_logger(os.path.basename(__file__))
 
 
+# only found entities are cached, an entity created after a failed lookup is found the next time it is looked up
+def found_cacheable(result):
+    return responsecache.default_cacheable(result) and result.get('entityFound', False)
+
+
+# aliased tagging mutation of several entities in one document, each entity has a guid and a tags_variable
+def tag_mutation_batch(mutation, tags_variable, tags_type):
+    return gqlbatch.AliasBatch('m', {'guid': 'EntityGuid!', tags_variable: tags_type},
+                               mutation + '(guid: $guid, ' + tags_variable + ': $' + tags_variable + ') '
+                               '{ errors { message type } }', envelope='%s', path=(), operation='mutation')
+
+
+ADD_TAGS_BATCH = tag_mutation_batch('taggingAddTagsToEntity', 'tags', '[TaggingTagInput!]!')
+REPLACE_TAGS_BATCH = tag_mutation_batch('taggingReplaceTagsOnEntity', 'tags', '[TaggingTagInput!]!')
+DELETE_TAG_VALUES_BATCH = tag_mutation_batch('taggingDeleteTagValuesFromEntity', 'tagValues',
+                                             '[TaggingTagValueInput!]!')
+DELETE_TAG_KEYS_BATCH = tag_mutation_batch('taggingDeleteTagFromEntity', 'tagKeys', '[String!]!')
+
+
+# entity_index : optional EntityIndex, matching calls for the accounts and types it covers are resolved from it
 class EntityClient:
 
-    def __init__(self):
-        pass
+    def __init__(self, entity_index=None):
+        self.entity_index = entity_index
 
     def get_matching_kt(self, tgt_api_key, kt_name):
+        if self.entity_index and self.entity_index.covers_key_transactions(tgt_api_key):
+            kt = self.entity_index.find_key_transaction(tgt_api_key, kt_name)
+            result = {'status': 200, 'entityFound': kt is not None}
+            if kt is not None:
+                result['entity'] = kt
+            return result
         filter_params = {'filter[name]': kt_name}
         result = {'entityFound': False}
-        response = requests.get(GET_APM_KT_URL, headers=self._rest_api_headers(tgt_api_key), params=filter_params)
+        response = ratelimiter.request(tgt_api_key, 'get', GET_APM_KT_URL, headers=self._rest_api_headers(tgt_api_key),
+                                       params=filter_params)
         result['status'] = response.status_code
         if response.text:
             response_json = response.json()
@@ -44,45 +77,39 @@ class EntityClient:
 
     def gql_get_matching_entity(self, api_key, entity_type, src_entity, tgt_account_id):
         logger.info('looking for matching entity ' + src_entity['name'] + ' in account ' + tgt_account_id)
-        payload = self._entity_by_name_payload(entity_type, src_entity['name'])
-        result = {'entityFound': False}
-        response = requests.post(nerdgraph.URL, headers=nerdgraph.GraphQl.headers(api_key), data=json.dumps(payload))
-        result['status'] = response.status_code
-        if response.text:
-            response_json = response.json()
-            if 'errors' in response_json:
-                if response.text:
-                    result['error'] = response_json['errors']
-                logger.error(result)
-            else:
-                result['count'] = response_json['data']['actor']['entitySearch']['count']
-                result['entities'] = self._extract_entities(response_json)
-                if result['count'] > 0:
-                    self._set_matched_entity(result['entities'], entity_type, result, src_entity, tgt_account_id)
+        if self._indexed(tgt_account_id, entity_type):
+            result = self._indexed_search(tgt_account_id, entity_type, src_entity['name'])
         else:
-            logger.warn('No response for this query response received ' + str(response))
+            result = self._entity_search(api_key, lambda cursor: self._entity_by_name_payload(entity_type,
+                                                                                              src_entity['name'],
+                                                                                              cursor))
+        result['entityFound'] = False
+        if 'error' in result:
+            logger.error(result)
+        elif result['count'] > 0:
+            self._set_matched_entity(result['entities'], entity_type, result, src_entity, tgt_account_id)
         logger.info('entity match result : ' + str(result))
         return result
 
     def gql_get_matching_entity_by_name(self, api_key, entity_type, name, tgt_acct_id):
+        if self._indexed(tgt_acct_id, entity_type):
+            return self._matching_entity_by_name(api_key, entity_type, name, tgt_acct_id)
+        return responsecache.cached('entityByName', api_key, [entity_type, name, tgt_acct_id],
+                                    lambda: self._matching_entity_by_name(api_key, entity_type, name, tgt_acct_id),
+                                    found_cacheable)
+
+    def _matching_entity_by_name(self, api_key, entity_type, name, tgt_acct_id):
         logger.info('Searching matching entity for type:' + entity_type + ', name:' + name + ', acct:' + tgt_acct_id)
-        payload = self._entity_by_name_payload(entity_type, name)
-        result = {'entityFound': False}
-        response = requests.post(nerdgraph.URL, headers=nerdgraph.GraphQl.headers(api_key), data=json.dumps(payload))
-        result['status'] = response.status_code
-        if response.text:
-            response_json = response.json()
-            if 'errors' in response_json:
-                if response.text:
-                    result['error'] = response_json['errors']
-                logger.error(result)
-            else:
-                result['count'] = response_json['data']['actor']['entitySearch']['count']
-                result['entities'] = self._extract_entities(response_json)
-                if result['count'] > 0:
-                    self._set_matched_entity_by_name(tgt_acct_id, entity_type, name, result)
+        if self._indexed(tgt_acct_id, entity_type):
+            result = self._indexed_search(tgt_acct_id, entity_type, name)
         else:
-            logger.warn('No response for this query response received ' + str(response))
+            result = self._entity_search(api_key,
+                                         lambda cursor: self._entity_by_name_payload(entity_type, name, cursor))
+        result['entityFound'] = False
+        if 'error' in result:
+            logger.error(result)
+        elif result['count'] > 0:
+            self._set_matched_entity_by_name(tgt_acct_id, entity_type, name, result)
         logger.info('entity match result : ' + str(result))
         return result
 
@@ -97,9 +124,13 @@ class EntityClient:
         return {'entityFound': False}
 
     def get_app_entity(self, api_key, entity_type, app_id):
+        return responsecache.cached('appEntity', api_key, [entity_type, app_id],
+                                    lambda: self._app_entity(api_key, entity_type, app_id), found_cacheable)
+
+    def _app_entity(self, api_key, entity_type, app_id):
         result = {'entityFound': False}
         get_url = self._show_url_for_app(entity_type, app_id)
-        response = requests.get(get_url, headers=self._rest_api_headers(api_key))
+        response = ratelimiter.request(api_key, 'get', get_url, headers=self._rest_api_headers(api_key))
         result['status'] = response.status_code
         if response.status_code != 200:
             if response.text:
@@ -113,7 +144,8 @@ class EntityClient:
     def get_apm_entity_by_name(self, api_key, app_name):
         params = {'filter[name]': app_name}
         result = {'entityFound': False}
-        response = requests.get(GET_APM_APP_URL, headers=self._rest_api_headers(api_key), params=params)
+        response = ratelimiter.request(api_key, 'get', GET_APM_APP_URL, headers=self._rest_api_headers(api_key),
+                                       params=params)
         result['status'] = response.status_code
         if response.status_code != 200:
             if response.text:
@@ -133,7 +165,7 @@ class EntityClient:
         params = {'filter[ids]': [app_id]}
         result = {'entityFound': False}
         get_url = GET_BROWSER_APP_URL
-        response = requests.get(get_url, headers=self._rest_api_headers(api_key), params=params)
+        response = ratelimiter.request(api_key, 'get', get_url, headers=self._rest_api_headers(api_key), params=params)
         logger.info(response.url)
         result['status'] = response.status_code
         if response.status_code != 200:
@@ -155,7 +187,7 @@ class EntityClient:
     def get_apm_kt(self, api_key, kt_id):
         result = {'entityFound': False}
         get_url = SHOW_APM_KT_URL + kt_id + '.json'
-        response = requests.get(get_url, headers=self._rest_api_headers(api_key))
+        response = ratelimiter.request(api_key, 'get', get_url, headers=self._rest_api_headers(api_key))
         result['status'] = response.status_code
         if response.status_code != 200:
             if response.text:
@@ -181,8 +213,8 @@ class EntityClient:
         }
         result = {}
         update_app_url = SHOW_APM_APP_URL + str(app_id) + '.json'
-        response = requests.put(update_app_url, headers=self._rest_api_headers(api_key),
-                                data=json.dumps(updated_settings))
+        response = ratelimiter.request(api_key, 'put', update_app_url, headers=self._rest_api_headers(api_key),
+                                       data=json.dumps(updated_settings))
         result['status'] = response.status_code
         if response.status_code in [200, 204] and response.text:
             result['application'] = response.json()['application']
@@ -206,6 +238,24 @@ class EntityClient:
         payload = self._replace_tags_payload(entity_guid, arr_label_keys)
         return nerdgraph.GraphQl.post(per_api_key, payload)
 
+    # The batch variants take a list of (entity_guid, tags) and send up to gqlbatch.DEFAULT_BATCH_SIZE entities per
+    # request. They return one result per entity, in order, result['response'] holds the mutation errors of the entity.
+    def gql_mutate_add_tags_batch(self, per_api_key, guids_and_label_keys):
+        return ADD_TAGS_BATCH.post(per_api_key, [{'guid': guid, 'tags': self._tags_arr_from(tags)}
+                                                 for guid, tags in guids_and_label_keys])
+
+    def gql_mutate_replace_tags_batch(self, per_api_key, guids_and_label_keys):
+        return REPLACE_TAGS_BATCH.post(per_api_key, [{'guid': guid, 'tags': self._tags_arr_from(tags)}
+                                                     for guid, tags in guids_and_label_keys])
+
+    def gql_mutate_delete_tag_values_batch(self, per_api_key, guids_and_tags):
+        return DELETE_TAG_VALUES_BATCH.post(per_api_key, [{'guid': guid, 'tagValues': self._tagvalues_payload(tags)}
+                                                          for guid, tags in guids_and_tags])
+
+    def gql_mutate_delete_tag_keys_batch(self, per_api_key, guids_and_keys):
+        return DELETE_TAG_KEYS_BATCH.post(per_api_key, [{'guid': guid, 'tagKeys': keys}
+                                                        for guid, keys in guids_and_keys])
+
     def gql_get_tags(self, per_api_key, entity_guid):
         entity_tags_query = '''query($entityGuid: EntityGuid!) { 
                                     actor {
@@ -239,48 +289,58 @@ class EntityClient:
         payload = {'query': entity_tags_query, 'variables': variables}
         return nerdgraph.GraphQl.post(per_api_key, payload)
 
+    # returns one result per guid, result['response'] is the entity with its tagsWithMetadata
+    def gql_get_tags_with_metadata_batch(self, per_api_key, entity_guids):
+        return TAGS_WITH_METADATA_BATCH.post(per_api_key, entity_guids)
+
+    # yields pages of entities, use gql_get_entities_of_type to collect all of them
+    def gql_iter_entities_of_type(self, per_api_key, domain, ent_type):
+        return self._entity_search_pager(per_api_key,
+                                         lambda cursor: self._entities_of_type_payload(domain, ent_type, cursor))
+
     def gql_get_entities_of_type(self, per_api_key, domain, ent_type):
-        query = '''query($domain: String!, $ent_type: String!) { 
-                        actor {
-                                entitySearch(queryBuilder: {domain: $domain, type: $ent_type}) {
-                                  count
-                                  results {
-                                    nextCursor
-                                    entities {
-                                      accountId
-                                      guid
-                                      name
-                                      type
-                                    }
-                                  }
-                                }
-                        }
-                    }'''
-        variables = {'domain': domain, 'ent_type': ent_type}
-        payload = {'query': query, 'variables': variables}
-        response = nerdgraph.GraphQl.post(per_api_key, payload)
-        result = {'status': response['status']}
-        if 'errors' in response:
-            result['error'] = response['errors']
-            return result
-        result['count'] = response['response']['data']['actor']['entitySearch']['count']
-        result['entities'] = response['response']['data']['actor']['entitySearch']['results']['entities']
-        return result
+        return self._entity_search(per_api_key, lambda cursor: self._entities_of_type_payload(domain, ent_type, cursor))
+
+    def gql_iter_entities_with_tags(self, per_api_key, tags_arr):
+        return self._entity_search_pager(per_api_key, lambda cursor: self._entities_by_tags_payload(tags_arr, cursor))
+
+    # yields pages of the entities matching an entitySearch query, with their tags inline
+    def gql_iter_entities_matching(self, per_api_key, query):
+        return self._entity_search_pager(per_api_key, lambda cursor: self._all_entities_payload_for(query, cursor))
+
+    # yields pages of the entity outlines of one type in an account, used to build an EntityIndex
+    def gql_iter_entities_in_account(self, per_api_key, entity_type, account_id):
+        return self._entity_search_pager(per_api_key, lambda cursor: self._matching_condition_payload(
+            entity_type, "accountId = '" + str(account_id), cursor))
+
+    # pages through every key transaction visible to the api key, returns {'status':, 'entities': []} or an error
+    def get_all_kts(self, api_key):
+        result = {'entities': []}
+        page = 1
+        while True:
+            response = ratelimiter.request(api_key, 'get', GET_APM_KT_URL, headers=self._rest_api_headers(api_key),
+                                           params={'page': page})
+            result['status'] = response.status_code
+            if response.status_code != 200:
+                result['error'] = response.text
+                return result
+            key_transactions = response.json().get(KEY_TRANSACTIONS, [])
+            result['entities'].extend(key_transactions)
+            if not key_transactions or 'next' not in response.links:
+                return result
+            page += 1
 
     def gql_get_entities_with_tags(self, per_api_key, tags_arr):
-        payload = self._entities_by_tags_payload(tags_arr)
-        result = {}
-        response = nerdgraph.GraphQl.post(per_api_key, payload)
-        result['status'] = response['status']
-        if 'error' in response:
-            result['error'] = response['error']
-            return result
-        result['count'] = response['response']['data']['actor']['entitySearch']['count']
-        result['entities'] = response['response']['data']['actor']['entitySearch']['results']['entities']
-        return result
+        return self._entity_search(per_api_key, lambda cursor: self._entities_by_tags_payload(tags_arr, cursor))
 
     @staticmethod
     def get_permalink(per_api_key, guid):
+        return responsecache.cached('permalink', per_api_key, [guid],
+                                    lambda: EntityClient._permalink(per_api_key, guid),
+                                    lambda permalink: not permalink.startswith('GUID_NOT_FOUND'))
+
+    @staticmethod
+    def _permalink(per_api_key, guid):
         query = '''query($guid: EntityGuid!) { 
                     actor {
                         entity(guid: $guid) {
@@ -296,6 +356,37 @@ class EntityClient:
         else:
             return "GUID_NOT_FOUND " + guid
 
+    def _indexed(self, account_id, entity_type):
+        return self.entity_index is not None and self.entity_index.covers(account_id, entity_type)
+
+    # same shape as _entity_search, with the indexed entities of that name
+    def _indexed_search(self, account_id, entity_type, name):
+        entities = self.entity_index.find(account_id, entity_type, name)
+        return {'status': 200, 'count': len(entities), 'entities': entities}
+
+    @classmethod
+    def _entity_search_pager(cls, per_api_key, payload_for):
+        return pager.CursorPager(lambda cursor: nerdgraph.GraphQl.post(per_api_key, payload_for(cursor)),
+                                 cls._extract_entity_page)
+
+    # pages through an entitySearch, returns {'status':, 'count':, 'entities': []} or {'status':, 'error':}
+    @classmethod
+    def _entity_search(cls, per_api_key, payload_for):
+        entity_pager = cls._entity_search_pager(per_api_key, payload_for)
+        entities = entity_pager.all()
+        result = {'status': entity_pager.status}
+        if entity_pager.error:
+            result['error'] = entity_pager.error
+            return result
+        result['count'] = entity_pager.response['data']['actor']['entitySearch']['count']
+        result['entities'] = entities
+        return result
+
+    @staticmethod
+    def _extract_entity_page(gql_rsp_json):
+        results = gql_rsp_json['data']['actor']['entitySearch']['results']
+        return list(filter(None, results['entities'])), results['nextCursor']  # remove empty dicts from list
+
     @staticmethod
     def _rest_api_headers(api_key):
         return {'X-Api-Key': api_key, 'Content-Type': 'Application/JSON'}
@@ -341,11 +432,36 @@ class EntityClient:
                             }  '''
 
     @classmethod
-    def _entity_by_name_payload(cls, entity_type, entity_name):
-        return cls._matching_condition_payload(entity_type, "name = '" + entity_name)
+    def _entity_by_name_payload(cls, entity_type, entity_name, cursor=None):
+        return cls._matching_condition_payload(entity_type, "name = '" + entity_name, cursor)
+
+    @staticmethod
+    def _entities_of_type_payload(domain, ent_type, cursor=None):
+        query = '''query($domain: String!, $ent_type: String!, $cursor: String) { 
+                        actor {
+                                entitySearch(queryBuilder: {domain: $domain, type: $ent_type}) {
+                                  count
+                                  results(cursor: $cursor) {
+                                    nextCursor
+                                    entities {
+                                      accountId
+                                      guid
+                                      name
+                                      type
+                                      tags {
+                                        key
+                                        values
+                                      }
+                                    }
+                                  }
+                                }
+                        }
+                    }'''
+        variables = {'domain': domain, 'ent_type': ent_type, 'cursor': cursor}
+        return {'query': query, 'variables': variables}
 
     @classmethod
-    def _entities_by_tags_payload(cls, tags_arr):
+    def _entities_by_tags_payload(cls, tags_arr, cursor=None):
         matching_tags = ""
         for i, tag in enumerate(tags_arr):
             tag_parts = tag.split(":")
@@ -353,36 +469,42 @@ class EntityClient:
                 matching_tags = "tags." + tag_parts[0] + "='" + tag_parts[1] + "'"
             else:
                 matching_tags = matching_tags + " AND tags." + tag_parts[0]
-        return cls._all_entities_payload_for(matching_tags)
+        return cls._all_entities_payload_for(matching_tags, cursor)
 
     @classmethod
-    def _all_entities_payload_for(cls, matching_condition):
-        entity_search_query = '''query($matchingCondition: String!) { 
+    def _all_entities_payload_for(cls, matching_condition, cursor=None):
+        entity_search_query = '''query($matchingCondition: String!, $cursor: String) { 
                                             actor { 
                                                 entitySearch(query: $matchingCondition)  { 
                                                     count 
-                                                    results { 
+                                                    results(cursor: $cursor) { 
+                                                        nextCursor
                                                         entities {
                                                               entityType
                                                               guid
                                                               name          
+                                                              tags {
+                                                                  key
+                                                                  values
+                                                              }
                                                         } 
                                                     } 
                                                 } 
                                             } 
                                         }
                                         '''
-        variables = {'matchingCondition': matching_condition}
+        variables = {'matchingCondition': matching_condition, 'cursor': cursor}
         payload = {'query': entity_search_query, 'variables': variables}
         return payload
 
     @classmethod
-    def _matching_condition_payload(cls, entity_type, matching_condition):
-        entity_search_query = '''query($matchingCondition: String!) { 
+    def _matching_condition_payload(cls, entity_type, matching_condition, cursor=None):
+        entity_search_query = '''query($matchingCondition: String!, $cursor: String) { 
                                         actor { 
                                             entitySearch(query: $matchingCondition)  { 
                                                 count 
-                                                results { 
+                                                results(cursor: $cursor) { 
+                                                    nextCursor
                                                     entities { ''' + cls._entity_outline(entity_type) + '''
                                                     } 
                                                 } 
@@ -390,7 +512,7 @@ class EntityClient:
                                         } 
                                     }
                                     '''
-        variables = {'matchingCondition': matching_condition + "' AND type = '"+entity_type+"'"}
+        variables = {'matchingCondition': matching_condition + "' AND type = '"+entity_type+"'", 'cursor': cursor}
         payload = {'query': entity_search_query, 'variables': variables}
         return payload
 
@@ -459,11 +581,6 @@ class EntityClient:
             matched = True
         return matched
 
-    @staticmethod
-    def _extract_entities(gql_rsp_json):
-        rsp_entities = gql_rsp_json['data']['actor']['entitySearch']['results']['entities']
-        return list(filter(None, rsp_entities))  # remove empty dicts from list
-
     @classmethod
     def _set_matched_entity(cls, entities, entity_type, result, src_entity, tgt_account_id):
         for entity in entities:
@@ -585,3 +702,73 @@ class EntityClient:
     APM_EXT_SVC = 'APM_EXT_SVC'
     MOBILE_APP = 'MOBILE_APP'
     MONITOR = 'SYNTH_MONITOR'
+
+
+# asyncio variant of EntityClient. Every call runs under the shared AsyncGraphQl concurrency limit.
+class AsyncEntityClient:
+
+    def __init__(self, async_gql=None, entity_client=None):
+        self.gql = async_gql or nerdgraph.AsyncGraphQl()
+        self.client = entity_client or EntityClient()
+
+    async def get_matching_kt(self, tgt_api_key, kt_name):
+        return await self.gql.run(self.client.get_matching_kt, tgt_api_key, kt_name)
+
+    async def gql_get_matching_entity(self, api_key, entity_type, src_entity, tgt_account_id):
+        return await self.gql.run(self.client.gql_get_matching_entity, api_key, entity_type, src_entity,
+                                  tgt_account_id)
+
+    async def gql_get_matching_entity_by_name(self, api_key, entity_type, name, tgt_acct_id):
+        return await self.gql.run(self.client.gql_get_matching_entity_by_name, api_key, entity_type, name,
+                                  tgt_acct_id)
+
+    async def get_entity(self, api_key, entity_type, entity_id):
+        return await self.gql.run(self.client.get_entity, api_key, entity_type, entity_id)
+
+    async def get_apm_entity_by_name(self, api_key, app_name):
+        return await self.gql.run(self.client.get_apm_entity_by_name, api_key, app_name)
+
+    async def put_apm_settings(self, api_key, app_id, app_settings):
+        return await self.gql.run(self.client.put_apm_settings, api_key, app_id, app_settings)
+
+    async def gql_mutate_add_tags(self, per_api_key, entity_guid, arr_label_keys):
+        return await self.gql.run(self.client.gql_mutate_add_tags, per_api_key, entity_guid, arr_label_keys)
+
+    async def gql_mutate_delete_tag_values(self, per_api_key, entity_guid, arr_tags):
+        return await self.gql.run(self.client.gql_mutate_delete_tag_values, per_api_key, entity_guid, arr_tags)
+
+    async def gql_mutate_delete_tag_keys(self, per_api_key, entity_guid, arr_keys):
+        return await self.gql.run(self.client.gql_mutate_delete_tag_keys, per_api_key, entity_guid, arr_keys)
+
+    async def gql_mutate_replace_tags(self, per_api_key, entity_guid, arr_label_keys):
+        return await self.gql.run(self.client.gql_mutate_replace_tags, per_api_key, entity_guid, arr_label_keys)
+
+    async def gql_mutate_add_tags_batch(self, per_api_key, guids_and_label_keys):
+        return await self.gql.run(self.client.gql_mutate_add_tags_batch, per_api_key, guids_and_label_keys)
+
+    async def gql_mutate_replace_tags_batch(self, per_api_key, guids_and_label_keys):
+        return await self.gql.run(self.client.gql_mutate_replace_tags_batch, per_api_key, guids_and_label_keys)
+
+    async def gql_mutate_delete_tag_values_batch(self, per_api_key, guids_and_tags):
+        return await self.gql.run(self.client.gql_mutate_delete_tag_values_batch, per_api_key, guids_and_tags)
+
+    async def gql_mutate_delete_tag_keys_batch(self, per_api_key, guids_and_keys):
+        return await self.gql.run(self.client.gql_mutate_delete_tag_keys_batch, per_api_key, guids_and_keys)
+
+    async def gql_get_tags(self, per_api_key, entity_guid):
+        return await self.gql.run(self.client.gql_get_tags, per_api_key, entity_guid)
+
+    async def gql_get_tags_with_metadata(self, per_api_key, entity_guid):
+        return await self.gql.run(self.client.gql_get_tags_with_metadata, per_api_key, entity_guid)
+
+    async def gql_get_tags_with_metadata_batch(self, per_api_key, entity_guids):
+        return await self.gql.run(self.client.gql_get_tags_with_metadata_batch, per_api_key, entity_guids)
+
+    async def gql_get_entities_of_type(self, per_api_key, domain, ent_type):
+        return await self.gql.run(self.client.gql_get_entities_of_type, per_api_key, domain, ent_type)
+
+    async def gql_get_entities_with_tags(self, per_api_key, tags_arr):
+        return await self.gql.run(self.client.gql_get_entities_with_tags, per_api_key, tags_arr)
+
+    async def get_permalink(self, per_api_key, guid):
+        return await self.gql.run(EntityClient.get_permalink, per_api_key, guid)
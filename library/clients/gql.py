@@ -1,10 +1,21 @@
 import os
-import requests
 import json
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import requests
 import library.nrpylogger as nrpy_logger
 from library.endpoints import Endpoints
+import library.ratelimiter as ratelimiter
+from library.httpsession import HttpSessions
+from library.clients.jsonstream import JsonItemStream, DEFAULT_CHUNK_SIZE
 
 URL = 'https://api.newrelic.com/graphql'
+DEFAULT_CONCURRENCY = 50
+DEFAULT_TIMEOUT = 60
+THROTTLED_ERROR_CLASSES = [b'TOO_MANY_REQUESTS']
+RETRY_ERROR_CLASSES = [b'SERVER_ERROR', b'INTERNAL_SERVER_ERROR']
 
 logger = nrpy_logger.get_logger(os.path.basename(__file__))
 
@@ -15,21 +26,127 @@ class GraphQl:
         pass
 
     @staticmethod
-    def post(per_api_key, payload, region=Endpoints.REGION_US):
+    def post(per_api_key, payload, region=Endpoints.REGION_US, timeout=None, partial=False):
         result = {}
-        response = requests.post(Endpoints.of(region).GRAPHQL_URL, headers=GraphQl.headers(per_api_key),
-                                 data=json.dumps(payload))
+        response = ratelimiter.request(per_api_key, 'post', Endpoints.of(region).GRAPHQL_URL, region, GraphQl.classify,
+                                       headers=GraphQl.headers(per_api_key), data=json.dumps(payload),
+                                       timeout=timeout)
         result['status'] = response.status_code
-        if response.text:
-            response_json = response.json()
+        # json.loads decodes the bytes directly, response.text would hold another decoded copy of the body
+        if response.content:
+            response_json = json.loads(response.content)
             if 'errors' in response_json:
                 logger.error('Error : ' + response.text)
                 result['error'] = response_json['errors']
+                if partial and response_json.get('data'):
+                    result['response'] = response_json
             else:
-                logger.debug('Success : ' + response.text)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('Success : ' + response.text)
                 result['response'] = response_json
         return result
 
+    # streams the items of the array at path, e.g. ('data', 'actor', 'nrql', 'results'), as the body is read
+    # only the http status is used to retry, NerdGraph errors are in the stream's errors once it has been iterated
+    @staticmethod
+    def stream(per_api_key, payload, path, region=Endpoints.REGION_US, timeout=None):
+        response = ratelimiter.request(per_api_key, 'post', Endpoints.of(region).GRAPHQL_URL, region,
+                                       ratelimiter.classify_status, headers=GraphQl.headers(per_api_key),
+                                       data=json.dumps(payload), timeout=timeout, stream=True)
+        return GraphQlStream(response, path)
+
     @staticmethod
     def headers(api_key):
-        return {'api-key': api_key, 'Content-Type': 'application/json'}
\ No newline at end of file
+        return {'api-key': api_key, 'Content-Type': 'application/json'}
+
+    # NerdGraph reports throttling and server faults as 200 responses with an errorClass in errors.extensions
+    @staticmethod
+    def classify(response):
+        outcome = ratelimiter.classify_status(response)
+        if outcome != ratelimiter.OK or b'"errors"' not in response.content:
+            return outcome
+        if any(b'"' + error_class + b'"' in response.content for error_class in THROTTLED_ERROR_CLASSES):
+            return ratelimiter.THROTTLED
+        if any(b'"' + error_class + b'"' in response.content for error_class in RETRY_ERROR_CLASSES):
+            return ratelimiter.RETRY
+        return outcome
+
+
+# iterating it yields the items and closes the response, status holds the http status
+class GraphQlStream(JsonItemStream):
+
+    def __init__(self, response, path):
+        super().__init__(response.iter_content(DEFAULT_CHUNK_SIZE), path)
+        self.response = response
+        self.status = response.status_code
+
+    def __iter__(self):
+        try:
+            if self.status != 200:
+                self.errors = [{'message': 'Http status ' + str(self.status) + ' : ' + self.response.text}]
+                logger.error('Error : ' + str(self.errors))
+                return
+            yield from super().__iter__()
+            if self.errors:
+                logger.error('Error : ' + json.dumps(self.errors))
+        finally:
+            self.response.close()
+
+
+# asyncio counterpart of GraphQl.post. Requests run on a worker pool sized to the concurrency limit so they keep
+# using the pooled keep-alive sessions, while the semaphore bounds how many are in flight at once. The request itself
+# carries the timeout, a call the caller stopped waiting for keeps its slot until its worker thread returns.
+class AsyncGraphQl:
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._semaphore = None
+        self._loop = None
+        HttpSessions.ensure_pool_size(concurrency)
+
+    async def post(self, per_api_key, payload, region=Endpoints.REGION_US, timeout=None):
+        timeout = timeout or self.timeout
+        return await self.run(GraphQl.post, per_api_key, payload, region, timeout, timeout=timeout)
+
+    async def post_all(self, per_api_key, payloads, region=Endpoints.REGION_US, timeout=None):
+        return await asyncio.gather(*[self.post(per_api_key, payload, region, timeout) for payload in payloads])
+
+    # runs any blocking client call under the same concurrency limit and timeout
+    async def run(self, fn, *args, timeout=None):
+        timeout = timeout or self.timeout
+        semaphore = self._bounded()
+        await semaphore.acquire()
+        try:
+            call = asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args))
+        except BaseException:
+            semaphore.release()
+            raise
+        call.add_done_callback(functools.partial(self._release, semaphore))
+        try:
+            # shielded so a timeout stops the wait without cancelling the call, whose slot is released once it returns
+            return await asyncio.wait_for(asyncio.shield(call), timeout)
+        except (asyncio.TimeoutError, requests.exceptions.Timeout):
+            logger.error('Timed out after ' + str(timeout) + 's calling ' + fn.__name__)
+            return {'status': None, 'error': [{'message': 'Timed out after ' + str(timeout) + 's'}]}
+        except requests.exceptions.RequestException as ex:
+            logger.error('Error calling ' + fn.__name__ + ' : ' + str(ex))
+            return {'status': None, 'error': [{'message': str(ex)}]}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _release(semaphore, call):
+        semaphore.release()
+        # retrieves the outcome of a call nobody awaits any more, so it is not reported as never retrieved
+        if not call.cancelled():
+            call.exception()
+
+    def _bounded(self):
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
@@ -0,0 +1,111 @@
+import os
+import re
+import json
+import library.nrpylogger as nrpy_logger
+import library.clients.gql as nerdgraph
+from library.endpoints import Endpoints
+
+# NerdGraph rejects documents above its query complexity limit, 25 single-entity lookups stay well below it
+DEFAULT_BATCH_SIZE = 25
+VARIABLE = re.compile(r'\$(\w+)')
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# Sends N homogeneous lookups as one aliased GraphQL document, e.g. for field 'entity(guid: $guid) { ... }'
+#   query($e0_guid: EntityGuid!, $e1_guid: EntityGuid!) { actor { e0: entity(guid: $e0_guid) { ... } e1: ... } }
+# variables : dict of per item variable name to GraphQL type
+# envelope : wraps the aliased fields, path : keys from data down to the object holding the aliases
+# shared_variables : dict of variable name to type for variables common to the whole batch e.g. accountId
+class AliasBatch:
+
+    def __init__(self, alias_prefix, variables, field, envelope='actor { %s }', path=('actor',),
+                 operation='query', shared_variables=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.alias_prefix = alias_prefix
+        self.variables = variables
+        self.field = field
+        self.envelope = envelope
+        self.path = path
+        self.operation = operation
+        self.shared_variables = shared_variables or {}
+        self.batch_size = batch_size
+
+    def payload(self, items, shared_values=None):
+        var_defs = ['$' + name + ': ' + var_type for name, var_type in self.shared_variables.items()]
+        variables = dict(shared_values or {})
+        fields = []
+        for i, item in enumerate(items):
+            alias = self.alias(i)
+            item_values = self._item_values(item)
+            for name, var_type in self.variables.items():
+                var_defs.append('$' + alias + '_' + name + ': ' + var_type)
+                variables[alias + '_' + name] = item_values[name]
+            fields.append(alias + ': ' + VARIABLE.sub(lambda m: self._rename(alias, m), self.field))
+        query = self.operation + '(' + ', '.join(var_defs) + ') { ' + self.envelope % ' '.join(fields) + ' }'
+        return {'query': query, 'variables': variables}
+
+    # returns one result per item, in order : {'status': , 'response': aliased object} or {'status': , 'error': []}
+    def post(self, per_api_key, items, shared_values=None, region=Endpoints.REGION_US):
+        results = []
+        for start in range(0, len(items), self.batch_size):
+            results.extend(self.post_batch(per_api_key, items[start:start + self.batch_size], shared_values, region))
+        return results
+
+    def post_batch(self, per_api_key, items, shared_values=None, region=Endpoints.REGION_US):
+        payload = self.payload(items, shared_values)
+        logger.debug(json.dumps(payload))
+        response = nerdgraph.GraphQl.post(per_api_key, payload, region, partial=True)
+        return self.split(response, len(items))
+
+    def split(self, response, item_count):
+        errors_by_alias = self._errors_by_alias(response.get('error', []))
+        container = self._aliased_container(response)
+        results = []
+        for i in range(item_count):
+            alias = self.alias(i)
+            result = {'status': response['status']}
+            if alias in errors_by_alias:
+                result['error'] = errors_by_alias[alias]
+            elif container is None:
+                result['error'] = response.get('error', [{'message': 'No data in response'}])
+            else:
+                result['response'] = container.get(alias)
+            results.append(result)
+        return results
+
+    def alias(self, index):
+        return self.alias_prefix + str(index)
+
+    def _item_values(self, item):
+        if isinstance(item, dict):
+            return item
+        return {next(iter(self.variables)): item}
+
+    def _rename(self, alias, match):
+        if match.group(1) in self.variables:
+            return '$' + alias + '_' + match.group(1)
+        return match.group(0)
+
+    def _aliased_container(self, response):
+        if 'response' not in response:
+            return None
+        container = response['response'].get('data')
+        for key in self.path:
+            if not container:
+                return None
+            container = container.get(key)
+        return container
+
+    def _errors_by_alias(self, errors):
+        errors_by_alias = {}
+        for error in errors:
+            for element in error.get('path') or []:
+                if isinstance(element, str) and element.startswith(self.alias_prefix) and \
+                        element[len(self.alias_prefix):].isdigit():
+                    errors_by_alias.setdefault(element, []).append(error)
+                    break
+        return errors_by_alias
+
+
+def chunks(items, size=DEFAULT_BATCH_SIZE):
+    return [items[start:start + size] for start in range(0, len(items), size)]
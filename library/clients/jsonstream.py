@@ -0,0 +1,141 @@
+import re
+import json
+import codecs
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+SCALAR = re.compile(r'[^\s,:\[\]{}"]+')
+WHITESPACE = re.compile(r'\s*')
+STRUCTURAL = '{}[],:'
+DECODER = json.JSONDecoder()
+
+
+# Iterates the items of one array of a JSON document while the document is still being read, e.g. the results of
+# data.actor.nrql.results. Only the item being decoded and the unread part of the current chunk are held in memory,
+# everything outside the path is skipped token by token.
+# chunks : iterable of str or utf-8 bytes, path : keys leading to the array
+# After iteration errors holds the top level errors of a GraphQL response, if any, and values the scalars found next
+# to the path keys, e.g. values['data.actor.entitySearch.results.nextCursor'].
+class JsonItemStream:
+
+    def __init__(self, chunks, path):
+        self.chunks = iter(chunks)
+        self.path = tuple(path)
+        self.errors = None
+        self.values = {}
+        self.count = 0
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._start = 0
+        self._capture = None
+        self._eof = False
+
+    def __iter__(self):
+        token = self._token()
+        if token != '{':
+            raise ValueError('Expected a JSON object, got ' + token[:20])
+        for item in self._walk(0):
+            self.count += 1
+            yield item
+
+    def _walk(self, depth):
+        while True:
+            token = self._token()
+            if token == '}':
+                return
+            if token == ',':
+                continue
+            key = json.loads(token)
+            self._expect(':')
+            token = self._token()
+            on_path = depth < len(self.path) and key == self.path[depth]
+            if on_path and depth == len(self.path) - 1 and token == '[':
+                yield from self._items()
+            elif on_path and token == '{':
+                yield from self._walk(depth + 1)
+            elif depth == 0 and key == 'errors':
+                self.errors = self._decode_value()
+            elif token not in STRUCTURAL:
+                self.values['.'.join(self.path[:depth] + (key,))] = json.loads(token)
+            else:
+                self._skip(token)
+
+    def _items(self):
+        while True:
+            token = self._token()
+            if token == ']':
+                return
+            if token == ',':
+                continue
+            yield self._decode_value()
+
+    # decodes the value whose first token was just read. A value cut by the end of the buffer fails to decode, the
+    # buffer is then grown to twice the pending size before trying again so large values are decoded in linear time.
+    def _decode_value(self):
+        self._capture = self._start
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self._buffer, self._capture)
+                # a number ending the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    self._capture = None
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            pending = len(self._buffer) - self._capture
+            while not self._eof and len(self._buffer) - self._capture < 2 * pending:
+                self._fill()
+
+    def _skip(self, token):
+        if token not in '{[':
+            return
+        depth = 1
+        while depth:
+            token = self._token()
+            if token in '{[':
+                depth += 1
+            elif token in '}]':
+                depth -= 1
+
+    def _expect(self, expected):
+        token = self._token()
+        if token != expected:
+            raise ValueError('Expected ' + expected + ', got ' + token[:20])
+
+    def _token(self):
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            self._start = self._pos
+            if self._pos < len(self._buffer):
+                char = self._buffer[self._pos]
+                if char in STRUCTURAL:
+                    self._pos += 1
+                    return char
+                match = STRING.match(self._buffer, self._pos) if char == '"' else SCALAR.match(self._buffer, self._pos)
+                # a scalar running to the end of the buffer may continue in the next chunk
+                if match and (char == '"' or match.end() < len(self._buffer) or self._eof):
+                    self._pos = match.end()
+                    return match.group()
+            if self._eof:
+                raise ValueError('Unexpected end of JSON document')
+            self._fill()
+
+    # drops what was already consumed and appends the next chunk
+    def _fill(self):
+        cut = self._start if self._capture is None else self._capture
+        self._buffer = self._buffer[cut:]
+        self._pos -= cut
+        self._start -= cut
+        if self._capture is not None:
+            self._capture -= cut
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self._eof = True
+            self._buffer += self._decoder.decode(b'', final=True)
+            return
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        self._buffer += chunk
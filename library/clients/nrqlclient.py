@@ -1,36 +1,125 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import library.clients.gql as nerdgraph
+import library.nrpylogger as nrpy_logger
 
+# how long an async query is polled for before giving up
+DEFAULT_POLL_TIMEOUT = 3600
+MIN_POLL_SECONDS = 1.0
+MAX_POLL_SECONDS = 30.0
+DEFAULT_MAX_WORKERS = 8
+RESULTS_PATH = ('data', 'actor', 'nrql', 'results')
 
-def get_results(query, account_id, api_key, timeout, region):
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# async_query : submit the query as a long running NRDB query and poll its queryId until it completes, so heavy
+# queries are not bound by the synchronous timeout. The timeout then only bounds the initial request.
+def get_results(query, account_id, api_key, timeout, region, async_query=False, poll_timeout=DEFAULT_POLL_TIMEOUT):
     query_response = {}
-    error = {}
-    payload = payload_from(query, account_id, timeout)
-    nerdgraph_response = nerdgraph.GraphQl.post(api_key,payload,region)
+    payload = payload_from(query, account_id, timeout, async_query)
+    nerdgraph_response = nerdgraph.GraphQl.post(api_key, payload, region)
     if 'response' in nerdgraph_response:
-        response = nerdgraph_response['response']
-        query_response['results'] = response['data']['actor']['nrql']['results']
+        nrql = nerdgraph_response['response']['data']['actor']['nrql']
+        progress = nrql.get('queryProgress') if async_query else None
+        if progress and not progress.get('completed'):
+            return poll_results(progress, account_id, api_key, region, poll_timeout)
+        query_response['results'] = nrql['results']
         return query_response
     if 'error' in nerdgraph_response:
-        error['errorClass'] = nerdgraph_response['error'][0]['extensions']['errorClass']
-        error['locations'] = nerdgraph_response['error'][0]['locations'][0]
-        error['message'] = nerdgraph_response['error'][0]['message']
-        query_response['error'] = error
+        query_response['error'] = error_from(nerdgraph_response)
         return query_response
 
 
-def payload_from(query, account_id, timeout):
-    exec_nrql = '''query execNrql($accountId: Int!, $nrqlQuery: Nrql!, $timeout: Seconds!) {
+# synchronous query whose results are decoded one by one as the body is read, iterate the returned stream to get
+# them and check its errors afterwards. Throttling reported inside a 200 body is not retried in this mode.
+def stream_results(query, account_id, api_key, timeout, region):
+    return nerdgraph.GraphQl.stream(api_key, payload_from(query, account_id, timeout), RESULTS_PATH, region)
+
+
+# polls nrqlQueryProgress until the query completes, waiting what NRDB suggests in retryAfter, backing off otherwise
+def poll_results(progress, account_id, api_key, region, poll_timeout=DEFAULT_POLL_TIMEOUT):
+    query_id = progress['queryId']
+    deadline = time.monotonic() + poll_timeout
+    delay = MIN_POLL_SECONDS
+    while True:
+        wait = progress.get('retryAfter') or delay
+        if time.monotonic() + wait > deadline:
+            logger.error('Gave up polling async query ' + query_id + ' after ' + str(poll_timeout) + 's')
+            return {'error': {'message': 'Async query ' + query_id + ' did not complete within ' +
+                              str(poll_timeout) + 's'}}
+        time.sleep(wait)
+        delay = min(MAX_POLL_SECONDS, delay * 2)
+        nerdgraph_response = nerdgraph.GraphQl.post(api_key, progress_payload(account_id, query_id), region)
+        if 'response' not in nerdgraph_response:
+            return {'error': error_from(nerdgraph_response)}
+        result = nerdgraph_response['response']['data']['actor']['account']['nrqlQueryProgress']
+        progress = result.get('queryProgress') or {'completed': True}
+        if progress.get('completed'):
+            return {'results': result['results']}
+        logger.debug('Async query ' + query_id + ' still running')
+
+
+# runs many queries at once, async queries spend most of their time polling so workers mostly wait on NRDB
+def get_all_results(queries, account_id, api_key, timeout, region, async_query=True,
+                    max_workers=DEFAULT_MAX_WORKERS):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(get_results, query, account_id, api_key, timeout, region, async_query)
+                   for query in queries]
+        return [future.result() for future in futures]
+
+
+def error_from(nerdgraph_response):
+    errors = nerdgraph_response.get('error') or [{'message': 'Empty response, status ' +
+                                                  str(nerdgraph_response.get('status'))}]
+    error = {'message': errors[0].get('message')}
+    if 'extensions' in errors[0]:
+        error['errorClass'] = errors[0]['extensions'].get('errorClass')
+    if errors[0].get('locations'):
+        error['locations'] = errors[0]['locations'][0]
+    return error
+
+
+def payload_from(query, account_id, timeout, async_query=False):
+    exec_nrql = '''query execNrql($accountId: Int!, $nrqlQuery: Nrql!, $timeout: Seconds!, $async: Boolean) {
                           actor {
                             nrql(
                               accounts: [$accountId]
                               query: $nrqlQuery
                               timeout: $timeout
+                              async: $async
                             ) {
                               results
+                              queryProgress {
+                                queryId
+                                completed
+                                retryAfter
+                              }
                             }
                           }
                         }
                         '''
-    variables = {'accountId': account_id, 'nrqlQuery': query, 'timeout': timeout}
+    variables = {'accountId': account_id, 'nrqlQuery': query, 'timeout': timeout, 'async': async_query}
     payload = {'query': exec_nrql, 'variables': variables}
-    return payload
\ No newline at end of file
+    return payload
+
+
+def progress_payload(account_id, query_id):
+    query_progress = '''query queryProgress($accountId: Int!, $queryId: ID!) {
+                          actor {
+                            account(id: $accountId) {
+                              nrqlQueryProgress(queryId: $queryId) {
+                                results
+                                queryProgress {
+                                  queryId
+                                  completed
+                                  retryAfter
+                                }
+                              }
+                            }
+                          }
+                        }
+                        '''
+    variables = {'accountId': account_id, 'queryId': query_id}
+    return {'query': query_progress, 'variables': variables}
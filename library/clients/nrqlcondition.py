@@ -2,6 +2,7 @@ import json
 import os
 import library.nrpylogger as nrpy_logger
 import library.clients.gql as nerdgraph
+import library.clients.pager as pager
 
 logger = nrpy_logger.get_logger(os.path.basename(__file__))
 
@@ -11,29 +12,42 @@ class NrqlCondition:
     def __init__(self):
         pass
 
+    # pages through every matching condition, returns {'status':, 'totalCount':, 'nrqlConditions': []}
+    # or {'status':, 'error':}
     @staticmethod
     def search(user_api_key, account_id, event_metric_name):
-        payload = NrqlCondition._search_conditions_payload(account_id, event_metric_name)
-        logger.debug(json.dumps(payload))
-        result = nerdgraph.GraphQl.post(user_api_key, payload, "")
-        while result['nextCursor']:
-            payload = NrqlCondition._search_conditions_payload(account_id, event_metric_name,  result['nextCursor'])
-            nextResult = nerdgraph.GraphQl.post(user_api_key, payload)
-
-
-
-
+        conditions_pager = NrqlCondition.search_pager(user_api_key, account_id, event_metric_name)
+        conditions = conditions_pager.all()
+        result = {'status': conditions_pager.status}
+        if conditions_pager.error:
+            result['error'] = conditions_pager.error
+            return result
+        search = conditions_pager.response['data']['actor']['account']['alerts']['nrqlConditionsSearch']
+        result['totalCount'] = search['totalCount']
+        result['nrqlConditions'] = conditions
+        return result
 
+    @staticmethod
+    def search_pager(user_api_key, account_id, event_metric_name):
+        def fetch(cursor):
+            payload = NrqlCondition._search_conditions_payload(account_id, event_metric_name, cursor)
+            logger.debug(json.dumps(payload))
+            return nerdgraph.GraphQl.post(user_api_key, payload)
+        return pager.CursorPager(fetch, NrqlCondition._extract_conditions_page)
 
+    @staticmethod
+    def _extract_conditions_page(response_json):
+        search = response_json['data']['actor']['account']['alerts']['nrqlConditionsSearch']
+        return search['nrqlConditions'], search['nextCursor']
 
     @staticmethod
-    def _search_conditions_payload(account_id, event_metric_name, next_cursor=""):
-        search_conditions_query = '''query($accountId: Int!, $eventMetricName: String!, $cursor: String!) { 
+    def _search_conditions_payload(account_id, event_metric_name, next_cursor=None):
+        search_conditions_query = '''query($accountId: Int!, $eventMetricName: String!, $cursor: String) { 
                                 actor {
                                     account(id: $accountId) {
                                         alerts {
                                             nrqlConditionsSearch(searchCriteria: {queryLike: $eventMetricName}, 
-                                            cursor: $next_cursor) {
+                                            cursor: $cursor) {
                                                 nrqlConditions { name enabled }
                                                 totalCount
                                                 nextCursor
@@ -43,4 +57,13 @@ class NrqlCondition:
                                 } 
                             }'''
         variables = {'accountId': account_id, 'eventMetricName': event_metric_name, 'cursor': next_cursor}
-        return {'query': search_conditions_query, 'variables': variables}
\ No newline at end of file
+        return {'query': search_conditions_query, 'variables': variables}
+
+
+class AsyncNrqlCondition:
+
+    def __init__(self, async_gql=None):
+        self.gql = async_gql or nerdgraph.AsyncGraphQl()
+
+    async def search(self, user_api_key, account_id, event_metric_name):
+        return await self.gql.run(NrqlCondition.search, user_api_key, account_id, event_metric_name)
@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import library.nrpylogger as nrpy_logger
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# Streams a cursor paginated NerdGraph search page by page. While the caller processes page K, page K+1 is already
+# being fetched in the background.
+# fetch : cursor -> GraphQl.post result, the first page is fetched with cursor None
+# extract : response json -> (items, next_cursor)
+# After iteration status holds the last http status and error the NerdGraph errors, if any, that stopped paging.
+class CursorPager:
+
+    def __init__(self, fetch, extract):
+        self.fetch = fetch
+        self.extract = extract
+        self.status = None
+        self.error = None
+        self.response = None
+        self.pages = 0
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            pending = executor.submit(self.fetch, None)
+            while pending is not None:
+                result = pending.result()
+                pending = None
+                self.status = result.get('status')
+                if 'error' in result or 'response' not in result:
+                    self.error = result.get('error', [{'message': 'Empty response, status ' + str(self.status)}])
+                    logger.error('Stopped paging after ' + str(self.pages) + ' pages : ' + str(self.error))
+                    return
+                self.response = result['response']
+                items, next_cursor = self.extract(self.response)
+                self.pages += 1
+                if next_cursor:
+                    pending = executor.submit(self.fetch, next_cursor)
+                yield items
+        finally:
+            executor.shutdown(wait=False)
+
+    def items(self):
+        for page in self:
+            for item in page:
+                yield item
+
+    def all(self):
+        return list(self.items())
+
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+import library.nrpylogger as nrpy_logger
+
+DEFAULT_INDEX_FILE = 'db/entityindex.json'
+# an account's entities of a type are downloaded again once they are older than this
+DEFAULT_MAX_AGE_SECONDS = 24 * 60 * 60
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# Every entity outline of the indexed types of an account, downloaded once through a paginated entitySearch and
+# looked up by (account, type, name) or by guid. EntityClient resolves its matching calls from the index, without a
+# request, for the accounts and types it covers. Key transactions are only listed by the REST v2 api, per api key.
+# The index is kept in memory and, when a file_name is given, in a json file reused by later runs until max_age.
+class EntityIndex:
+
+    def __init__(self, file_name=None, max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        self.file_name = file_name
+        self.max_age_seconds = max_age_seconds
+        self.by_name = {}
+        self.by_guid = {}
+        self.built = {}
+        self.key_transactions = {}
+        self._lock = threading.Lock()
+        if file_name and Path(file_name).exists():
+            self.load()
+
+    def covers(self, account_id, entity_type):
+        built = self.built.get(self._account_key(account_id), {}).get(entity_type)
+        return built is not None and time.time() - built['builtAt'] <= self.max_age_seconds
+
+    def covers_key_transactions(self, api_key):
+        built = self.key_transactions.get(self._api_key_hash(api_key))
+        return built is not None and time.time() - built['builtAt'] <= self.max_age_seconds
+
+    # downloads the entities of every type not already covered, returns the types that could not be downloaded
+    def build(self, entity_client, api_key, account_id, entity_types):
+        failed = []
+        for entity_type in entity_types:
+            if self.covers(account_id, entity_type):
+                continue
+            entity_pager = entity_client.gql_iter_entities_in_account(api_key, entity_type, account_id)
+            entities = entity_pager.all()
+            if entity_pager.error:
+                logger.error('Could not index ' + entity_type + ' of account ' + str(account_id))
+                failed.append(entity_type)
+                continue
+            self.add(account_id, entity_type, entities)
+            logger.info('Indexed ' + str(len(entities)) + ' ' + entity_type + ' of account ' + str(account_id))
+        self.save()
+        return failed
+
+    def build_key_transactions(self, entity_client, api_key):
+        if self.covers_key_transactions(api_key):
+            return True
+        result = entity_client.get_all_kts(api_key)
+        if 'error' in result:
+            logger.error('Could not index key transactions ' + str(result['error']))
+            return False
+        with self._lock:
+            self.key_transactions[self._api_key_hash(api_key)] = {
+                'builtAt': time.time(), 'byName': {kt['name']: kt for kt in reversed(result['entities'])}}
+        self.save()
+        return True
+
+    def add(self, account_id, entity_type, entities, built_at=None):
+        account_key = self._account_key(account_id)
+        with self._lock:
+            for key in [key for key in self.by_name if key[0] == account_key and key[1] == entity_type]:
+                for entity in self.by_name.pop(key):
+                    self.by_guid.pop(entity.get('guid'), None)
+            for entity in entities:
+                self.by_name.setdefault((account_key, entity_type, entity['name']), []).append(entity)
+                if 'guid' in entity:
+                    self.by_guid[entity['guid']] = entity
+            self.built.setdefault(account_key, {})[entity_type] = {'builtAt': built_at or time.time(),
+                                                                   'entities': entities}
+
+    def find(self, account_id, entity_type, name):
+        return self.by_name.get((self._account_key(account_id), entity_type, name), [])
+
+    def find_by_guid(self, guid):
+        return self.by_guid.get(guid)
+
+    def find_key_transaction(self, api_key, name):
+        return self.key_transactions.get(self._api_key_hash(api_key), {}).get('byName', {}).get(name)
+
+    def save(self):
+        if not self.file_name:
+            return
+        Path(self.file_name).parent.mkdir(mode=0o777, parents=True, exist_ok=True)
+        with self._lock:
+            index_json = json.dumps({'accounts': self.built, 'keyTransactions': self.key_transactions})
+        Path(self.file_name).write_text(index_json)
+
+    def load(self):
+        index_json = json.loads(Path(self.file_name).read_text())
+        for account_key, types in index_json.get('accounts', {}).items():
+            for entity_type, built in types.items():
+                self.add(account_key, entity_type, built['entities'], built['builtAt'])
+        self.key_transactions = index_json.get('keyTransactions', {})
+
+    @staticmethod
+    def _account_key(account_id):
+        return str(account_id)
+
+    @staticmethod
+    def _api_key_hash(api_key):
+        return hashlib.sha256(str(api_key).encode()).hexdigest()
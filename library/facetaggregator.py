@@ -0,0 +1,110 @@
+import os
+import csv
+import heapq
+import tempfile
+from array import array
+import library.nrpylogger as nrpy_logger
+
+# facet combinations held in memory before the sums are spilled to disk as a sorted run
+DEFAULT_MAX_KEYS = 500000
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# Sums NRQL results per facet combination within a bounded memory budget.
+# Facet values are interned and combinations are kept as tuples of small int codes, the sums live in a double array
+# indexed by combination. Once max_keys combinations or max_values interned values are held, they are written to
+# disk as a run sorted by facet values, each row carrying its own facet strings, and memory is cleared including the
+# intern table. rows() k-way merges the runs, summing combinations found in several runs, so the output is streamed
+# in facet order without ever loading all the combinations.
+class FacetAggregator:
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS, spill_dir=None, max_values=None):
+        self.max_keys = max_keys
+        self.max_values = max_values or max_keys
+        self.spill_dir = spill_dir
+        self.codes = {}
+        self.facet_values = []
+        self.slots = {}
+        self.sums = array('d')
+        self.runs = []
+
+    def add(self, facet, value):
+        if not isinstance(facet, list):
+            facet = [facet]
+        facet = [str(facet_value) for facet_value in facet]
+        codes = [self.codes.get(facet_value) for facet_value in facet]
+        slot = None if None in codes else self.slots.get(tuple(codes))
+        if slot is None:
+            # spilled before interning, the codes of a run are only valid until it is spilled
+            if len(self.slots) >= self.max_keys or len(self.facet_values) + len(facet) > self.max_values:
+                self._spill()
+            key = tuple(self._encode(facet_value) for facet_value in facet)
+            self.slots[key] = len(self.sums)
+            self.sums.append(value)
+        else:
+            self.sums[slot] += value
+
+    # yields (facet values list, sum) ordered by facet values
+    def rows(self):
+        if not self.runs:
+            for facets, total in self._sorted_slots():
+                yield list(facets), total
+            return
+        self._spill()
+        files = [open(run, newline='') for run in self.runs]
+        try:
+            merged = heapq.merge(*[self._read_run(run_file) for run_file in files])
+            current, total = None, 0.0
+            for facets, value in merged:
+                if facets != current:
+                    if current is not None:
+                        yield list(current), total
+                    current, total = facets, 0.0
+                total += value
+            if current is not None:
+                yield list(current), total
+        finally:
+            for run_file in files:
+                run_file.close()
+
+    def close(self):
+        for run in self.runs:
+            os.remove(run)
+        self.runs = []
+        self._clear()
+
+    def _encode(self, facet_value):
+        code = self.codes.get(facet_value)
+        if code is None:
+            code = len(self.facet_values)
+            self.codes[facet_value] = code
+            self.facet_values.append(facet_value)
+        return code
+
+    def _sorted_slots(self):
+        return sorted((tuple(self.facet_values[code] for code in key), self.sums[slot])
+                      for key, slot in self.slots.items())
+
+    def _spill(self):
+        if not self.slots:
+            return
+        file_descriptor, run = tempfile.mkstemp(prefix='facets-', suffix='.csv', dir=self.spill_dir)
+        with os.fdopen(file_descriptor, 'w', newline='') as run_file:
+            writer = csv.writer(run_file)
+            for facets, total in self._sorted_slots():
+                writer.writerow(list(facets) + [repr(total)])
+        logger.debug('Spilled ' + str(len(self.slots)) + ' facet combinations to ' + run)
+        self.runs.append(run)
+        self._clear()
+
+    def _clear(self):
+        self.codes = {}
+        self.facet_values = []
+        self.slots = {}
+        self.sums = array('d')
+
+    @staticmethod
+    def _read_run(run_file):
+        for row in csv.reader(run_file):
+            yield tuple(row[:-1]), float(row[-1])
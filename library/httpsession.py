@@ -0,0 +1,115 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import library.nrpylogger as nrpy_logger
+from library.endpoints import Endpoints
+
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_SIZE = 20
+DEFAULT_HEADERS = {'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'}
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# one keep-alive requests.Session per region, shared by GraphQl and the REST v2 helpers
+class HttpSessions:
+    _sessions = {}
+    _lock = threading.Lock()
+    pool_connections = DEFAULT_POOL_CONNECTIONS
+    pool_size = DEFAULT_POOL_SIZE
+
+    @classmethod
+    def configure(cls, pool_size=DEFAULT_POOL_SIZE, pool_connections=DEFAULT_POOL_CONNECTIONS):
+        with cls._lock:
+            cls.pool_size = pool_size
+            cls.pool_connections = pool_connections
+            sessions = list(cls._sessions.values())
+            cls._sessions = {}
+        for session in sessions:
+            session.close()
+
+    # raises the pool size of the sessions created from now on. Open sessions are left as they are, closing them
+    # would break the requests other threads have in flight on them
+    @classmethod
+    def ensure_pool_size(cls, pool_size):
+        with cls._lock:
+            if cls.pool_size >= pool_size:
+                return
+            cls.pool_size = pool_size
+            if cls._sessions:
+                logger.debug('Pool size raised to ' + str(pool_size) + ', open sessions keep their pool')
+
+    @classmethod
+    def of(cls, region=Endpoints.REGION_US):
+        region = cls._region_key(region)
+        session = cls._sessions.get(region)
+        if session is None:
+            with cls._lock:
+                session = cls._sessions.get(region)
+                if session is None:
+                    session = cls._new_session()
+                    cls._sessions[region] = session
+                    logger.debug('Created http session for region ' + region + ' with pool size ' +
+                                 str(cls.pool_size))
+        return session
+
+    @classmethod
+    def stats(cls):
+        all_stats = {}
+        for region, session in list(cls._sessions.items()):
+            region_stats = {'hosts': {}, 'requests': 0, 'connections': 0, 'idleSockets': 0}
+            adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+            for adapter in adapters.values():
+                for pool_key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(pool_key)
+                    if pool is None:
+                        continue
+                    pool_stats = cls._pool_stats(pool)
+                    region_stats['hosts'][pool.host] = pool_stats
+                    region_stats['requests'] += pool_stats['requests']
+                    region_stats['connections'] += pool_stats['connections']
+                    region_stats['idleSockets'] += pool_stats['idleSockets']
+            region_stats['reuseRate'] = cls._reuse_rate(region_stats['requests'], region_stats['connections'])
+            all_stats[region] = region_stats
+        return all_stats
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            sessions = list(cls._sessions.values())
+            cls._sessions = {}
+        for session in sessions:
+            session.close()
+
+    @classmethod
+    def _new_session(cls):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=cls.pool_connections, pool_maxsize=cls.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update(DEFAULT_HEADERS)
+        return session
+
+    @staticmethod
+    def _region_key(region):
+        if not region:
+            return Endpoints.REGION_US
+        return region.lower()
+
+    @classmethod
+    def _pool_stats(cls, pool):
+        idle_sockets = 0
+        if pool.pool is not None:
+            idle_sockets = len([conn for conn in list(pool.pool.queue) if conn is not None])
+        return {'requests': pool.num_requests,
+                'connections': pool.num_connections,
+                'idleSockets': idle_sockets,
+                'reuseRate': cls._reuse_rate(pool.num_requests, pool.num_connections)}
+
+    @staticmethod
+    def _reuse_rate(num_requests, num_connections):
+        if num_requests == 0:
+            return 0.0
+        return max(0.0, 1.0 - float(num_connections) / num_requests)
@@ -56,11 +56,16 @@ def create_storage_dirs(account_id, timestamp):
     return storage_dir
 
 
+# an existing file with the same json is left as is
 def save_json_to_file(entity_json, file_name):
     curr_dir = Path(".")
     to_file = curr_dir / file_name
+    entity_text = json.dumps(entity_json, indent=utils.DEFAULT_INDENT)
+    if to_file.exists() and to_file.read_text() == entity_text:
+        logger.info("Unchanged " + to_file.name)
+        return
     store_file = create_file(to_file)
-    store_file.write_text(json.dumps(entity_json, indent=utils.DEFAULT_INDENT))
+    store_file.write_text(entity_text)
 
 
 def create_file(file_name):
@@ -139,6 +144,18 @@ def save_dict_as_csv(name: str, csv_data: dict, header: list):
                 csv_writer.writerow([key, value])
 
 
+# writes rows as they are produced, rows can be any iterable of (list of columns, value)
+def save_rows_as_csv(name: str, rows, header: list):
+    csv_data_file = Path(".") / name
+    create_file(csv_data_file)
+    with open(str(csv_data_file), 'w', newline='') as csvfile:
+        csv_writer = csv.writer(csvfile, delimiter=',',
+                                quotechar='"', quoting=csv.QUOTE_ALL)
+        csv_writer.writerow(iter(header))
+        for columns, value in rows:
+            csv_writer.writerow(columns + [value])
+
+
 def save_list_of_dict_as_csv(list_of_dicts, file_name):
     if list_of_dicts:
         column_names = list_of_dicts[0].keys()
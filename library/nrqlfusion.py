@@ -0,0 +1,43 @@
+import os
+import re
+import library.nrpylogger as nrpy_logger
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+def normalize(clause):
+    clause = re.sub(r'\s+', ' ', str(clause).strip())
+    return re.sub(r'\s*,\s*', ',', clause)
+
+
+# Groups nrql2csv entries that can run as one NRQL query. Entries over the same account, FROM, WHERE and FACET
+# only differ in what they SELECT, so their aggregates are queried together as `output0`, `output1`... and each
+# result row is fanned back out to the entry it belongs to. The facets are query wide, entries faceting or filtering
+# differently are left in their own group.
+# returns a list of groups, each a dict with account_id, from, where, facet, selects and the member entry names
+def fuse(nrqls, default_account_id, enabled=True):
+    groups = {}
+    fused = []
+    for nrql in nrqls:
+        account_id = nrql.get('account_id', default_account_id)
+        key = (account_id, normalize(nrql['from']), normalize(nrql['where']), normalize(nrql['facet']))
+        group = groups.get(key) if enabled else None
+        if group is None:
+            group = {'account_id': account_id, 'from': nrql['from'], 'where': nrql['where'],
+                     'facet': nrql['facet'], 'selects': [], 'names': []}
+            groups[key] = group
+            fused.append(group)
+        group['selects'].append(nrql['select'])
+        group['names'].append(nrql['name'])
+    for group in fused:
+        if len(group['names']) > 1:
+            logger.info('Fused ' + ', '.join(group['names']) + ' into one query')
+    return fused
+
+
+def select_clause(group):
+    return ', '.join(f'{select} AS `{output_alias(index)}`' for index, select in enumerate(group['selects']))
+
+
+def output_alias(index):
+    return 'output' + str(index)
@@ -0,0 +1,87 @@
+import os
+import library.nrpylogger as nrpy_logger
+
+MINUTE_MS = 60 * 1000
+HOUR_MS = 60 * MINUTE_MS
+# LIMIT MAX returns at most this many facets
+DEFAULT_FACET_LIMIT = 5000
+# windows returning fewer facets than this share of the limit let the following windows grow
+GROW_BELOW = 0.25
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# Plans the time windows of a faceted NRQL export. Windows that hit the facet limit are split in half and queried
+# again, down to min_ms. Windows returning few facets double the size of the windows planned after them, up to max_ms.
+# Windows are handed out lazily so the sizes adapt to the results of the windows completed so far.
+# covered : sorted, non overlapping windows whose results are already known, they are skipped
+class WindowPlanner:
+
+    def __init__(self, start_ms, end_ms, initial_ms, min_ms, max_ms, facet_limit=DEFAULT_FACET_LIMIT, covered=None):
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.size_ms = max(min_ms, min(initial_ms, max_ms))
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.facet_limit = facet_limit
+        self.next_start = start_ms
+        self.covered = list(covered or [])
+        self.splits = []
+        self.queried = 0
+        self.split_count = 0
+
+    def has_next(self):
+        self._skip_covered()
+        return bool(self.splits) or self.next_start < self.end_ms
+
+    def next_window(self):
+        if self.splits:
+            return self.splits.pop()
+        self._skip_covered()
+        if self.next_start >= self.end_ms:
+            return None
+        until = min(self.end_ms, self.next_start + self.size_ms)
+        if self.covered:
+            until = min(until, self.covered[0][0])
+        window = (self.next_start, until)
+        self.next_start = until
+        return window
+
+    # returns True when the results of the window are complete and can be merged,
+    # False when the window was split and its halves will be handed out again
+    def complete(self, window, result_count):
+        self.queried += 1
+        duration = window[1] - window[0]
+        if result_count >= self.facet_limit:
+            if self.can_split(window):
+                middle = window[0] + duration // 2
+                self.splits.extend([(middle, window[1]), (window[0], middle)])
+                self.size_ms = max(self.min_ms, min(self.size_ms, duration // 2))
+                self.split_count += 1
+                logger.info('window ' + str(window) + ' hit the facet limit, splitting it')
+                return False
+            logger.warning('window ' + str(window) + ' hit the facet limit at the minimum window size, '
+                           'results are truncated')
+        elif result_count < self.facet_limit * GROW_BELOW and duration >= self.size_ms:
+            self.size_ms = min(self.max_ms, self.size_ms * 2)
+        return True
+
+    def can_split(self, window):
+        return (window[1] - window[0]) // 2 >= self.min_ms
+
+    def stop(self):
+        self.splits = []
+        self.next_start = self.end_ms
+
+    def _skip_covered(self):
+        while self.covered and self.covered[0][0] <= self.next_start:
+            self.next_start = max(self.next_start, self.covered.pop(0)[1])
+
+
+# picks stored windows inside [start_ms, end_ms] that do not overlap each other, earliest first
+def non_overlapping(windows, start_ms, end_ms):
+    picked = []
+    for window in sorted(windows):
+        if window[0] >= start_ms and window[1] <= end_ms and (not picked or window[0] >= picked[-1][1]):
+            picked.append(window)
+    return picked
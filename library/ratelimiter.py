@@ -0,0 +1,169 @@
+import os
+import time
+import random
+import hashlib
+import threading
+import requests
+import library.nrpylogger as nrpy_logger
+from library.endpoints import Endpoints
+from library.httpsession import HttpSessions
+
+
+DEFAULT_RATE = 25.0
+DEFAULT_BURST = 50
+DEFAULT_MAX_CONCURRENCY = 50
+MIN_CONCURRENCY = 1
+DEFAULT_MAX_RETRIES = 6
+BASE_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30.0
+THROTTLED_STATUSES = [429]
+RETRY_STATUSES = [500, 502, 503, 504]
+OK = 'ok'
+THROTTLED = 'throttled'
+RETRY = 'retry'
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+class TokenBucket:
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# additive increase / multiplicative decrease of the number of requests allowed in flight
+class AimdLimiter:
+
+    def __init__(self, max_limit=DEFAULT_MAX_CONCURRENCY, min_limit=MIN_CONCURRENCY, decrease_factor=0.5):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.throttled = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, outcome):
+        with self._condition:
+            self.in_flight -= 1
+            if outcome == THROTTLED:
+                self.throttled += 1
+                # a burst of 429s from requests already in flight only counts as one congestion signal
+                now = time.monotonic()
+                if now - self._last_decrease > 1.0:
+                    self._last_decrease = now
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    logger.warning('Throttled, reducing concurrency to ' + str(int(self.limit)))
+            elif outcome == OK:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+
+# one token bucket and AIMD limiter per api key and region, shared by every client in the process
+class RateLimiter:
+    _limiters = {}
+    _lock = threading.Lock()
+    rate = DEFAULT_RATE
+    burst = DEFAULT_BURST
+    max_concurrency = DEFAULT_MAX_CONCURRENCY
+    max_retries = DEFAULT_MAX_RETRIES
+
+    def __init__(self, rate, burst, max_concurrency):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AimdLimiter(max_concurrency)
+
+    @classmethod
+    def configure(cls, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                  max_retries=DEFAULT_MAX_RETRIES):
+        with cls._lock:
+            cls.rate = rate
+            cls.burst = burst
+            cls.max_concurrency = max_concurrency
+            cls.max_retries = max_retries
+            cls._limiters = {}
+
+    @classmethod
+    def of(cls, api_key, region=Endpoints.REGION_US):
+        key = (hashlib.sha256(str(api_key).encode()).hexdigest(), (region or Endpoints.REGION_US).lower())
+        limiter = cls._limiters.get(key)
+        if limiter is None:
+            with cls._lock:
+                limiter = cls._limiters.get(key)
+                if limiter is None:
+                    limiter = RateLimiter(cls.rate, cls.burst, cls.max_concurrency)
+                    cls._limiters[key] = limiter
+        return limiter
+
+    # send : no-arg callable returning a response, classify : maps a response to OK, THROTTLED or RETRY
+    def call(self, send, classify=None):
+        classify = classify or classify_status
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.concurrency.acquire()
+            outcome = RETRY
+            response = None
+            try:
+                response = send()
+                outcome = classify(response)
+                if outcome == OK or attempt >= self.max_retries:
+                    return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as ex:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning('Connection error ' + str(ex))
+            finally:
+                self.concurrency.release(outcome)
+            delay = backoff(attempt, response)
+            if response is not None:
+                # returns the connection of a dropped response to the pool, a streamed body is never read
+                response.close()
+            logger.warning('Retrying after ' + outcome + ' in ' + '%.2f' % delay + 's, attempt ' + str(attempt + 1))
+            time.sleep(delay)
+            attempt += 1
+
+
+def classify_status(response):
+    if response.status_code in THROTTLED_STATUSES:
+        return THROTTLED
+    if response.status_code in RETRY_STATUSES:
+        return RETRY
+    return OK
+
+
+# exponential backoff with full jitter, never sooner than a Retry-After header asks for
+def backoff(attempt, response=None):
+    delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** attempt)))
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+    return delay
+
+
+def request(api_key, method, url, region=Endpoints.REGION_US, classify=None, **kwargs):
+    session = HttpSessions.of(region)
+    return RateLimiter.of(api_key, region).call(lambda: session.request(method, url, **kwargs), classify)
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+import library.nrpylogger as nrpy_logger
+
+DEFAULT_CACHE_FILE = 'db/responsecache.sqlite'
+DEFAULT_MAX_ENTRIES = 100000
+DAY_SECONDS = 24 * 60 * 60
+DEFAULT_TTL = DAY_SECONDS
+# seconds a cached response stays fresh, per operation
+DEFAULT_TTLS = {'currentUserAccounts': DAY_SECONDS,
+                'conditionDetails': DAY_SECONDS,
+                'permalink': 30 * DAY_SECONDS,
+                'entityByName': DAY_SECONDS,
+                'appEntity': DAY_SECONDS}
+# the entry count is only checked against max_entries every so many writes
+EVICT_EVERY = 100
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# Read-through cache of NerdGraph and REST responses in a sqlite file, shared by every client in the process.
+# Entries are keyed by a hash of the operation, the api key and the normalized lookup arguments, expire after the
+# ttl of their operation and the least recently used ones are evicted beyond max_entries.
+# Off unless a script calls configure(enabled=True), refresh=True fetches everything again and rewrites the entries.
+class ResponseCache:
+    _shared = None
+    _lock = threading.Lock()
+    enabled = False
+    refresh = False
+    file_name = DEFAULT_CACHE_FILE
+    max_entries = DEFAULT_MAX_ENTRIES
+    ttls = dict(DEFAULT_TTLS)
+
+    def __init__(self, file_name=DEFAULT_CACHE_FILE, max_entries=DEFAULT_MAX_ENTRIES):
+        Path(file_name).parent.mkdir(mode=0o777, parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._connection_lock = threading.Lock()
+        self.connection = sqlite3.connect(file_name, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, operation TEXT, '
+                                'value TEXT, expires_at REAL, used_at REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)')
+        self.connection.commit()
+        self.evict()
+
+    @classmethod
+    def configure(cls, enabled=True, refresh=False, file_name=DEFAULT_CACHE_FILE, max_entries=DEFAULT_MAX_ENTRIES,
+                  ttls=None):
+        with cls._lock:
+            cls.enabled = enabled
+            cls.refresh = refresh
+            cls.file_name = file_name
+            cls.max_entries = max_entries
+            cls.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+            if cls._shared:
+                cls._shared.close()
+            cls._shared = None
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            with cls._lock:
+                if cls._shared is None:
+                    cls._shared = ResponseCache(cls.file_name, cls.max_entries)
+        return cls._shared
+
+    @staticmethod
+    def key(operation, api_key, key_parts):
+        api_key_hash = hashlib.sha256(str(api_key).encode()).hexdigest()
+        return hashlib.sha256(json.dumps([operation, api_key_hash, key_parts], sort_keys=True,
+                                         default=str).encode()).hexdigest()
+
+    # returns (True, value) for a fresh entry, (False, None) otherwise
+    def get(self, key):
+        now = time.time()
+        with self._connection_lock:
+            row = self.connection.execute('SELECT value, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] < now:
+                self.misses += 1
+                return False, None
+            self.connection.execute('UPDATE responses SET used_at = ? WHERE key = ?', (now, key))
+            self.connection.commit()
+        self.hits += 1
+        return True, json.loads(row[0])
+
+    def put(self, key, operation, value, ttl):
+        now = time.time()
+        with self._connection_lock:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                    (key, operation, json.dumps(value), now + ttl, now))
+            self.connection.commit()
+            self._writes += 1
+            if self._writes % EVICT_EVERY:
+                return
+        self.evict()
+
+    # drops expired entries, then the least recently used ones beyond max_entries
+    def evict(self):
+        with self._connection_lock:
+            self.connection.execute('DELETE FROM responses WHERE expires_at < ?', (time.time(),))
+            count = self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses '
+                                        'ORDER BY used_at LIMIT ?)', (count - self.max_entries,))
+                logger.info('Evicted ' + str(count - self.max_entries) + ' cached responses')
+            self.connection.commit()
+
+    def close(self):
+        with self._connection_lock:
+            self.connection.close()
+
+
+def default_cacheable(value):
+    return value is not None and not (isinstance(value, dict) and 'error' in value)
+
+
+# returns the cached result of loader() for operation, api_key and key_parts, calling loader on a miss
+def cached(operation, api_key, key_parts, loader, cacheable=default_cacheable):
+    if not ResponseCache.enabled:
+        return loader()
+    cache = ResponseCache.shared()
+    key = ResponseCache.key(operation, api_key, key_parts)
+    if not ResponseCache.refresh:
+        found, value = cache.get(key)
+        if found:
+            return value
+    value = loader()
+    if cacheable(value):
+        cache.put(key, operation, value, ResponseCache.ttls.get(operation, DEFAULT_TTL))
+    return value
+
+
+# per item variant of cached for batch lookups, loader is only called with the items that missed and must return
+# one result per item, in order
+def cached_each(operation, api_key, key_parts, items, loader, cacheable=default_cacheable):
+    if not ResponseCache.enabled:
+        return loader(items)
+    cache = ResponseCache.shared()
+    keys = [ResponseCache.key(operation, api_key, key_parts + [item]) for item in items]
+    results = [None] * len(items)
+    missed = []
+    for index, key in enumerate(keys):
+        found, value = (False, None) if ResponseCache.refresh else cache.get(key)
+        if found:
+            results[index] = value
+        else:
+            missed.append(index)
+    if missed:
+        for index, value in zip(missed, loader([items[index] for index in missed])):
+            results[index] = value
+            if cacheable(value):
+                cache.put(keys[index], operation, value, ResponseCache.ttls.get(operation, DEFAULT_TTL))
+    return results
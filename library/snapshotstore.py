@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+from pathlib import Path
+import library.nrpylogger as nrpy_logger
+
+DEFAULT_SNAPSHOT_FILE = 'db/snapshots.sqlite'
+DASHBOARD = 'dashboard'
+PAGE = 'page'
+WIDGET = 'widget'
+CONDITION = 'condition'
+POLICY = 'policy'
+# list fields stored as separate objects, so pages and widgets shared by several dashboards are stored once
+SPLITS = {DASHBOARD: [('pages', PAGE)], PAGE: [('widgets', WIDGET)]}
+REF = '$ref'
+ADDED = 'added'
+MODIFIED = 'modified'
+DELETED = 'deleted'
+# versions are committed every so many records, and on close
+COMMIT_EVERY = 100
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# the same json whatever the order of its keys
+def canonical(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
+# Content addressed history of dashboards, conditions, policies or any json object, in a sqlite file.
+# Objects are stored once per distinct content, keyed by the hash of their canonical json and zlib compressed.
+# save(kind, key, obj) only records a version when the hash differs from the key's latest version, so a run over
+# unchanged objects writes nothing and changes_since(timestamp) lists the added, modified and deleted keys.
+class SnapshotStore:
+
+    def __init__(self, file_name=DEFAULT_SNAPSHOT_FILE):
+        Path(file_name).parent.mkdir(mode=0o777, parents=True, exist_ok=True)
+        self.file_name = file_name
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS objects (hash TEXT PRIMARY KEY, body BLOB)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS versions (kind TEXT, key TEXT, hash TEXT, '
+                                'recorded_at REAL, PRIMARY KEY (kind, key, recorded_at))')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS latest (kind TEXT, key TEXT, hash TEXT, '
+                                'PRIMARY KEY (kind, key))')
+        self.connection.commit()
+        self.saved = 0
+        self.unchanged = 0
+        self._records = 0
+
+    # returns True when obj differs from the latest version of kind and key
+    def save(self, kind, key, obj):
+        object_hash = self._put(kind, obj)
+        if self.latest_hash(kind, key) == object_hash:
+            self.unchanged += 1
+            return False
+        self._record(kind, key, object_hash)
+        self.saved += 1
+        return True
+
+    def latest_hash(self, kind, key):
+        row = self.connection.execute('SELECT hash FROM latest WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        return row[0] if row else None
+
+    # the object as of its latest version, or of the last version recorded at or before at
+    def load(self, kind, key, at=None):
+        if at is None:
+            object_hash = self.latest_hash(kind, key)
+        else:
+            row = self.connection.execute('SELECT hash FROM versions WHERE kind = ? AND key = ? AND recorded_at <= ? '
+                                          'ORDER BY recorded_at DESC LIMIT 1', (kind, key, at)).fetchone()
+            object_hash = row[0] if row else None
+        return self._get(kind, object_hash) if object_hash else None
+
+    # records the keys of kind starting with key_prefix that are not in present_keys as deleted
+    def mark_deleted(self, kind, present_keys, key_prefix=''):
+        present_keys = set(present_keys)
+        rows = self.connection.execute('SELECT key FROM latest WHERE kind = ? AND hash IS NOT NULL', (kind,))
+        deleted = [key for key, in rows.fetchall() if key.startswith(key_prefix) and key not in present_keys]
+        for key in deleted:
+            self._record(kind, key, None)
+        return deleted
+
+    # [{'kind', 'key', 'change': ADDED, MODIFIED or DELETED, 'recordedAt'}] for every version recorded after since
+    def changes_since(self, since, kind=None):
+        self.connection.commit()
+        changes = []
+        query = ('SELECT kind, key, hash, recorded_at, (SELECT hash FROM versions previous WHERE '
+                 'previous.kind = v.kind AND previous.key = v.key AND previous.recorded_at < v.recorded_at '
+                 'ORDER BY previous.recorded_at DESC LIMIT 1) FROM versions v WHERE recorded_at > ?')
+        parameters = [since]
+        if kind:
+            query += ' AND kind = ?'
+            parameters.append(kind)
+        for row_kind, key, object_hash, recorded_at, previous_hash in self.connection.execute(
+                query + ' ORDER BY recorded_at', parameters):
+            change = DELETED if object_hash is None else ADDED if previous_hash is None else MODIFIED
+            changes.append({'kind': row_kind, 'key': key, 'change': change, 'recordedAt': recorded_at})
+        return changes
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    # stores the split fields of obj as objects of their own then obj with references in their place
+    def _put(self, kind, obj):
+        if isinstance(obj, dict) and kind in SPLITS:
+            obj = dict(obj)
+            for field, child_kind in SPLITS[kind]:
+                if isinstance(obj.get(field), list):
+                    obj[field] = [{REF: self._put(child_kind, child)} for child in obj[field]]
+        body = canonical(obj)
+        object_hash = hashlib.sha256(body.encode()).hexdigest()
+        self.connection.execute('INSERT OR IGNORE INTO objects VALUES (?, ?)',
+                                (object_hash, zlib.compress(body.encode())))
+        return object_hash
+
+    def _get(self, kind, object_hash):
+        row = self.connection.execute('SELECT body FROM objects WHERE hash = ?', (object_hash,)).fetchone()
+        obj = json.loads(zlib.decompress(row[0]))
+        if isinstance(obj, dict):
+            for field, child_kind in SPLITS.get(kind, []):
+                if isinstance(obj.get(field), list):
+                    obj[field] = [self._get(child_kind, child[REF]) for child in obj[field]]
+        return obj
+
+    def _record(self, kind, key, object_hash):
+        self.connection.execute('INSERT INTO versions VALUES (?, ?, ?, ?)', (kind, key, object_hash, time.time()))
+        self.connection.execute('INSERT OR REPLACE INTO latest VALUES (?, ?, ?)', (kind, key, object_hash))
+        self._records += 1
+        if self._records % COMMIT_EVERY == 0:
+            self.connection.commit()
@@ -0,0 +1,73 @@
+import os
+import csv
+import sqlite3
+from pathlib import Path
+import library.nrpylogger as nrpy_logger
+
+CSV = 'csv'
+SQLITE = 'sqlite'
+KEY_FIELDS = ['key', 'entities', 'distinctValues']
+VALUE_FIELDS = ['key', 'value', 'entities']
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# Counts the tags returned inline by an entitySearch page by page: entities per tag key, distinct values per key and
+# entities per key and value. Only the counts are kept, the entities themselves are dropped once counted.
+class TagInventory:
+
+    def __init__(self):
+        self.entities = 0
+        self.entities_by_key = {}
+        self.entities_by_value = {}
+
+    def add(self, entities):
+        for entity in entities:
+            self.entities += 1
+            for tag in entity.get('tags') or []:
+                key = tag['key']
+                self.entities_by_key[key] = self.entities_by_key.get(key, 0) + 1
+                for value in set(tag['values']):
+                    self.entities_by_value[(key, value)] = self.entities_by_value.get((key, value), 0) + 1
+
+    def key_rows(self):
+        distinct_values = {}
+        for key, value in self.entities_by_value:
+            distinct_values[key] = distinct_values.get(key, 0) + 1
+        return [{'key': key, 'entities': count, 'distinctValues': distinct_values.get(key, 0)}
+                for key, count in sorted(self.entities_by_key.items(), key=lambda item: (-item[1], item[0]))]
+
+    def value_rows(self):
+        return [{'key': key, 'value': value, 'entities': count}
+                for (key, value), count in sorted(self.entities_by_value.items(),
+                                                  key=lambda item: (item[0][0], -item[1], item[0][1]))]
+
+    # writes <name>_keys.csv and <name>_values.csv, or the tag_keys and tag_values tables of <name>.sqlite
+    def save(self, name, output_format=CSV):
+        if output_format == SQLITE:
+            file_name = name + '.sqlite'
+            self._save_sqlite(file_name)
+        else:
+            file_name = name + '_keys.csv, ' + name + '_values.csv'
+            self._save_csv(name + '_keys.csv', KEY_FIELDS, self.key_rows())
+            self._save_csv(name + '_values.csv', VALUE_FIELDS, self.value_rows())
+        logger.info('Saved the tags of ' + str(self.entities) + ' entities to ' + file_name)
+
+    @staticmethod
+    def _save_csv(file_name, fields, rows):
+        with open(file_name, 'w', newline='') as output_file:
+            writer = csv.DictWriter(output_file, fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def _save_sqlite(self, file_name):
+        Path(file_name).unlink(missing_ok=True)
+        connection = sqlite3.connect(file_name)
+        connection.execute('CREATE TABLE tag_keys (key TEXT PRIMARY KEY, entities INTEGER, distinct_values INTEGER)')
+        connection.execute('CREATE TABLE tag_values (key TEXT, value TEXT, entities INTEGER, PRIMARY KEY (key, value))')
+        connection.executemany('INSERT INTO tag_keys VALUES (?, ?, ?)',
+                               ((row['key'], row['entities'], row['distinctValues']) for row in self.key_rows()))
+        connection.executemany('INSERT INTO tag_values VALUES (?, ?, ?)',
+                               ((row['key'], row['value'], row['entities']) for row in self.value_rows()))
+        connection.commit()
+        connection.close()
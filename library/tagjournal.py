@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+import library.nrpylogger as nrpy_logger
+import library.tagmutations as tagmutations
+
+JOURNAL_DIR = 'db'
+PLANNED = 'planned'
+PLAN_COMPLETE = 'planComplete'
+# a journal planned longer ago than this is discarded and the operation planned again, its plans may be stale
+DEFAULT_MAX_AGE_HOURS = 24
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# the journal file of an operation, e.g. ['update_tags', 'owner:John', 'owner:Jack'], run with an api key. The same
+# operation run again with the same key finds the journal of the interrupted run, the key itself is only hashed
+def journal_file(operation, api_key, journal_dir=JOURNAL_DIR):
+    operation_hash = hashlib.sha256(json.dumps([operation, api_key]).encode()).hexdigest()[:16]
+    return str(Path(journal_dir) / ('tagjournal-' + operation_hash + '.jsonl'))
+
+
+# Append-only json lines journal of a bulk tag operation: every planned entity, a planComplete marker, then the
+# outcome of each entity as it completes. A run that stops before the end leaves the journal behind, running the
+# same operation again resumes from the journaled plans and skips the entities already done.
+# A journal without planComplete was interrupted while planning, and one planned more than max_age_hours ago may no
+# longer match the entities, both are started over.
+class TagJournal:
+
+    def __init__(self, file_name, restart=False, max_age_hours=DEFAULT_MAX_AGE_HOURS):
+        self.file_name = file_name
+        self.plans = None
+        self.status = {}
+        self.created_at = None
+        Path(file_name).parent.mkdir(mode=0o777, parents=True, exist_ok=True)
+        if restart and Path(file_name).exists():
+            Path(file_name).unlink()
+        if Path(file_name).exists():
+            self._load()
+        if self.plans is not None and time.time() - (self.created_at or 0) > max_age_hours * 3600:
+            logger.warning(self.file_name + ' is older than ' + str(max_age_hours) + ' hours, planning again')
+            self.plans = None
+            self.status = {}
+        self.journal = open(file_name, 'a' if self.plans is not None else 'w')
+        if self.plans is not None and self._ends_mid_line():
+            self.journal.write('\n')
+
+    def start(self, plans):
+        self.plans = {}
+        for entity_plan in plans:
+            self.plans[entity_plan['entity']['guid']] = entity_plan
+            self._write({'event': PLANNED, 'plan': entity_plan})
+        self.created_at = time.time()
+        self._write({'event': PLAN_COMPLETE, 'count': len(plans), 'createdAt': self.created_at})
+
+    # replaces the plan of an entity planned again, e.g. once its tags could be read
+    def update(self, entity_plan):
+        self.plans[entity_plan['entity']['guid']] = entity_plan
+        self._write({'event': PLANNED, 'plan': entity_plan})
+
+    # the plans not done yet, in plan order
+    def pending(self):
+        return [entity_plan for guid, entity_plan in (self.plans or {}).items()
+                if self.status.get(guid) != tagmutations.DONE]
+
+    # the plans whose last outcome failed, replayed as the retry queue
+    def failed(self):
+        return [entity_plan for guid, entity_plan in (self.plans or {}).items()
+                if self.status.get(guid) == tagmutations.FAILED]
+
+    def done_count(self):
+        return sum(1 for status in self.status.values() if status == tagmutations.DONE)
+
+    def record(self, outcome):
+        self.status[outcome['guid']] = outcome['status']
+        self._write({'event': outcome['status'], 'guid': outcome['guid'], 'errors': outcome['errors']})
+
+    # closes the journal and removes it once every entity is done, returns the plans still failed
+    def finish(self):
+        failed = self.failed()
+        self.journal.close()
+        if failed:
+            logger.warning(str(len(failed)) + ' entities failed, run again to retry them from ' + self.file_name)
+        else:
+            Path(self.file_name).unlink()
+        return failed
+
+    def _write(self, record):
+        self.journal.write(json.dumps(record) + '\n')
+        self.journal.flush()
+
+    def _ends_mid_line(self):
+        with open(self.file_name, 'rb') as journal:
+            journal.seek(0, os.SEEK_END)
+            if not journal.tell():
+                return False
+            journal.seek(-1, os.SEEK_END)
+            return journal.read(1) != b'\n'
+
+    def _load(self):
+        plans = {}
+        with open(self.file_name) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line of a run killed while writing it
+                    continue
+                if record['event'] == PLANNED:
+                    plans[record['plan']['entity']['guid']] = record['plan']
+                elif record['event'] == PLAN_COMPLETE:
+                    self.plans = plans
+                    self.created_at = record.get('createdAt')
+                else:
+                    self.status[record['guid']] = record['event']
+        if self.plans is None:
+            self.status = {}
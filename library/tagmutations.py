@@ -0,0 +1,158 @@
+import os
+import asyncio
+import library.nrpylogger as nrpy_logger
+import library.clients.gqlbatch as gqlbatch
+
+ADD = 'add'
+REPLACE = 'replace'
+DELETE_VALUES = 'deleteValues'
+DELETE_KEYS = 'deleteKeys'
+# AsyncEntityClient batch call of each action
+BATCH_CALLS = {ADD: 'gql_mutate_add_tags_batch',
+               REPLACE: 'gql_mutate_replace_tags_batch',
+               DELETE_VALUES: 'gql_mutate_delete_tag_values_batch',
+               DELETE_KEYS: 'gql_mutate_delete_tag_keys_batch'}
+DONE = 'done'
+FAILED = 'failed'
+# dry run action of an entity whose tags could not be read
+UNREAD = 'unread'
+
+logger = nrpy_logger.get_logger(os.path.basename(__file__))
+
+
+# action : one of the actions above, tags : key:value strings, or keys for DELETE_KEYS
+def mutation(action, tags):
+    return {'action': action, 'tags': tags}
+
+
+# the mutations of one entity, applied in order. mutations is None when the entity's tags could not be read, the
+# entity is then planned again before its mutations are applied
+def plan(entity, mutations):
+    return {'entity': entity, 'mutations': mutations}
+
+
+# the failed outcome journaled for an entity whose tags could not be read, so it is kept in the retry queue
+def unread_outcome(entity_plan):
+    entity = entity_plan['entity']
+    return {'guid': entity['guid'], 'name': entity.get('name'), 'status': FAILED,
+            'errors': [{'message': 'Tags could not be read'}]}
+
+
+# {key: set of values} of the tags returned inline by an entitySearch
+def tag_values(tags):
+    return {tag['key']: set(tag['values']) for tag in tags or []}
+
+
+def has_tag(current, tag):
+    key, value = tag.split(':', 1)
+    return value in current.get(key, ())
+
+
+# The fewest mutations that remove delete_values and add add_tags, both key:value strings, given the entity's current
+# tags. Values already absent are not deleted, values already present are not added, and a value both deleted and
+# added is left alone. An entity already in the target state gets no mutations.
+def retag_mutations(current_tags, delete_values, add_tags):
+    current = tag_values(current_tags)
+    deletes = [tag for tag in delete_values if has_tag(current, tag) and tag not in add_tags]
+    adds = [tag for tag in add_tags if not has_tag(current, tag)]
+    mutations = []
+    if deletes:
+        mutations.append(mutation(DELETE_VALUES, deletes))
+    if adds:
+        mutations.append(mutation(ADD, adds))
+    return mutations
+
+
+# Tag values read as immutable and as mutable from tagsWithMetadata. Hosts mostly carry the same agent reported tags,
+# so a host whose inline tags are all values only ever seen immutable is assumed to have nothing to delete and its
+# metadata is not read. This is a lossy hint: a user set tag equal to a value only seen agent set on other hosts is
+# missed, so it is only used when asked for. A value seen mutable on any host always has its metadata read.
+class ImmutableTagValues:
+
+    def __init__(self):
+        self.values = set()
+        self.mutable_values = set()
+
+    def learn(self, tags_with_metadata):
+        for tag in tags_with_metadata:
+            for value in tag['values']:
+                if value['mutable']:
+                    self.mutable_values.add((tag['key'], value['value']))
+                else:
+                    self.values.add((tag['key'], value['value']))
+
+    def may_be_mutable(self, tags):
+        if tags is None:
+            return True
+        return any((tag['key'], value) not in self.values or (tag['key'], value) in self.mutable_values
+                   for tag in tags for value in tag['values'])
+
+
+def unread_or(mutations):
+    return [mutation(UNREAD, [])] if mutations is None else mutations
+
+
+# one row per planned mutation, for a dry run report
+def plan_rows(plans):
+    return [{'guid': entity_plan['entity']['guid'], 'name': entity_plan['entity'].get('name'),
+             'action': entity_mutation['action'], 'tags': ','.join(entity_mutation['tags'])}
+            for entity_plan in plans for entity_mutation in unread_or(entity_plan['mutations'])]
+
+
+# the errors of one entity in a batch mutation result, empty when the mutation succeeded
+def mutation_errors(result):
+    if 'error' in result:
+        return result['error']
+    if not result.get('response'):
+        return [{'message': 'No mutation result'}]
+    return result['response'].get('errors') or []
+
+
+# Applies the tag mutations of many entities. Entities are taken batch_size at a time and the n-th mutations of a
+# batch are sent as one aliased document per action, so a batch costs one request per step instead of one per entity
+# and step. Batches run concurrently under the AsyncGraphQl concurrency limit of the AsyncEntityClient.
+# An entity stops at its first failed mutation. on_outcome(outcome) is called as each entity completes, with
+# outcome {'guid', 'name', 'status': DONE or FAILED, 'errors': []}.
+class TagMutationPipeline:
+
+    def __init__(self, aec, per_api_key, batch_size=gqlbatch.DEFAULT_BATCH_SIZE, on_outcome=None):
+        self.aec = aec
+        self.per_api_key = per_api_key
+        self.batch_size = batch_size
+        self.on_outcome = on_outcome
+
+    # returns one outcome per plan, in order
+    def run(self, plans):
+        return asyncio.run(self.run_all(plans))
+
+    async def run_all(self, plans):
+        batch_outcomes = await asyncio.gather(*[self._run_batch(batch)
+                                                for batch in gqlbatch.chunks(plans, self.batch_size)])
+        return [outcome for outcomes in batch_outcomes for outcome in outcomes]
+
+    async def _run_batch(self, plans):
+        errors = [[] for _ in plans]
+        for step in range(max(len(entity_plan['mutations']) for entity_plan in plans)):
+            by_action = {}
+            for index, entity_plan in enumerate(plans):
+                if not errors[index] and step < len(entity_plan['mutations']):
+                    step_mutation = entity_plan['mutations'][step]
+                    by_action.setdefault(step_mutation['action'], []).append((index, step_mutation['tags']))
+            for action, indexed_tags in by_action.items():
+                batch_call = getattr(self.aec, BATCH_CALLS[action])
+                results = await batch_call(self.per_api_key, [(plans[index]['entity']['guid'], tags)
+                                                              for index, tags in indexed_tags])
+                # a failed request returns a single error result instead of one per entity
+                if isinstance(results, dict):
+                    results = [results] * len(indexed_tags)
+                for (index, tags), result in zip(indexed_tags, results):
+                    errors[index] = mutation_errors(result)
+        outcomes = []
+        for entity_plan, entity_errors in zip(plans, errors):
+            entity = entity_plan['entity']
+            outcome = {'guid': entity['guid'], 'name': entity.get('name'),
+                       'status': FAILED if entity_errors else DONE, 'errors': entity_errors}
+            if self.on_outcome:
+                self.on_outcome(outcome)
+            outcomes.append(outcome)
+        return outcomes
@@ -3,7 +3,7 @@ import sys
 import library.nrpylogger as nrpylogger
 import library.clients.entityclient as entityclient
 import json
-import requests
+import library.ratelimiter as ratelimiter
 
 
 DEFAULT_INDENT = 2
@@ -39,7 +39,7 @@ def get_paginated_entities(api_key, fetch_url, entity_key, params={}):
     curr_fetch_url = fetch_url
     all_entities = {'response_count': 0, entity_key: []}
     while another_page and error is False:
-        resp = requests.get(curr_fetch_url, headers=setup_headers(api_key), params=params)
+        resp = ratelimiter.request(api_key, 'get', curr_fetch_url, headers=setup_headers(api_key), params=params)
         if resp.status_code == 200:
             resp_json = json.loads(resp.text)
             all_entities[entity_key].extend(resp_json[entity_key])
@@ -1,55 +1,155 @@
 import json
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import library.localstore as store
 import library.clients.nrqlclient as nrqlclient
+import library.nrqlwindows as nrqlwindows
+import library.nrqlfusion as nrqlfusion
+from library.facetaggregator import FacetAggregator, DEFAULT_MAX_KEYS
+from library.checkpointstore import CheckpointStore, DEFAULT_CHECKPOINT_FILE
 from library.endpoints import Endpoints
 import library.nrpylogger as nrpylogger
 
-
-def list_to_csv(list_or_str):
-    if isinstance(list_or_str, str):
-        return list_or_str
-    if isinstance(list_or_str, list):
-        return ','.join(list_or_str)
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MIN_WINDOW_MINUTES = 5
+# windows ending less than this long ago may still receive data so they are not checkpointed
+DEFAULT_CHECKPOINT_SETTLE_MINUTES = 60
 
 
 logger = nrpylogger.get_logger(os.path.basename(__file__))
-config = store.load_json_from_file(".","nrql2csv.json")
-nrqls = config["nrql"]
-since_hours_ago = config["since_days_ago"] * 24
-query_increment_hours = config["query_increment_hours"]
-timeout = config["timeout"]
-batch_count = int(since_hours_ago/query_increment_hours)
-region = Endpoints.REGION_US
-if 'region' in config:
-    region = config['region']
-for nrql in nrqls:
-    logger.info(f'Running query {nrql["name"]}')
-    merged_results = {}
-    for batch in range(batch_count):
-        since_hours = since_hours_ago - batch * query_increment_hours
-        until_hours = since_hours_ago - (batch + 1) * query_increment_hours
-        query = f'FROM {nrql["from"]} SELECT {nrql["select"]} AS `output` WHERE {nrql["where"]} FACET {nrql["facet"]}' \
-                f' SINCE {str(since_hours)} HOURS AGO UNTIL {str(until_hours)} HOURS AGO LIMIT MAX'
+account_slots = {}
+account_slots_lock = threading.Lock()
+
+
+# bounds the number of queries in flight per account across all the nrqls being exported
+def account_slot(account_id, account_concurrency):
+    with account_slots_lock:
+        if account_id not in account_slots:
+            account_slots[account_id] = threading.BoundedSemaphore(account_concurrency)
+        return account_slots[account_id]
+
+
+# all windows are planned from a single now so every worker queries the same absolute time range
+def window_planner(config, start_ms, now_ms, covered):
+    return nrqlwindows.WindowPlanner(start_ms, now_ms,
+                                     int(config["query_increment_hours"] * nrqlwindows.HOUR_MS),
+                                     int(config.get("min_window_minutes", DEFAULT_MIN_WINDOW_MINUTES) *
+                                         nrqlwindows.MINUTE_MS),
+                                     int(config.get("max_window_hours", config["since_days_ago"] * 24) *
+                                         nrqlwindows.HOUR_MS),
+                                     config.get("facet_limit", nrqlwindows.DEFAULT_FACET_LIMIT), covered)
+
+
+def query_hash(group, region):
+    return CheckpointStore.query_hash(group['account_id'], region, group["from"], group["selects"], group["where"],
+                                      group["facet"])
+
+
+# merges the checkpointed windows of the range and returns them so the planner skips them
+def resume_from_checkpoint(checkpoints, qhash, start_ms, end_ms, aggregators):
+    covered = nrqlwindows.non_overlapping(checkpoints.windows(qhash, start_ms, end_ms), start_ms, end_ms)
+    for window in covered:
+        merge(aggregators, checkpoints.load(qhash, window))
+    return covered
+
+
+def build_query(group, since_ms, until_ms):
+    return f'FROM {group["from"]} SELECT {nrqlfusion.select_clause(group)} WHERE {group["where"]} ' \
+           f'FACET {group["facet"]} SINCE {str(since_ms)} UNTIL {str(until_ms)} LIMIT MAX'
+
+
+def run_window(config, group, window, account_concurrency, region):
+    account_id = group['account_id']
+    query = build_query(group, window[0], window[1])
+    with account_slot(account_id, account_concurrency):
         logger.info(query)
-        response = nrqlclient.get_results(query, config['account_id'], config['nr_user_api_key'], timeout, region)
-        if 'error' in response:
-            logger.error(json.dumps(response))
-            logger.error('correct the config to proceed')
-            break
-        if 'results' in response:
-            batch_result = {list_to_csv(result['facet']): result['output'] for result in response['results']}
-            for key, value in batch_result.items():
-                merged_results[key] = merged_results.get(key, 0) + value
-        else:
-            logger.info('no results for this query trying next batch')
-    header_list = nrql["facet"].split(",")
-    header_list.append("summedOutput")
-    store.save_dict_as_csv(f'{nrql["name"]}.csv', merged_results, header_list)
+        if config.get("stream_results", False) and not config.get("async_queries", False):
+            return stream_window(config, query, account_id, region)
+        return nrqlclient.get_results(query, account_id, config['nr_user_api_key'], config['timeout'], region,
+                                      config.get("async_queries", False),
+                                      config.get("poll_timeout", nrqlclient.DEFAULT_POLL_TIMEOUT))
+
 
+# a window's results are kept until the planner knows the window was not truncated, only the parsed items are held
+def stream_window(config, query, account_id, region):
+    stream = nrqlclient.stream_results(query, account_id, config['nr_user_api_key'], config['timeout'], region)
+    results = list(stream)
+    if stream.errors or stream.status != 200:
+        return {'error': nrqlclient.error_from({'status': stream.status, 'error': stream.errors})}
+    return {'results': results}
 
 
+def export_all(config):
+    max_workers = config.get("max_workers", DEFAULT_MAX_WORKERS)
+    account_concurrency = config.get("account_concurrency", max_workers)
+    region = config.get('region', Endpoints.REGION_US)
+    now_ms = int(time.time() * 1000) // nrqlwindows.MINUTE_MS * nrqlwindows.MINUTE_MS
+    start_ms = now_ms - int(config["since_days_ago"] * 24 * nrqlwindows.HOUR_MS)
+    settled_ms = now_ms - config.get("checkpoint_settle_minutes", DEFAULT_CHECKPOINT_SETTLE_MINUTES) * \
+        nrqlwindows.MINUTE_MS
+    checkpoints = None
+    if config.get("checkpoint", True):
+        checkpoints = CheckpointStore(config.get("checkpoint_file", DEFAULT_CHECKPOINT_FILE))
+    nrqls = {nrql["name"]: nrql for nrql in config["nrql"]}
+    groups = nrqlfusion.fuse(config["nrql"], config['account_id'], config.get("fuse_queries", True))
+    merged_results = {name: FacetAggregator(config.get("max_facet_keys", DEFAULT_MAX_KEYS), config.get("spill_dir"),
+                                            config.get("max_facet_values"))
+                      for name in nrqls}
+    aggregators = [[merged_results[name] for name in group['names']] for group in groups]
+    hashes = [query_hash(group, region) for group in groups]
+    planners = []
+    for index, group in enumerate(groups):
+        covered = []
+        if checkpoints:
+            covered = resume_from_checkpoint(checkpoints, hashes[index], start_ms, now_ms, aggregators[index])
+            logger.info(f'{", ".join(group["names"])} resuming with {len(covered)} checkpointed windows')
+        planners.append(window_planner(config, start_ms, now_ms, covered))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+        while True:
+            # only keep max_workers windows in flight so later windows are sized from the results so far
+            for index, group in enumerate(groups):
+                while len(in_flight) < max_workers and planners[index].has_next():
+                    window = planners[index].next_window()
+                    future = executor.submit(run_window, config, group, window, account_concurrency, region)
+                    in_flight[future] = (index, window)
+            if not in_flight:
+                break
+            done, not_done = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, window = in_flight.pop(future)
+                response = future.result() or {}
+                if 'error' in response:
+                    logger.error(json.dumps(response))
+                    logger.error('correct the config to proceed')
+                    planners[index].stop()
+                    continue
+                results = response.get('results', [])
+                if planners[index].complete(window, len(results)):
+                    merge(aggregators[index], results)
+                    if checkpoints and window[1] <= settled_ms:
+                        checkpoints.save(hashes[index], window, results)
+    if checkpoints:
+        checkpoints.close()
+    for index, group in enumerate(groups):
+        logger.info(f'{", ".join(group["names"])} queried in {planners[index].queried} windows, '
+                    f'{planners[index].split_count} split')
+    for name, nrql in nrqls.items():
+        header_list = nrql["facet"].split(",")
+        header_list.append("summedOutput")
+        store.save_rows_as_csv(f'{name}.csv', merged_results[name].rows(), header_list)
+        merged_results[name].close()
 
 
+# sums are order independent so windows can be merged in whatever order they complete
+# aggregators : one per select of the query, in the order of the `output0`, `output1`... aliases
+def merge(aggregators, results):
+    for result in results or []:
+        for index, aggregator in enumerate(aggregators):
+            aggregator.add(result['facet'], result.get(nrqlfusion.output_alias(index)) or 0)
 
 
+if __name__ == '__main__':
+    export_all(store.load_json_from_file(".", "nrql2csv.json"))
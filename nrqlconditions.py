@@ -29,8 +29,11 @@ def search_nrql_conditions(user_api_key, account_id, search_strings_file):
     for event_metric_name in event_metric_names:
         result = nrqlcondition.search(user_api_key,account_id,event_metric_name)
         logger.info(json.dumps(result))
-        total = result['response']['data']['actor']['account']['alerts']['nrqlConditionsSearch']['totalCount']
-        conditions = result['response']['data']['actor']['account']['alerts']['nrqlConditionsSearch']['nrqlConditions']
+        if 'error' in result:
+            nrql_conditions.append([event_metric_name, 0, '', ''])
+            continue
+        total = result['totalCount']
+        conditions = result['nrqlConditions']
         if result['status'] == 200 and total > 0:
             for condition in conditions:
                 nrql_conditions.append([event_metric_name,total,condition['name'],condition['enabled']])
@@ -0,0 +1,23 @@
+import pytest
+from library import ccucost
+
+TIERS = [{'fromCcu': '0', 'pricePerCcu': '1'}, {'fromCcu': '100', 'pricePerCcu': '0.5'},
+         {'fromCcu': '1000', 'pricePerCcu': '0.1'}]
+
+
+def test_tiered_cost():
+    pricing = ccucost.TierPricing(TIERS)
+    assert pricing.costs([0, 50, 100, 600, 2000]) == [0, 50, 100, 350, 650]
+
+
+def test_account_rates_with_discounts():
+    pricing = ccucost.TierPricing(TIERS)
+    fractions = ccucost.paid_fractions([{'accountId': '*', 'discountPercent': '10'},
+                                        {'accountId': '2', 'discountPercent': '50'}])
+    rates = ccucost.account_rates({'1': 100, '2': 500}, pricing, fractions)
+    assert rates['1'] == pytest.approx(350 / 600 * 0.9)
+    assert rates['2'] == pytest.approx(350 / 600 * 0.5)
+    rates = ccucost.account_rates({'1': 100, '2': 500}, pricing, fractions, ccucost.ACCOUNT)
+    assert rates['1'] == pytest.approx(0.9)
+    assert rates['2'] == pytest.approx(300 / 500 * 0.5)
+
@@ -0,0 +1,36 @@
+from library.ccurollup import CcuRollup, nrql_pattern
+
+
+def row(account_id, condition_id, policy_id, query, usage):
+    return {'accountId': account_id, 'conditionId': condition_id, 'conditionName': 'c' + str(condition_id),
+            'policyId': policy_id, 'conditionQuery': query, 'ccuConsumption': usage}
+
+
+def test_nrql_pattern():
+    assert nrql_pattern("SELECT count(*) FROM Transaction WHERE appName = 'a'  AND duration > 1.5") == \
+        nrql_pattern("SELECT count(*) FROM Transaction WHERE appName = 'b' AND duration > 3")
+    assert nrql_pattern("SELECT count(*) FROM Log WHERE message = 'it''s'") == \
+        'SELECT count(*) FROM Log WHERE message = ??'
+
+
+def test_rollups():
+    rollup = CcuRollup()
+    rollup.add_all([row(1, 10, 100, "SELECT count(*) FROM Transaction WHERE appName = 'a'", 5),
+                    row(1, 11, 100, "SELECT count(*) FROM Transaction WHERE appName = 'b'", 3),
+                    row(1, 12, 101, 'SELECT average(duration) FROM Transaction', 1),
+                    row(2, 20, 200, 'SELECT average(duration) FROM Transaction', 10)])
+    assert rollup.account_rows() == [{'accountId': '2', 'conditions': 1, 'ccuConsumption': 10},
+                                     {'accountId': '1', 'conditions': 3, 'ccuConsumption': 9}]
+    assert rollup.policy_rows()[1:] == [{'accountId': '1', 'policyId': '100', 'conditions': 2, 'ccuConsumption': 8},
+                                        {'accountId': '1', 'policyId': '101', 'conditions': 1, 'ccuConsumption': 1}]
+    assert rollup.pattern_rows() == [
+        {'queryPattern': 'SELECT average(duration) FROM Transaction', 'conditions': 2, 'ccuConsumption': 11},
+        {'queryPattern': 'SELECT count(*) FROM Transaction WHERE appName = ?', 'conditions': 2, 'ccuConsumption': 8}]
+
+
+def test_top_k_keeps_the_largest():
+    rollup = CcuRollup(top_k=3)
+    usages = [7, 1, 9, 3, 9, 2, 8, 5]
+    rollup.add_all(row(1, i, 100, 'SELECT count(*) FROM Log', usage) for i, usage in enumerate(usages))
+    assert [(r['conditionId'], r['ccuConsumption']) for r in rollup.top()] == [(2, 9), (4, 9), (6, 8)]
+    assert rollup.rows == len(usages)
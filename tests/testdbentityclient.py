@@ -0,0 +1,17 @@
+import library.utils
+from library.clients.dbentityclient import DashboardEntity
+
+
+def test_dashboards_payload():
+    payload = DashboardEntity._dashboards_payload(12, 'next')
+    assert payload['variables'] == {'query': "type = 'DASHBOARD' AND accountId = '12'", 'cursor': 'next'}
+
+
+def test_extract_dashboards_skips_pages():
+    response = {'data': {'actor': {'entitySearch': {'results': {'nextCursor': None, 'entities': [
+        {'guid': 'd1', 'name': 'Dashboard', 'accountId': 12, 'dashboardParentGuid': None},
+        {'guid': 'p1', 'name': 'Dashboard / Page', 'accountId': 12, 'dashboardParentGuid': 'd1'},
+        {}]}}}}}
+    dashboards, next_cursor = DashboardEntity._extract_dashboards(response)
+    assert [dashboard['guid'] for dashboard in dashboards] == ['d1']
+    assert next_cursor is None
@@ -0,0 +1,50 @@
+from library.entityindex import EntityIndex
+# library.utils imports entityclient, importing it first avoids tripping over that cycle
+import library.utils
+from library.clients.entityclient import EntityClient, APM_APP, MONITOR
+
+APPS = [{'guid': 'g1', 'name': 'checkout', 'accountId': 1, 'entityType': 'APM_APPLICATION_ENTITY', 'language': 'java'},
+        {'guid': 'g2', 'name': 'checkout', 'accountId': 1, 'entityType': 'APM_APPLICATION_ENTITY', 'language': 'go'}]
+
+
+class FakePager:
+
+    def __init__(self, entities):
+        self.entities = entities
+        self.error = None
+
+    def all(self):
+        return self.entities
+
+
+class FakeEntityClient:
+
+    def __init__(self):
+        self.calls = []
+
+    def gql_iter_entities_in_account(self, api_key, entity_type, account_id):
+        self.calls.append(entity_type)
+        return FakePager(APPS if entity_type == APM_APP else [])
+
+
+def test_builds_once_and_persists(tmp_path):
+    index_file = str(tmp_path / 'index.json')
+    fake_client = FakeEntityClient()
+    entity_index = EntityIndex(index_file)
+    assert entity_index.build(fake_client, 'key', 1, [APM_APP, MONITOR]) == []
+    entity_index.build(fake_client, 'key', 1, [APM_APP])
+    assert fake_client.calls == [APM_APP, MONITOR]
+    reloaded = EntityIndex(index_file)
+    assert reloaded.covers('1', APM_APP) and reloaded.covers(1, MONITOR)
+    assert [entity['guid'] for entity in reloaded.find(1, APM_APP, 'checkout')] == ['g1', 'g2']
+    assert reloaded.find_by_guid('g2')['language'] == 'go'
+
+
+def test_entity_client_matches_from_index():
+    entity_index = EntityIndex()
+    entity_index.add(1, APM_APP, APPS)
+    client = EntityClient(entity_index)
+    result = client.gql_get_matching_entity('key', APM_APP, {'name': 'checkout', 'language': 'go'}, '1')
+    assert result['entityFound'] and result['entity']['guid'] == 'g2'
+    result = client.gql_get_matching_entity_by_name('key', APM_APP, 'missing', '1')
+    assert not result['entityFound'] and result['count'] == 0
@@ -0,0 +1,31 @@
+from library.facetaggregator import FacetAggregator
+
+
+def test_sums_in_memory():
+    aggregator = FacetAggregator()
+    aggregator.add(['b', 'x'], 1)
+    aggregator.add(['a', 'y'], 2)
+    aggregator.add(['b', 'x'], 3)
+    assert list(aggregator.rows()) == [(['a', 'y'], 2.0), (['b', 'x'], 4.0)]
+    aggregator.close()
+
+
+def test_merges_spilled_runs(tmp_path):
+    aggregator = FacetAggregator(max_keys=2, spill_dir=str(tmp_path))
+    for facet in ['c', 'a', 'b', 'a', 'd', 'c', 'a']:
+        aggregator.add(facet, 1)
+    assert len(aggregator.runs) == 3
+    assert list(aggregator.rows()) == [(['a'], 3.0), (['b'], 1.0), (['c'], 2.0), (['d'], 1.0)]
+    aggregator.close()
+    assert not list(tmp_path.iterdir())
+
+
+def test_interned_values_stay_bounded(tmp_path):
+    aggregator = FacetAggregator(max_keys=3, spill_dir=str(tmp_path))
+    for number in range(20):
+        aggregator.add(['host' + str(number), 'app' + str(number)], number)
+        assert len(aggregator.facet_values) <= aggregator.max_values
+    assert len(aggregator.runs) > 1
+    assert list(aggregator.rows()) == sorted((['host' + str(number), 'app' + str(number)], float(number))
+                                             for number in range(20))
+    aggregator.close()
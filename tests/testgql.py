@@ -0,0 +1,31 @@
+import time
+import asyncio
+import library.utils
+from library.clients.gql import AsyncGraphQl
+from library.httpsession import HttpSessions
+
+
+def test_timed_out_call_keeps_its_slot():
+    def slow():
+        time.sleep(0.3)
+        return {'status': 200}
+
+    async def run_both(async_gql):
+        timed_out = await async_gql.run(slow, timeout=0.05)
+        started = time.monotonic()
+        second = await async_gql.run(lambda: {'status': 200}, timeout=1)
+        return timed_out, second, time.monotonic() - started
+
+    async_gql = AsyncGraphQl(concurrency=1)
+    timed_out, second, waited = asyncio.run(run_both(async_gql))
+    async_gql.close()
+    assert timed_out['error'][0]['message'] == 'Timed out after 0.05s'
+    assert second == {'status': 200}
+    assert waited >= 0.2
+
+
+def test_open_sessions_are_not_closed():
+    session = HttpSessions.of()
+    AsyncGraphQl(concurrency=HttpSessions.pool_size + 1).close()
+    assert HttpSessions.of() is session
+    HttpSessions.close_all()
@@ -0,0 +1,41 @@
+from library.clients import gqlbatch
+
+
+CONDITIONS = gqlbatch.AliasBatch('c', {'conditionId': 'ID!'}, 'nrqlCondition(id: $conditionId) { name }',
+                                 envelope='actor { account(id: $accountId) { alerts { %s } } }',
+                                 path=('actor', 'account', 'alerts'), shared_variables={'accountId': 'Int!'})
+
+
+def test_aliased_payload():
+    payload = CONDITIONS.payload(['11', '12'], {'accountId': 1})
+    assert payload['query'] == 'query($accountId: Int!, $c0_conditionId: ID!, $c1_conditionId: ID!) { ' \
+                               'actor { account(id: $accountId) { alerts { ' \
+                               'c0: nrqlCondition(id: $c0_conditionId) { name } ' \
+                               'c1: nrqlCondition(id: $c1_conditionId) { name } } } } }'
+    assert payload['variables'] == {'accountId': 1, 'c0_conditionId': '11', 'c1_conditionId': '12'}
+
+
+def test_split_partial_response():
+    response = {'status': 200,
+                'response': {'data': {'actor': {'account': {'alerts': {'c0': {'name': 'a'}, 'c1': None}}}}},
+                'error': [{'message': 'not found', 'path': ['actor', 'account', 'alerts', 'c1']}]}
+    results = CONDITIONS.split(response, 2)
+    assert results[0] == {'status': 200, 'response': {'name': 'a'}}
+    assert results[1]['error'][0]['message'] == 'not found'
+
+
+def test_split_failed_request():
+    response = {'status': 500, 'error': [{'message': 'boom'}]}
+    results = CONDITIONS.split(response, 2)
+    assert all(result['error'][0]['message'] == 'boom' for result in results)
+
+
+def test_split_mutation_response():
+    batch = gqlbatch.AliasBatch('m', {'guid': 'EntityGuid!'},
+                                'taggingDeleteTagFromEntity(guid: $guid) { errors { message } }',
+                                envelope='%s', path=(), operation='mutation')
+    assert batch.payload(['a'])['query'] == 'mutation($m0_guid: EntityGuid!) { ' \
+                                            'm0: taggingDeleteTagFromEntity(guid: $m0_guid) { errors { message } } }'
+    response = {'status': 200, 'response': {'data': {'m0': {'errors': []}, 'm1': {'errors': [{'message': 'no'}]}}}}
+    assert [result['response'] for result in batch.split(response, 2)] == [{'errors': []},
+                                                                           {'errors': [{'message': 'no'}]}]
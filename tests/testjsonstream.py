@@ -0,0 +1,26 @@
+import json
+from library.clients.jsonstream import JsonItemStream
+
+DOCUMENT = {'data': {'other': [{'results': [0]}], 'actor': {'entitySearch': {'results': {
+    'entities': [{'name': 'a "quoted" [name]', 'tags': []}, {'name': 'café', 'n': 1.5e3}, None],
+    'nextCursor': 'abc'}}}}, 'errors': [{'message': 'partial'}]}
+PATH = ('data', 'actor', 'entitySearch', 'results', 'entities')
+
+
+def chunked(text, size):
+    data = text.encode()
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_streams_items_at_path():
+    for size in [1, 3, 4096]:
+        stream = JsonItemStream(chunked(json.dumps(DOCUMENT, ensure_ascii=False), size), PATH)
+        assert list(stream) == DOCUMENT['data']['actor']['entitySearch']['results']['entities']
+        assert stream.errors == [{'message': 'partial'}]
+        assert stream.values['data.actor.entitySearch.results.nextCursor'] == 'abc'
+
+
+def test_missing_path_yields_nothing():
+    stream = JsonItemStream(['{"data": {"actor": {"entitySearch": null}}}'], PATH)
+    assert list(stream) == []
+    assert stream.values['data.actor.entitySearch'] is None
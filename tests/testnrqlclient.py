@@ -0,0 +1,74 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import library.clients.nrqlclient as nrqlclient
+from library.endpoints import USEndpoints
+
+POLLS_BEFORE_COMPLETE = 2
+
+
+# stands in for NerdGraph, async queries complete after a couple of progress polls
+class NerdGraphHandler(BaseHTTPRequestHandler):
+    polls = {}
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        variables = payload['variables']
+        if 'queryId' in variables:
+            query_id = variables['queryId']
+            self.polls[query_id] = self.polls.get(query_id, 0) + 1
+            completed = self.polls[query_id] >= POLLS_BEFORE_COMPLETE
+            results = [{'count': int(query_id)}] if completed else None
+            data = {'account': {'nrqlQueryProgress': {'results': results, 'queryProgress': {
+                'queryId': query_id, 'completed': completed, 'retryAfter': 0}}}}
+        elif variables['async']:
+            data = {'nrql': {'results': None, 'queryProgress': {
+                'queryId': variables['nrqlQuery'], 'completed': False, 'retryAfter': 0}}}
+        else:
+            data = {'nrql': {'results': [{'count': int(variables['nrqlQuery'])}], 'queryProgress': None}}
+        body = json.dumps({'data': {'actor': data}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def nerdgraph(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), NerdGraphHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(USEndpoints, 'GRAPHQL_URL', 'http://127.0.0.1:' + str(server.server_port) + '/graphql')
+    monkeypatch.setattr(nrqlclient, 'MIN_POLL_SECONDS', 0.01)
+    NerdGraphHandler.polls = {}
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_sync_query(nerdgraph):
+    assert nrqlclient.get_results('1', 1, 'key', 60, 'us') == {'results': [{'count': 1}]}
+
+
+def test_async_query_polls_until_complete(nerdgraph):
+    assert nrqlclient.get_results('7', 1, 'key', 60, 'us', async_query=True) == {'results': [{'count': 7}]}
+    assert NerdGraphHandler.polls['7'] == POLLS_BEFORE_COMPLETE
+
+
+def test_async_query_gives_up_after_poll_timeout(nerdgraph):
+    assert 'error' in nrqlclient.get_results('7', 1, 'key', 60, 'us', async_query=True, poll_timeout=0)
+
+
+def test_fetches_async_queries_concurrently(nerdgraph):
+    results = nrqlclient.get_all_results([str(count) for count in range(10)], 1, 'key', 60, 'us')
+    assert [result['results'][0]['count'] for result in results] == list(range(10))
+
+
+def test_streams_sync_query_results(nerdgraph):
+    stream = nrqlclient.stream_results('3', 1, 'key', 60, 'us')
+    assert list(stream) == [{'count': 3}]
+    assert stream.status == 200 and stream.errors is None
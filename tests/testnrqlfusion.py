@@ -0,0 +1,19 @@
+from library import nrqlfusion
+
+
+def entry(name, select, where='a IS NOT NULL', facet='a', source='Log,LogRecord'):
+    return {'name': name, 'from': source, 'select': select, 'where': where, 'facet': facet}
+
+
+def test_fuses_entries_differing_in_select():
+    groups = nrqlfusion.fuse([entry('bytes', 'bytecountestimate()'),
+                              entry('count', 'count(*)', source='Log, LogRecord'),
+                              entry('other', 'count(*)', facet='b')], 1)
+    assert [group['names'] for group in groups] == [['bytes', 'count'], ['other']]
+    assert nrqlfusion.select_clause(groups[0]) == 'bytecountestimate() AS `output0`, count(*) AS `output1`'
+
+
+def test_keeps_accounts_apart_and_can_be_disabled():
+    other_account = dict(entry('b', 'count(*)'), account_id=2)
+    assert len(nrqlfusion.fuse([entry('a', 'count(*)'), other_account], 1)) == 2
+    assert len(nrqlfusion.fuse([entry('a', 'count(*)'), entry('b', 'max(x)')], 1, enabled=False)) == 2
@@ -0,0 +1,34 @@
+from library import nrqlwindows
+
+HOUR = nrqlwindows.HOUR_MS
+
+
+def test_splits_truncated_window():
+    planner = nrqlwindows.WindowPlanner(0, 4 * HOUR, 4 * HOUR, HOUR, 4 * HOUR, facet_limit=10)
+    window = planner.next_window()
+    assert window == (0, 4 * HOUR)
+    assert not planner.complete(window, 10)
+    assert planner.next_window() == (0, 2 * HOUR)
+    assert planner.next_window() == (2 * HOUR, 4 * HOUR)
+    assert not planner.has_next()
+
+
+def test_keeps_truncated_window_at_minimum_size():
+    planner = nrqlwindows.WindowPlanner(0, HOUR, HOUR, HOUR, HOUR, facet_limit=10)
+    assert planner.complete(planner.next_window(), 10)
+    assert not planner.has_next()
+
+
+def test_grows_after_small_results():
+    planner = nrqlwindows.WindowPlanner(0, 10 * HOUR, HOUR, HOUR, 4 * HOUR, facet_limit=100)
+    assert planner.complete(planner.next_window(), 1)
+    assert planner.next_window() == (HOUR, 3 * HOUR)
+
+
+def test_skips_covered_windows():
+    covered = nrqlwindows.non_overlapping([(HOUR, 2 * HOUR), (HOUR, 3 * HOUR), (3 * HOUR, 4 * HOUR)], 0, 4 * HOUR)
+    assert covered == [(HOUR, 2 * HOUR), (3 * HOUR, 4 * HOUR)]
+    planner = nrqlwindows.WindowPlanner(0, 4 * HOUR, 4 * HOUR, HOUR, 4 * HOUR, facet_limit=10, covered=covered)
+    assert planner.next_window() == (0, HOUR)
+    assert planner.next_window() == (2 * HOUR, 3 * HOUR)
+    assert not planner.has_next()
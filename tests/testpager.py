@@ -0,0 +1,29 @@
+from library.clients import pager
+
+PAGES = {None: (['a', 'b'], 'c1'), 'c1': (['c'], 'c2'), 'c2': (['d'], None)}
+
+
+def fetch(cursor):
+    items, next_cursor = PAGES[cursor]
+    return {'status': 200, 'response': {'items': items, 'nextCursor': next_cursor}}
+
+
+def extract(response):
+    return response['items'], response['nextCursor']
+
+
+def test_pages_until_no_cursor():
+    cursor_pager = pager.CursorPager(fetch, extract)
+    assert cursor_pager.all() == ['a', 'b', 'c', 'd']
+    assert cursor_pager.pages == 3
+    assert cursor_pager.error is None
+
+
+def test_stops_on_error():
+    def failing_fetch(cursor):
+        if cursor == 'c1':
+            return {'status': 200, 'error': [{'message': 'boom'}]}
+        return fetch(cursor)
+    cursor_pager = pager.CursorPager(failing_fetch, extract)
+    assert cursor_pager.all() == ['a', 'b']
+    assert cursor_pager.error[0]['message'] == 'boom'
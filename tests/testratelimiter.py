@@ -0,0 +1,84 @@
+import pytest
+import requests
+from library import ratelimiter
+
+
+def test_aimd_halves_on_throttle_and_grows_on_success():
+    limiter = ratelimiter.AimdLimiter(max_limit=8)
+    limiter.acquire()
+    limiter.release(ratelimiter.THROTTLED)
+    assert int(limiter.limit) == 4
+    for i in range(20):
+        limiter.acquire()
+        limiter.release(ratelimiter.OK)
+    assert 4 < limiter.limit <= 8
+
+
+def test_backoff_is_bounded():
+    for attempt in range(20):
+        assert 0 <= ratelimiter.backoff(attempt) <= ratelimiter.MAX_BACKOFF_SECONDS
+
+
+def test_token_bucket_allows_burst():
+    bucket = ratelimiter.TokenBucket(rate=1, capacity=5)
+    for i in range(5):
+        bucket.acquire()
+    assert bucket._tokens < 1
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def limiter_sending(monkeypatch, outcomes, max_retries=ratelimiter.DEFAULT_MAX_RETRIES):
+    delays = []
+    monkeypatch.setattr(ratelimiter.time, 'sleep', delays.append)
+    limiter = ratelimiter.RateLimiter(rate=1000, burst=1000, max_concurrency=4)
+    limiter.max_retries = max_retries
+    outcomes = iter(outcomes)
+
+    def send():
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return limiter, send, delays
+
+
+def test_call_retries_throttled_responses(monkeypatch):
+    throttled, ok = FakeResponse(429), FakeResponse(200)
+    limiter, send, delays = limiter_sending(monkeypatch, [throttled, ok])
+    assert limiter.call(send) is ok
+    assert throttled.closed and not ok.closed
+    assert len(delays) == 1
+
+
+def test_call_honours_retry_after(monkeypatch):
+    limiter, send, delays = limiter_sending(monkeypatch, [FakeResponse(429, {'Retry-After': '7'}), FakeResponse(200)])
+    limiter.call(send)
+    assert delays[0] >= 7
+
+
+def test_call_reraises_connection_errors_after_max_retries(monkeypatch):
+    error = requests.exceptions.ConnectionError('reset')
+    ok = FakeResponse(200)
+    limiter, send, delays = limiter_sending(monkeypatch, [error, ok], max_retries=2)
+    assert limiter.call(send) is ok
+    limiter, send, delays = limiter_sending(monkeypatch, [error, error, error], max_retries=2)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        limiter.call(send)
+    assert len(delays) == 2
+
+
+def test_call_returns_the_last_response_after_max_retries(monkeypatch):
+    responses = [FakeResponse(503) for attempt in range(3)]
+    limiter, send, delays = limiter_sending(monkeypatch, responses, max_retries=2)
+    assert limiter.call(send) is responses[-1]
+    assert [response.closed for response in responses] == [True, True, False]
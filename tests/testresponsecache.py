@@ -0,0 +1,63 @@
+import library.utils
+from library.clients import entityclient
+from library import responsecache
+from library.responsecache import ResponseCache
+
+
+def test_reads_through_until_refreshed(tmp_path):
+    ResponseCache.configure(file_name=str(tmp_path / 'cache.sqlite'))
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return {'status': 200, 'response': len(calls)}
+    assert responsecache.cached('permalink', 'key', ['guid'], loader)['response'] == 1
+    assert responsecache.cached('permalink', 'key', ['guid'], loader)['response'] == 1
+    assert responsecache.cached('permalink', 'other key', ['guid'], loader)['response'] == 2
+    ResponseCache.configure(refresh=True, file_name=str(tmp_path / 'cache.sqlite'))
+    assert responsecache.cached('permalink', 'key', ['guid'], loader)['response'] == 3
+    ResponseCache.configure(enabled=False)
+
+
+def test_skips_errors_and_expired_entries(tmp_path):
+    ResponseCache.configure(file_name=str(tmp_path / 'cache.sqlite'), ttls={'permalink': -1})
+    assert responsecache.cached('conditionDetails', 'key', [1], lambda: {'error': 'e'}) == {'error': 'e'}
+    assert responsecache.cached('conditionDetails', 'key', [1], lambda: {'response': 1}) == {'response': 1}
+    responsecache.cached('permalink', 'key', [1], lambda: 'a')
+    assert responsecache.cached('permalink', 'key', [1], lambda: 'b') == 'b'
+    ResponseCache.configure(enabled=False)
+
+
+def test_batch_only_loads_misses(tmp_path):
+    ResponseCache.configure(file_name=str(tmp_path / 'cache.sqlite'))
+    loaded = []
+
+    def loader(items):
+        loaded.extend(items)
+        return [{'response': item * 10} for item in items]
+    responsecache.cached_each('conditionDetails', 'key', [1], [1, 2], loader)
+    results = responsecache.cached_each('conditionDetails', 'key', [1], [2, 3, 1], loader)
+    assert [result['response'] for result in results] == [20, 30, 10]
+    assert loaded == [1, 2, 3]
+    ResponseCache.configure(enabled=False)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    for key in ['a', 'b', 'c']:
+        cache.put(key, 'permalink', key, 60)
+        cache.get('a')
+    cache.evict()
+    assert cache.get('a') == (True, 'a')
+    assert cache.get('b') == (False, None)
+    cache.close()
+
+
+def test_entities_not_found_are_not_cached(tmp_path):
+    ResponseCache.configure(file_name=str(tmp_path / 'cache.sqlite'))
+    responsecache.cached('appEntity', 'key', [1], lambda: {'entityFound': False}, entityclient.found_cacheable)
+    assert responsecache.cached('appEntity', 'key', [1], lambda: {'entityFound': True},
+                                entityclient.found_cacheable) == {'entityFound': True}
+    assert responsecache.cached('appEntity', 'key', [1], lambda: {'entityFound': False},
+                                entityclient.found_cacheable) == {'entityFound': True}
+    ResponseCache.configure(enabled=False)
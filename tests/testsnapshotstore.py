@@ -0,0 +1,52 @@
+import copy
+import sqlite3
+from library import snapshotstore
+from library.snapshotstore import SnapshotStore
+
+
+WIDGET = {'title': 'Throughput', 'rawConfiguration': {'nrqlQueries': [{'accountId': 1, 'query': 'SELECT 1'}]}}
+DASHBOARD = {'name': 'A', 'permissions': 'PUBLIC_READ_WRITE',
+             'pages': [{'name': 'Overview', 'widgets': [WIDGET, dict(WIDGET, title='Errors')]}]}
+
+
+def object_count(store):
+    store.connection.commit()
+    return sqlite3.connect(store.file_name).execute('SELECT COUNT(*) FROM objects').fetchone()[0]
+
+
+def test_unchanged_objects_are_not_recorded(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    assert store.save(snapshotstore.DASHBOARD, '1/a', DASHBOARD)
+    reordered = {'pages': copy.deepcopy(DASHBOARD['pages']), 'permissions': 'PUBLIC_READ_WRITE', 'name': 'A'}
+    assert not store.save(snapshotstore.DASHBOARD, '1/a', reordered)
+    assert store.load(snapshotstore.DASHBOARD, '1/a') == DASHBOARD
+    store.close()
+
+
+def test_pages_and_widgets_are_shared(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    store.save(snapshotstore.DASHBOARD, '1/a', DASHBOARD)
+    objects = object_count(store)
+    assert objects == 4
+    store.save(snapshotstore.DASHBOARD, '1/b', dict(DASHBOARD, name='B'))
+    assert object_count(store) == objects + 1
+    store.close()
+
+
+def test_changes_since(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    store.save(snapshotstore.DASHBOARD, '1/a', DASHBOARD)
+    store.save(snapshotstore.DASHBOARD, '1/b', DASHBOARD)
+    store.save(snapshotstore.CONDITION, '1/7', {'name': 'c'})
+    since = store.changes_since(0)[-1]['recordedAt']
+    first = store.load(snapshotstore.DASHBOARD, '1/a')
+    changed = copy.deepcopy(DASHBOARD)
+    changed['pages'][0]['widgets'][0]['title'] = 'Latency'
+    store.save(snapshotstore.DASHBOARD, '1/a', changed)
+    assert store.mark_deleted(snapshotstore.DASHBOARD, ['1/a'], '1/') == ['1/b']
+    store.save(snapshotstore.DASHBOARD, '1/c', DASHBOARD)
+    assert [(change['key'], change['change']) for change in store.changes_since(since)] == [
+        ('1/a', snapshotstore.MODIFIED), ('1/b', snapshotstore.DELETED), ('1/c', snapshotstore.ADDED)]
+    assert store.load(snapshotstore.DASHBOARD, '1/a', since) == first
+    assert store.load(snapshotstore.DASHBOARD, '1/b') is None
+    store.close()
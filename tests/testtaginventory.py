@@ -0,0 +1,29 @@
+import sqlite3
+from library import taginventory
+
+
+ENTITIES = [{'guid': '1', 'tags': [{'key': 'env', 'values': ['prod']}, {'key': 'host', 'values': ['h1']}]},
+            {'guid': '2', 'tags': [{'key': 'env', 'values': ['prod']}, {'key': 'host', 'values': ['h2']}]},
+            {'guid': '3', 'tags': [{'key': 'env', 'values': ['dev', 'dev']}]},
+            {'guid': '4'}]
+
+
+def test_counts_keys_and_values():
+    inventory = taginventory.TagInventory()
+    inventory.add(ENTITIES[:2])
+    inventory.add(ENTITIES[2:])
+    assert inventory.entities == 4
+    assert inventory.key_rows() == [{'key': 'env', 'entities': 3, 'distinctValues': 2},
+                                    {'key': 'host', 'entities': 2, 'distinctValues': 2}]
+    assert inventory.value_rows()[:2] == [{'key': 'env', 'value': 'prod', 'entities': 2},
+                                          {'key': 'env', 'value': 'dev', 'entities': 1}]
+
+
+def test_save_sqlite(tmp_path):
+    inventory = taginventory.TagInventory()
+    inventory.add(ENTITIES)
+    inventory.save(str(tmp_path / 'tags'), taginventory.SQLITE)
+    connection = sqlite3.connect(str(tmp_path / 'tags.sqlite'))
+    assert connection.execute('SELECT entities FROM tag_values WHERE key = ? AND value = ?',
+                              ('host', 'h2')).fetchone() == (1,)
+    connection.close()
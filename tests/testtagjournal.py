@@ -0,0 +1,82 @@
+from library import tagjournal, tagmutations
+
+
+def plans(guids):
+    return [tagmutations.plan({'guid': guid, 'name': 'n' + guid},
+                              [tagmutations.mutation(tagmutations.ADD, ['owner:b'])]) for guid in guids]
+
+
+def outcome(guid, status):
+    return {'guid': guid, 'name': 'n' + guid, 'status': status,
+            'errors': [{'message': 'denied'}] if status == tagmutations.FAILED else []}
+
+
+def test_resumes_the_pending_and_failed_entities(tmp_path):
+    file_name = str(tmp_path / 'journal.jsonl')
+    journal = tagjournal.TagJournal(file_name)
+    assert journal.plans is None
+    journal.start(plans(['1', '2', '3']))
+    journal.record(outcome('1', tagmutations.DONE))
+    journal.record(outcome('2', tagmutations.FAILED))
+    journal.journal.write('{"event": "do')
+    journal.journal.close()
+
+    resumed = tagjournal.TagJournal(file_name)
+    assert [entity_plan['entity']['guid'] for entity_plan in resumed.pending()] == ['2', '3']
+    assert [entity_plan['entity']['guid'] for entity_plan in resumed.failed()] == ['2']
+    resumed.record(outcome('2', tagmutations.DONE))
+    resumed.record(outcome('3', tagmutations.FAILED))
+    assert [entity_plan['entity']['guid'] for entity_plan in resumed.finish()] == ['3']
+
+    resumed = tagjournal.TagJournal(file_name)
+    assert resumed.done_count() == 2
+    resumed.record(outcome('3', tagmutations.DONE))
+    assert resumed.finish() == []
+    assert not (tmp_path / 'journal.jsonl').exists()
+
+
+def test_interrupted_planning_starts_over(tmp_path):
+    file_name = str(tmp_path / 'journal.jsonl')
+    with open(file_name, 'w') as journal:
+        journal.write('{"event": "planned", "plan": {"entity": {"guid": "1"}, "mutations": []}}\n')
+    journal = tagjournal.TagJournal(file_name)
+    assert journal.plans is None
+    assert journal.finish() == []
+
+
+def test_expired_journal_is_planned_again(tmp_path):
+    file_name = str(tmp_path / 'journal.jsonl')
+    journal = tagjournal.TagJournal(file_name)
+    journal.start(plans(['1', '2']))
+    journal.record(outcome('1', tagmutations.FAILED))
+    journal.journal.close()
+    assert tagjournal.TagJournal(file_name, max_age_hours=1).plans is not None
+    expired = tagjournal.TagJournal(file_name, max_age_hours=0)
+    assert expired.plans is None
+    assert expired.failed() == []
+    expired.finish()
+
+
+def test_unread_entity_stays_in_the_retry_queue(tmp_path):
+    file_name = str(tmp_path / 'journal.jsonl')
+    journal = tagjournal.TagJournal(file_name)
+    unread = tagmutations.plan({'guid': '1', 'name': 'n1'}, None)
+    journal.start([unread])
+    journal.record(tagmutations.unread_outcome(unread))
+    journal.journal.close()
+
+    resumed = tagjournal.TagJournal(file_name)
+    assert resumed.failed() == [unread]
+    resumed.update(plans(['1'])[0])
+    resumed.record(outcome('1', tagmutations.FAILED))
+    assert resumed.finish() == plans(['1'])
+    assert tagjournal.TagJournal(file_name).failed() == plans(['1'])
+
+
+def test_journal_file_depends_on_the_operation_and_api_key():
+    operation = ['update_tags', ['owner:a'], ['owner:b']]
+    assert tagjournal.journal_file(operation, 'key') == tagjournal.journal_file(operation, 'key')
+    assert tagjournal.journal_file(operation, 'key') != \
+        tagjournal.journal_file(['update_tags', ['owner:a'], ['owner:c']], 'key')
+    assert tagjournal.journal_file(operation, 'key') != tagjournal.journal_file(operation, 'other key')
+    assert 'key' not in tagjournal.journal_file(operation, 'key')
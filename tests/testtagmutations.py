@@ -0,0 +1,77 @@
+from library import tagmutations
+
+
+class FakeAsyncEntityClient:
+
+    def __init__(self, failing_guids=()):
+        self.calls = []
+        self.failing_guids = failing_guids
+
+    async def gql_mutate_delete_tag_values_batch(self, per_api_key, guids_and_tags):
+        return self._results(tagmutations.DELETE_VALUES, guids_and_tags)
+
+    async def gql_mutate_add_tags_batch(self, per_api_key, guids_and_tags):
+        return self._results(tagmutations.ADD, guids_and_tags)
+
+    def _results(self, action, guids_and_tags):
+        self.calls.append((action, [guid for guid, tags in guids_and_tags]))
+        return [{'status': 200, 'response': {'errors': [{'message': 'denied'}] if guid in self.failing_guids else []}}
+                for guid, tags in guids_and_tags]
+
+
+def retag_plans(guids):
+    return [tagmutations.plan({'guid': guid, 'name': 'n' + guid},
+                              [tagmutations.mutation(tagmutations.DELETE_VALUES, ['owner:a']),
+                               tagmutations.mutation(tagmutations.ADD, ['owner:b'])]) for guid in guids]
+
+
+def test_batches_each_step_and_reports_outcomes():
+    aec = FakeAsyncEntityClient(failing_guids=('2',))
+    completed = []
+    pipeline = tagmutations.TagMutationPipeline(aec, 'key', batch_size=3, on_outcome=completed.append)
+    outcomes = pipeline.run(retag_plans(['1', '2', '3', '4']))
+    assert sorted(aec.calls) == [(tagmutations.ADD, ['1', '3']), (tagmutations.ADD, ['4']),
+                                 (tagmutations.DELETE_VALUES, ['1', '2', '3']), (tagmutations.DELETE_VALUES, ['4'])]
+    assert [outcome['status'] for outcome in outcomes] == ['done', 'failed', 'done', 'done']
+    assert outcomes[1]['errors'] == [{'message': 'denied'}]
+    assert len(completed) == 4
+
+
+def test_failed_request_fails_the_whole_batch():
+    class FailingClient(FakeAsyncEntityClient):
+        async def gql_mutate_delete_tag_values_batch(self, per_api_key, guids_and_tags):
+            return {'status': 500, 'error': [{'message': 'boom'}]}
+
+    outcomes = tagmutations.TagMutationPipeline(FailingClient(), 'key').run(retag_plans(['1', '2']))
+    assert all(outcome['errors'] == [{'message': 'boom'}] for outcome in outcomes)
+
+
+def test_retag_mutations_is_the_minimal_diff():
+    tags = [{'key': 'owner', 'values': ['a', 'c']}, {'key': 'team', 'values': ['x']}]
+    assert tagmutations.retag_mutations(tags, ['owner:a'], ['owner:b']) == [
+        tagmutations.mutation(tagmutations.DELETE_VALUES, ['owner:a']),
+        tagmutations.mutation(tagmutations.ADD, ['owner:b'])]
+    assert tagmutations.retag_mutations(tags, ['owner:z'], ['owner:c', 'team:x']) == []
+    assert tagmutations.retag_mutations(tags, ['owner:c'], ['owner:c']) == []
+    assert tagmutations.retag_mutations(None, ['owner:a'], ['owner:b']) == [
+        tagmutations.mutation(tagmutations.ADD, ['owner:b'])]
+
+
+def test_immutable_tag_values():
+    immutable_values = tagmutations.ImmutableTagValues()
+    immutable_values.learn([{'key': 'hostname', 'values': [{'mutable': False, 'value': 'h1'}]},
+                            {'key': 'owner', 'values': [{'mutable': True, 'value': 'a'}]}])
+    assert not immutable_values.may_be_mutable([{'key': 'hostname', 'values': ['h1']}])
+    assert immutable_values.may_be_mutable([{'key': 'hostname', 'values': ['h1']}, {'key': 'owner', 'values': ['a']}])
+    assert immutable_values.may_be_mutable(None)
+    immutable_values.learn([{'key': 'hostname', 'values': [{'mutable': True, 'value': 'h1'}]}])
+    assert immutable_values.may_be_mutable([{'key': 'hostname', 'values': ['h1']}])
+
+
+def test_plan_rows():
+    plans = retag_plans(['1']) + [tagmutations.plan({'guid': '2', 'name': 'n2'}, []),
+                                  tagmutations.plan({'guid': '3', 'name': 'n3'}, None)]
+    assert tagmutations.plan_rows(plans) == [
+        {'guid': '1', 'name': 'n1', 'action': tagmutations.DELETE_VALUES, 'tags': 'owner:a'},
+        {'guid': '1', 'name': 'n1', 'action': tagmutations.ADD, 'tags': 'owner:b'},
+        {'guid': '3', 'name': 'n3', 'action': tagmutations.UNREAD, 'tags': ''}]